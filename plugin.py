@@ -27,6 +27,72 @@
 #   * handle multiplier for kWh and P1 devices
 # version 1.0.7
 #   * adapted the validation limit for P1 meter
+# version 1.0.8
+#   * probe the battery at startup and only create devices for the fields it really reports (e.g. PV3/PV4 or EM phases)
+#   * the probe result is cached per device model and firmware version in capabilities.json in the plugin folder
+#   * devices for fields that appear later are created when the first value is received
+# version 1.0.9
+#   * optional OpenMetrics (Prometheus) exporter for all battery values and the UDP client statistics, see plugin_config.json
+# version 1.0.10
+#   * devices for the communication statistics of each data cycle: success rate, p95 round trip time and cycle time
+# version 1.0.11
+#   * the timeout of each request is derived from the measured round trip times (between timeout_min and timeout_max in plugin_config.json)
+#     instead of a fixed 5 seconds, so a lost packet is detected and retried much sooner
+# version 1.0.12
+#   * optional shared UDP socket for all requests (shared_socket in plugin_config.json)
+# version 1.0.13
+#   * each data cycle has a deadline (default half the heartbeat interval), retries stop at the deadline and the data received is processed.
+#     Commands without data are done first in the next cycle, after EM status which is always retrieved first.
+# version 1.0.14
+#   * optional recording of all requests and replies (capture_file in plugin_config.json), to be replayed without a battery
+# version 1.0.15
+#   * outlier filter (rolling median/MAD) on all power, temperature, percentage, voltage and current values, replacing the fixed
+#     -20000..20000 W check of the kWh devices. Limits and sensitivity per device type in OUTLIERDEFAULTS, per field in plugin_config.json
+# version 1.0.16
+#   * the lifetime energy counters are tracked (state in counters.json): a counter reset, wraparound or change of scale after a firmware
+#     restart/update no longer causes a jump in the energy dashboard, the counter devices and P1 meter continue from their last total
+# version 1.0.17
+#   * optional grid analytics of the EM values (phase_analytics in plugin_config.json): 1, 5 and 15 minute average grid power,
+#     quarter-hour peak demand of the month (for capacity tariffs), phase imbalance and import/export energy
+# version 1.0.18
+#   * optional schedule optimiser (tariff_file in plugin_config.json): plans charging/discharging against the prices and the
+#     household load profile, and sends the plan as manual mode periods while the battery is in manual mode
+# version 1.0.19
+#   * optional fleet dispatcher (fleet in plugin_config.json): one "Fleet power target" setpoint device that is split over this
+#     battery and the other batteries listed, by SOC, temperature and charge/discharge permission, sent to all batteries at once
+# version 1.0.20
+#   * warm restart: the last values, round trip time estimate, probed fields and failure state are saved in state.json at stop and
+#     every 5 minutes, and loaded at start, so the devices show their values at once and the first poll uses the learned timeouts
+#   * the P1 meter is created with an initial value (no more "Invalid Number sValue" errors before the first data cycle)
+# version 1.0.21
+#   * the five status commands of a data cycle (and of the capability probe) are sent at the same time, the cycle takes about one
+#     round trip instead of five. Commands without data are retried until the cycle deadline and all are requested again at the
+#     start of the next cycle, the list of missed commands is no longer kept in state.json. Requires the new venus_api_v2.py
+# version 1.0.22
+#   * request pacing per battery (pacing in plugin_config.json, default on): the rate of requests and the number of requests in
+#     flight are not limited until a request is lost, then halved after each loss and raised step by step while no request is
+#     lost, so the firmware no longer drops requests that arrive too close together. The learned limits are kept in state.json
+# version 1.0.23
+#   * Wi-Fi link monitor (wifi_interval in plugin_config.json, default every 5 minutes): devices for the Wi-Fi signal, the share of
+#     lost requests and a link diagnosis that tells a weak signal from a battery that does not answer (Open API off). On a weak link
+#     the battery, PV and ES status are requested less often and the interval is stretched, EM status and mode keep priority
+# version 1.0.24
+#   * deadbands (deadband in plugin_config.json, default on): a device is only updated when its value changed more than the deadband
+#     of its type (5 W, 1 %, 0.5 C, ...) or when it was not updated for max_silence seconds, so fast polling no longer floods the
+#     Domoticz database and the scripts triggered by the devices. Deadbands per field in deadband_settings
+# version 1.0.25
+#   * the email notifications are sent by a background thread over one keep-alive connection with timeouts (venus_writer.py),
+#     a slow Domoticz web server no longer blocks the heartbeat. Address and login in domoticz_url, domoticz_username, domoticz_password
+# version 1.0.26
+#   * the device list moved from the DEVSLIST dictionary in plugin.py to devices.json (venus_mapping.py), with named settings per field.
+#     Multipliers, names and expressions that correct a value (e.g. "-value" to flip a sign) can be changed per field with
+#     device_overrides in plugin_config.json, firmware quirks per battery model and firmware version in devices.json
+# version 1.0.27
+#   * burst polling (burst in plugin_config.json, default on): after a mode change or a step of 500 W or more in the grid or
+#     on-grid power, EM status, mode and ES status are polled every 2 seconds for 30 seconds, then the interval grows back to
+#     the polling interval and a complete data cycle follows. A new mode is confirmed within seconds, also with long intervals.
+#     Only steps between samples at most 30 seconds apart count, a burst lasts at most burst_max_duration and a complete data
+#     cycle still runs once per polling interval during a burst
 #
 # This plugin re-uses the UDP API library developed by Ivan Kablar for his MQTT bridge (https://github.com/IvanKablar/marstek-venus-bridge)
 # The library was extended to cover all elements from the specification and was made more responsive and reliable.
@@ -125,84 +191,125 @@
 
 
 import DomoticzEx as Domoticz
-import json,requests   # make sure these are available in your system environment
+import json
+import os
 import time
 from datetime import datetime
-from requests.exceptions import Timeout
-
-from venus_api_v2 import VenusAPIClient
-
-
-# A dictionary to list all parameters that can be retrieved from Marstek and to define the Domoticz devices to hold them.
-# currently only english names are provided, can be extended with other languages later
-
-# Dictionary structure is as follows: Property (from API spec) : [ Unit, Type, Subtype, Switchtype, OptionsList{}, Multiplier, Name, Source ],
-
-DEVSLIST={
-# response Bat.GetStatus
-    "soc"             : [1,  243,  6, 0, {}, 1   ,"Battery SOC","BAT"], # duplicate ? (soc, bat_soc)
-    "charg_flag"      : [2,  244, 73, 0, {}, 1   ,"Charge permission","BAT"],
-    "dischrg_flag"    : [3,  244, 73, 0, {}, 1   ,"Discharge permission","BAT"],
-    "bat_temp"        : [4,   80,  5, 0, {}, 1   ,"Battery temperature","BAT"],
-    "bat_capacity"    : [5,  113,  0, 0, {}, 1   ,"Remaining Capacity","BAT"],
-    "rated_capacity"  : [6,  113,  0, 0, {}, 1   ,"Rated Capacity","BAT"],
-# response PV.GetStatus
-    "pv1_power"       : [7,  243, 29, 0, {'EnergyMeterMode': '1'}, 0.1   ,"PV1 power","PV"], # 4 groups, although not in specification ver. 1.0
-    "pv1_voltage"     : [8,  243,  8, 0, {}, 1   ,"PV1 voltage","PV"],
-    "pv1_current"     : [9,  243, 23, 0, {}, 1   ,"PV1 current","PV"],
-    "pv1_state"       : [10, 244, 73, 0, {}, 1   ,"PV1 state","PV"], # pv_state not in specification ver. 1.0
-    "pv2_power"       : [11, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"PV2 power","PV"],
-    "pv2_voltage"     : [12, 243,  8, 0, {}, 1   ,"PV2 voltage","PV"],
-    "pv2_current"     : [13, 243, 23, 0, {}, 1   ,"PV2 current","PV"],
-    "pv2_state"       : [14, 244, 73, 0, {}, 1   ,"PV2 state","PV"],
-    "pv3_power"       : [15, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"PV3 power","PV"],
-    "pv3_voltage"     : [16, 243,  8, 0, {}, 1   ,"PV3 voltage","PV"],
-    "pv3_current"     : [17, 243, 23, 0, {}, 1   ,"PV3 current","PV"],
-    "pv3_state"       : [18, 244, 73, 0, {}, 1   ,"PV3 state","PV"],
-    "pv4_power"       : [19, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"PV4 power","PV"],
-    "pv4_voltage"     : [20, 243,  8, 0, {}, 1   ,"PV4 voltage","PV"],
-    "pv4_current"     : [21, 243, 23, 0, {}, 1   ,"PV4 current","PV"],
-    "pv4_state"       : [22, 244, 73, 0, {}, 1   ,"PV4 state","PV"],
-# response ES.GetMode
-    "mode"            : [23, 243, 19, 0, {}, 1   ,"ESM mode","ESM"],
-    "ongrid_power"    : [24, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"ESM on-grid power","ESM"], # duplicate ?
-    "offgrid_power"   : [25, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"ESM off-grid power","ESM"], # duplicate ?
-    "bat_soc"         : [26, 243,  6, 0, {}, 1   ,"ESM Battery Soc","ESM"], # duplicate ?
-# note in case of auto or AI mode the response of Es.GetMode also includes EM.GetStatus data
-# reponse ES.GetStatus
-    "es_bat_soc"      : [27, 243,  6, 0, {}, 1   ,"ESS Total SOC","ESS"],  # duplicate ? note es_ added to name to create unique key
-    "bat_cap"         : [28, 113,  0, 0, {}, 1   ,"ESS Rated capacity","ESS"], # duplicate value but still unique name (other is bat_capacity)
-    "pv_power"        : [29, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"ESS PV charging power","ESS"],
-    "es_ongrid_power" : [30, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"ESS on-grid power","ESS"], # duplicate ? note es_ added to name to create unique key
-    "es_offgrid_power": [31, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"ESS off-grid power","ESS"], # duplicate ? note es_ added to name to create unique key
-#    "bat_power"      : "ES battery power W"], # not present in ES.getStatus response, although in specification ver 1.0
-    "total_pv_energy"          : [32, 113,  0, 0, {}, 1   ,"ESS PV energy generated","ESS"],
-    "total_grid_output_energy" : [33, 113,  0, 0, {}, 1   ,"ESS Battery output energy","ESS"],
-    "total_grid_input_energy"  : [34, 113,  0, 0, {}, 1   ,"ESS Battery input energy","ESS"],
-    "total_load_energy"        : [35, 113,  0, 0, {}, 1   ,"ESS Off-grid energy used","ESS"],
-# response EM.GetStatus
-    "ct_state"        : [36, 244, 73, 0, {}, 1,  "P1 CT state","EMS"],
-    "a_power"         : [37, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"P1 Phase A power","EMS"],
-    "b_power"         : [38, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"P1 Phase B power","EMS"],
-    "c_power"         : [39, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"P1 Phase C power","EMS"],
-    "total_power"     : [40, 243, 29, 0, {'EnergyMeterMode': '1'}, 1   ,"P1 A+B+C power","EMS"], # 3 devices can be disabled. A P1 meter device (51) has been added to hold all 3.
-    "input_energy"    : [41, 113,  0, 0, {}, 0.1 ,"P1 input from grid","EMS"], # in response, although not in specification ver 1.0
-    "output_energy"   : [42, 113,  0, 0, {}, 0.1 ,"P1 output to grid","EMS"], # in response, although not in specification ver 1.0
-# device for holding one single manual mode setting
-    "time_period"     : [43, 243, 19, 0, {}, 1   ,"Manual Mode periodnr","MM"],
-    "start_time"      : [44, 243, 19, 0, {}, 1   ,"Manual Mode starttime","MM"],
-    "end_time"        : [45, 243, 19, 0, {}, 1   ,"Manual Mode endtime","MM"],
-    "week_set"        : [46, 243, 19, 0, {}, 1   ,"Manual Mode weekdays","MM"],
-    "mm_power"        : [47, 248,  1, 0, {}, 1   ,"Manual Mode power","MM"], # note mm_ added to create unique key
-# device for holding passive mode power and countdown
-# removed in version 1.0.3 because it was determined that these fields do not have an effect
-#    "pm_power"        : [48, 248,  1, 0, {}, 1   ,"Passive Mode power","PM"], # note pm_ added to create unique key
-#    "countdown"       : [49, 243, 19, 0, {}, 1   ,"Passive Mode countdown s","PM"],
-# device to activate mode switch
-# do not change name, used on onCommand code below
-    "select Marstek mode"     : [50, 244, 62, 18, {"LevelActions":"|||||","LevelNames":"|AutoSelf|AI|Manual|Passive|UPS","LevelOffHidden":"true","SelectorStyle":"0"}, 1 ,"Select Marstek mode","SM"],
-    "P1 meter"   : [51, 250,  1, 0, {}, 1 ,"P1 meter","EMS"], # new P1 device to hold EMS total_power, input_energy and output_energy
-} # end of dictionary
+
+from venus_api_v2 import VenusAPIClient, TrafficCapture, CLI_METHODS, get_multiplexer, close_multiplexer, get_pacer
+from venus_exporter import MetricsExporter
+from venus_filters import OutlierFilter, DeadbandFilter
+from venus_counters import CounterBank
+from venus_analytics import PhaseAnalytics, LoadProfile
+from venus_optimiser import ScheduleOptimiser, load_tariff, tariff_slots, manual_config, SLOT
+from venus_dispatch import FleetDispatcher
+from venus_link import LinkMonitor
+from venus_burst import BurstSchedule, BURST_METHODS
+from venus_mapping import load_devices, compile_mapping
+from venus_writer import DomoticzWriter   # needs the requests package, make sure it is available in your system environment
+
+
+# The fields that can be retrieved from Marstek and the Domoticz devices to hold them are listed in devices.json,
+# one entry per field with named settings: unit, type, subtype, switchtype, options, multiplier, name, source and
+# an optional expression that corrects the value received. Firmware quirks in devices.json and the device_overrides
+# in plugin_config.json change these settings without editing code, see venus_mapping.py.
+# A devices.json in the plugin home folder is used before the one next to plugin.py.
+DEVICEFILE="devices.json"
+# Field name : DeviceField, compiled from DEVICEFILE in onStart
+DEVSLIST={}
+
+# Data retrieval commands in order of importance, Source : VenusAPIClient method
+DATASOURCES={"EMS":"get_em_status","ESM":"get_mode","ESS":"get_energy_status","BAT":"get_battery_status","PV":"get_pv_status"}
+# Sources for which the devices are only created when the battery reports the fields (see probeCapabilities)
+PROBEDSOURCES=tuple(DATASOURCES)
+# API method of each data source, all requested at the same time in one snapshot. Source : API method
+SOURCEMETHODS={source:method for source in DATASOURCES for method,getter in CLI_METHODS.values() if getter==DATASOURCES[source]}
+# Sources calculated by the plugin, only created when the plugin_config.json setting is true. Source : setting
+OPTIONALSOURCES={"EMA":"phase_analytics","FLT":"fleet","LINK":"wifi_interval"}
+# File in the plugin home folder holding the probed fields per device model and firmware version
+CAPABILITYCACHE="capabilities.json"
+# Longest wait in seconds between two requests of the battery model when it was not reported at start
+DEVICEINFOMAXWAIT=3600
+
+# Outlier filter settings per device Type/Subtype, values are in device units (after the multiplier).
+# lower/upper limit: values outside are always rejected. min_deviation: deviation from the recent median that is always accepted.
+OUTLIERDEFAULTS={
+    (243,29) : {"min_deviation":3000, "low":-20000, "high":20000}, # power (W), the limits keep out the "655xx" values
+    (80,5)   : {"min_deviation":10,   "low":-40,    "high":100},   # temperature (C)
+    (243,6)  : {"min_deviation":25,   "low":0,      "high":100},   # percentage
+    (243,8)  : {"min_deviation":50,   "low":0,      "high":1000},  # voltage (V)
+    (243,23) : {"min_deviation":20,   "low":-100,   "high":100},   # current (A)
+}
+
+# Deadbands per device type (Type,Subtype): a device is updated when the value changed more than
+# max(absolute, relative * last value), or after max_silence seconds. Other types are updated when the value changed.
+DEADBANDDEFAULTS={
+    (243,29) : {"absolute":5},        # power (W)
+    (250,1)  : {"absolute":5},        # P1 meter, on its total power (W)
+    (248,1)  : {"absolute":5},        # power (W)
+    (80,5)   : {"absolute":0.5},      # temperature (C)
+    (243,6)  : {"absolute":1},        # percentage
+    (243,8)  : {"absolute":1},        # voltage (V)
+    (243,23) : {"absolute":0.1},      # current (A)
+    (243,31) : {"relative":0.02},     # custom sensors (averages, round trip times, signal)
+}
+
+# Cumulative energy counters of the battery, tracked for resets, wraparound and changes of scale (see venus_counters.py)
+COUNTERFIELDS=("total_pv_energy","total_grid_output_energy","total_grid_input_energy","total_load_energy","input_energy","output_energy")
+# File in the plugin home folder holding the state of the counters
+COUNTERSTATE="counters.json"
+# File in the plugin home folder holding the peak demand and import/export energy of the grid analytics
+ANALYTICSSTATE="analytics.json"
+# File in the plugin home folder holding the household load profile used by the schedule optimiser
+LOADPROFILE="loadprofile.json"
+# File in the plugin home folder holding the state of the plugin for a warm restart
+STATEFILE="state.json"
+STATEVERSION=1
+
+# Optional file in the plugin home folder with settings that do not fit in the Domoticz hardware parameters.
+# Only the settings to be changed need to be present, see CONFIGDEFAULTS for the possible settings and defaults.
+CONFIGFILE="plugin_config.json"
+CONFIGDEFAULTS={
+    "exporter_port"    : 0,           # TCP port of the OpenMetrics /metrics endpoint, 0 = exporter off
+    "exporter_address" : "127.0.0.1", # listen address of the exporter, use 0.0.0.0 to allow scrapes from other hosts
+    "timeout_max"      : 5,           # seconds, timeout before the first reply and ceiling of the adaptive timeout
+    "timeout_min"      : 0.3,         # seconds, floor of the timeout derived from the measured round trip times
+    "cycle_deadline"   : 0.5,         # fraction of the heartbeat interval after which a data cycle stops, missing data is requested again next cycle
+    "shared_socket"    : False,       # true = all requests go over one UDP socket with a receive thread, instead of a new socket per request
+    "pacing"           : True,        # limit the request rate and the requests in flight per battery, learned from the lost requests
+    "pacing_max_rate"  : 20,          # requests per second, the highest rate the pacing tries
+    "outlier_filter"   : True,        # false = only reject values outside the hard limits of OUTLIERDEFAULTS
+    "outlier_settings" : {},          # per field changes of OUTLIERDEFAULTS, e.g. {"pv1_power": {"min_deviation": 1500}}, null = no filter for that field
+    "deadband"         : True,        # false = update the devices with every value received
+    "deadband_settings": {},          # per field changes of DEADBANDDEFAULTS, e.g. {"total_power": {"absolute": 20}}, null = update on any change
+    "max_silence"      : 300,         # seconds after which a device is updated even when its value did not change
+    "capture_file"     : "",          # file name in the plugin folder to record all requests and replies in, for replay (python -m venus_api_v2 replay)
+    "phase_analytics"  : False,       # true = grid analytics of the EMS values (averages, peak demand, phase imbalance, import/export energy)
+    "tariff_file"      : "",          # price file in the plugin folder, CSV start,import_price[,export_price] or JSON. "" = no schedule optimiser
+    "optimiser_interval" : 900,       # seconds between plans, a changed price file is planned at the next cycle
+    "optimiser_hours"  : 24,          # planning horizon in hours (also limited by the prices known)
+    "optimiser_min_soc": 10,          # lowest state of charge in % the plan may use
+    "optimiser_efficiency" : 0.95,    # efficiency of charging, and of discharging
+    "optimiser_charge_power" : 1200,  # maximum charging power in W (discharging is limited by the Max output power setting)
+    "fleet"            : [],          # other batteries as "ip" or "ip:port", together with this one they follow the Fleet power target device
+    "fleet_max_charge" : 1200,        # maximum charging power in W of each battery of the fleet
+    "fleet_max_discharge" : 800,      # maximum discharging power in W of the other batteries (this one: Max output power setting)
+    "fleet_deadband"   : 50,          # W, a new share is only sent to a battery when it changed more than this
+    "state_interval"   : 300,         # seconds between saves of state.json (also saved at stop)
+    "state_max_age"    : 3600,        # seconds, older saved values are not loaded onto the devices at start
+    "wifi_interval"    : 300,         # seconds between Wi-Fi status requests of the link monitor, 0 = no link monitor
+    "link_adapt"       : True,        # on a weak link request BAT, PV and ES status less often and stretch the interval
+    "device_overrides" : {},          # per field changes of devices.json, e.g. {"pv1_power": {"multiplier": 1}, "ongrid_power": {"expression": "-value"}}
+    "burst"            : True,        # poll mode and power flows fast after a mode change or a large power step
+    "burst_interval"   : 2,           # seconds between the burst polls
+    "burst_hold"       : 30,          # seconds of fast polling after the last mode change or step
+    "burst_decay"      : 1.5,         # after the hold time the interval grows by this factor per poll, back to the polling interval
+    "burst_step"       : 500,         # W, a change of grid or on-grid power between two samples that starts a burst
+    "burst_max_duration": 300,        # seconds, a burst ends after this time also when the power keeps stepping
+    "domoticz_url"     : "http://127.0.0.1:8080", # Domoticz web server for the notifications (JSON API)
+    "domoticz_username": "",          # only needed when the Domoticz JSON API asks for a login from this address
+    "domoticz_password": "",
+}
 
 class MarstekPlugin:
     enabled = False
@@ -222,6 +329,7 @@ class MarstekPlugin:
         else:
             Domoticz.Heartbeat(30)
             self.heartbeatWaits=int(int(Parameters["Mode1"])/30 - 1)
+        self.heartbeat=min(30,int(Parameters["Mode1"])) # changed while burst polling
         self.notificationsOn=(Parameters["Mode2"]=="Yes")
         self.emailAlertSent=False
         self.failedCycleCount=0
@@ -232,32 +340,361 @@ class MarstekPlugin:
         self.heartbeatCounter=0
         self.stillbusy=False
         self.Hwid=Parameters['HardwareID']
-        # cycle through device list and create any non-existing devices when the plugin/domoticz is started
+        self.homeFolder=str(Parameters.get("HomeFolder",""))
+        self.config=self.loadConfig()
+        # notifications go through the Domoticz JSON API, sent by a background thread so the heartbeat never waits for the web server
+        self.writer=None
+        if self.notificationsOn:
+            self.writer=DomoticzWriter(self.config["domoticz_url"], self.config["domoticz_username"] or None, self.config["domoticz_password"])
+            self.writer.start()
+        # one client for the lifetime of the plugin, so the request statistics are kept between cycles
+        multiplexer=get_multiplexer() if self.config["shared_socket"] else None
+        capture=None
+        if self.config["capture_file"]:
+            Domoticz.Log("Recording all requests and replies in "+self.config["capture_file"])
+            capture=TrafficCapture(self.homeFolder+self.config["capture_file"])
+        pacer=get_pacer(self.IPAddress, self.Port, max_rate=float(self.config["pacing_max_rate"])) if self.config["pacing"] else None
+        self.client=VenusAPIClient(ip=self.IPAddress, port=self.Port, timeout=float(self.config["timeout_max"]), min_timeout=float(self.config["timeout_min"]), multiplexer=multiplexer, capture=capture, pacer=pacer)
+        self.cycleDeadline=float(self.config["cycle_deadline"])*min(30,int(Parameters["Mode1"]))
+        # model and firmware version, for the firmware quirks of devices.json and the probe; retried later when not known
+        self.deviceInfo=self.client.get_devices("0",deadline=time.monotonic()+self.deviceInfoDeadline())
+        self.deviceInfoFailures=0
+        self.deviceInfoNext=time.monotonic()
+        self.loadDevices()
+        self.lastStats=None
+        self.outlierFilter=self.createOutlierFilter()
+        self.deadband=self.createDeadbandFilter()
+        self.saveTotalPower=0
+        # the counters are kept in device units, so the multiplier of the device is the scale of the counter;
+        # a total saved with another multiplier is converted
+        self.counters=CounterBank({Dev:{"scale":DEVSLIST[Dev].multiplier} for Dev in COUNTERFIELDS}, self.homeFolder+COUNTERSTATE)
+        self.analytics=None
+        self.lastValues={} # last accepted value of each field
+        if self.config["phase_analytics"]:
+            self.analytics=PhaseAnalytics()
+            try:
+                with open(self.homeFolder+ANALYTICSSTATE) as f:
+                    self.analytics.restore(json.load(f))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                Domoticz.Error("Could not read "+ANALYTICSSTATE+", peak demand and grid energy start again from 0: "+str(e))
+        self.loadProfile=None
+        self.lastPlanTime=0
+        self.tariffTime=None
+        self.pushedPlan=None
+        if self.config["tariff_file"] and self.config["fleet"]:
+            # the optimiser writes manual mode periods 0-9 and switches off the ones it does not use, so also the all-day period of the dispatcher
+            Domoticz.Error("tariff_file and fleet in "+CONFIGFILE+" both use the manual mode periods of the battery, the schedule optimiser is not started")
+        elif self.config["tariff_file"]:
+            self.loadProfile=LoadProfile()
+            try:
+                with open(self.homeFolder+LOADPROFILE) as f:
+                    self.loadProfile.restore(json.load(f))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                Domoticz.Error("Could not read "+LOADPROFILE+", the load profile starts again: "+str(e))
+        self.dispatcher=None
+        self.fleetTarget=None # set with the Fleet power target device, nothing is sent before that
+        if self.config["fleet"]:
+            self.dispatcher=FleetDispatcher(deadband=float(self.config["fleet_deadband"]))
+            self.dispatcher.add_unit(self.IPAddress+":"+str(self.Port), self.client, float(self.config["fleet_max_charge"]), self.maxOutputPower)
+            for spec in self.config["fleet"]:
+                ip,_,port=str(spec).partition(":")
+                port=int(port) if port else self.Port
+                fleetPacer=get_pacer(ip, port, max_rate=float(self.config["pacing_max_rate"])) if self.config["pacing"] else None
+                fleetClient=VenusAPIClient(ip=ip, port=port, timeout=float(self.config["timeout_max"]), min_timeout=float(self.config["timeout_min"]), multiplexer=multiplexer, pacer=fleetPacer)
+                self.dispatcher.add_unit(ip+":"+str(port), fleetClient, float(self.config["fleet_max_charge"]), float(self.config["fleet_max_discharge"]))
+        self.linkMonitor=None
+        self.linkSkips=0 # data cycles skipped because of a weak link
+        if self.config["wifi_interval"]:
+            self.linkMonitor=LinkMonitor(wifi_interval=float(self.config["wifi_interval"]))
+        self.burst=None
+        self.setModes=0 # successful ES.SetMode requests seen, a new one starts a burst
+        if self.config["burst"]:
+            self.burst=BurstSchedule(normal=int(Parameters["Mode1"]), fast=float(self.config["burst_interval"]), hold=float(self.config["burst_hold"]),
+                                     decay=float(self.config["burst_decay"]), step=float(self.config["burst_step"]),
+                                     max_duration=float(self.config["burst_max_duration"]))
+        self.exporter=None
+        if self.config["exporter_port"]:
+            try:
+                self.exporter=MetricsExporter(port=int(self.config["exporter_port"]), address=self.config["exporter_address"])
+                self.exporter.add_client(self.IPAddress, self.client)
+                self.exporter.add_counter("venus_outliers_rejected", self.IPAddress, self.outlierFilter.rejected, help_text="Values rejected by the outlier filter")
+                self.exporter.add_counter("venus_updates_suppressed", self.IPAddress, self.deadband.suppressed, help_text="Device updates left out because the value stayed within the deadband")
+                self.exporter.add_counter("venus_energy_counter_events", self.IPAddress, self.counters.events, label="event", help_text="Resets, wraparounds, changes of scale and ignored jumps of the energy counters")
+                if self.burst is not None:
+                    self.exporter.add_counter("venus_burst", self.IPAddress, self.burst.values, label="counter", help_text="Bursts of fast polling started and burst polls done")
+                self.exporter.add_counter("venus_energy_today", self.IPAddress, self.counters.today, label="counter", help_text="Increase of the energy counters since midnight, in device units", kind="gauge")
+                self.exporter.start()
+                Domoticz.Log("Metrics exporter started on port "+str(self.config["exporter_port"]))
+            except OSError as e:
+                Domoticz.Error("Metrics exporter could not be started: "+str(e))
+                self.exporter=None
+        # probe the battery to find out which fields it really reports, only those devices are created
+        # devices for fields that show up later (or when the probe failed) are created when the first value arrives
+        self.lastResponses={} # last response of each data source, saved for a warm restart
+        self.lastStateSave=time.time()
+        self.lastDataCycle=time.monotonic() # start of the last complete data cycle, also run during a burst
+        state=self.loadState()
+        self.probedFields=self.probeCapabilities()
+        if self.probedFields is None and state.get("probedFields") is not None:
+            Domoticz.Log("Using the fields probed before the restart")
+            self.probedFields=set(state["probedFields"])
         for Dev in DEVSLIST:
-            Unit=DEVSLIST[Dev][0]
-            DeviceID="{:04x}{:04x}".format(self.Hwid,Unit)
-            Type=DEVSLIST[Dev][1]
-            Subtype=DEVSLIST[Dev][2]
-            Switchtype=DEVSLIST[Dev][3]
-            Options=DEVSLIST[Dev][4]
-            Name=self.namePrefix+DEVSLIST[Dev][6]
-            if DeviceID not in Devices:
-                Domoticz.Status(f"Creating device for Field {Dev} ...")
-                if ((Type==243) and (Subtype==29)):
-                    # below code puts an initial svalue on the kwh device and then changes the type to "computed". This is to work around a BUG in Domoticz for computed kwh devices. See issue 6194 on Github.
-                    Domoticz.Unit(DeviceID=DeviceID,Unit=Unit, Name=Name, Type=Type, Subtype=Subtype, Switchtype=Switchtype, Options={}, Used=1).Create()
-                    Devices[DeviceID].Units[Unit].sValue="0;0"
-                    Devices[DeviceID].Units[Unit].Update()
-                    Devices[DeviceID].Units[Unit].Options=Options
-                    Devices[DeviceID].Units[Unit].Update(UpdateOptions=True)
-                else:
-                    Domoticz.Unit(DeviceID=DeviceID,Unit=Unit, Name=Name, Type=Type, Subtype=Subtype, Switchtype=Switchtype, Options=Options, Used=1).Create()
+            if DEVSLIST[Dev].source in PROBEDSOURCES and (self.probedFields is None or Dev not in self.probedFields):
+                continue
+            if DEVSLIST[Dev].source in OPTIONALSOURCES and not self.config[OPTIONALSOURCES[DEVSLIST[Dev].source]]:
+                continue
+            self.createDevice(Dev)
+        for Dev in DEVSLIST:
+            Domoticz.Log("DEVSLIST "+str(DEVSLIST[Dev].unit)+DEVSLIST[Dev].name)
+        if time.time()-state.get("saved",0)<=float(self.config["state_max_age"]):
+            # show the values from before the restart until the first data cycle
+            # straight onto the devices: counters.json is newer than these responses, so they must not be counted again
+            for source,response in state.get("responses",{}).items():
+                if source in DATASOURCES:
+                    self.processValues(source,response,restored=True)
+
+    def loadDevices(self):
+        # compile the device mapping of devices.json with the quirks of this battery and the device_overrides of plugin_config.json
+        global DEVSLIST
+        fileName=self.homeFolder+DEVICEFILE
+        if not os.path.exists(fileName):
+            fileName=os.path.join(os.path.dirname(os.path.abspath(__file__)),DEVICEFILE)
+        try:
+            document=load_devices(fileName)
+        except (OSError, ValueError) as e:
+            Domoticz.Error("Could not read the device list "+DEVICEFILE+": "+str(e))
+            raise
+        model=self.deviceInfo.get("device") if self.deviceInfo else None
+        version=self.deviceInfo.get("ver") if self.deviceInfo else None
+        if model is None and document.get("quirks"):
+            Domoticz.Log("Battery model unknown, the firmware quirks of "+DEVICEFILE+" are applied once the battery reports its model")
+        try:
+            DEVSLIST=compile_mapping(document, self.config["device_overrides"], model, version)
+        except ValueError as e:
+            Domoticz.Error("device_overrides in "+CONFIGFILE+" not used: "+str(e))
+            DEVSLIST=compile_mapping(document, None, model, version)
+        changed=[Dev for Dev in DEVSLIST if DEVSLIST[Dev].expression is not None or Dev in self.config["device_overrides"]]
+        if changed:
+            Domoticz.Log("Device settings changed by quirks or overrides: "+str(changed))
+
+    def deviceInfoDeadline(self):
+        # seconds for the model request: one attempt of the longest timeout, within the cycle deadline
+        return min(self.cycleDeadline,float(self.config["timeout_max"]))
+
+    def retryDeviceInfo(self):
+        # the model was unknown at start: ask again, with a growing wait between the attempts, and apply the firmware
+        # quirks once it is known
+        if time.monotonic()<self.deviceInfoNext:
+            return
+        self.deviceInfo=self.client.get_devices("0",deadline=time.monotonic()+self.deviceInfoDeadline())
+        if not self.deviceInfo:
+            self.deviceInfoFailures+=1
+            wait=min(DEVICEINFOMAXWAIT,int(Parameters["Mode1"])*2**self.deviceInfoFailures)
+            self.deviceInfoNext=time.monotonic()+wait
+            if debug: Domoticz.Log("Battery model still unknown, asking again in "+str(wait)+"s")
+            return
+        Domoticz.Log("Battery model "+str(self.deviceInfo.get("device"))+" firmware "+str(self.deviceInfo.get("ver"))+" known now, device settings reloaded")
+        self.loadDevices()
+        for Dev in COUNTERFIELDS:
+            self.counters.set_multiplier(Dev,DEVSLIST[Dev].multiplier)
+
+    def loadState(self):
+        # read state.json and restore the round trip time estimate and the failure state, returns the state (empty if none)
+        try:
+            with open(self.homeFolder+STATEFILE) as f:
+                state=json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            Domoticz.Error("Could not read "+STATEFILE+", cold start: "+str(e))
+            return {}
+        if state.get("version")!=STATEVERSION or state.get("device")!=self.IPAddress+":"+str(self.Port):
+            Domoticz.Log(STATEFILE+" is of another version or battery, cold start")
+            return {}
+        self.client.rtt_estimator.restore(state.get("rtt",{}))
+        if self.client.pacer is not None:
+            self.client.pacer.restore(state.get("pacing",{}))
+        self.failedCycleCount=int(state.get("failedCycleCount",0))
+        if self.linkMonitor is not None:
+            self.linkMonitor.restore(state.get("link",{}))
+        self.emailAlertSent=bool(state.get("emailAlertSent",False))
+        Domoticz.Log("State loaded from "+STATEFILE+", saved "+str(round(time.time()-state.get("saved",0)))+"s ago")
+        return state
+
+    def saveState(self):
+        # write the state for a warm restart, see loadState
+        state={"version":STATEVERSION,
+               "device":self.IPAddress+":"+str(self.Port),
+               "saved":time.time(),
+               "responses":self.lastResponses,
+               "rtt":self.client.rtt_estimator.state(),
+               "pacing":self.client.pacer.state() if self.client.pacer is not None else {},
+               "probedFields":sorted(self.probedFields) if self.probedFields is not None else None,
+               "failedCycleCount":self.failedCycleCount,
+               "link":self.linkMonitor.state() if self.linkMonitor is not None else {},
+               "emailAlertSent":self.emailAlertSent}
+        try:
+            self.writeJson(STATEFILE,state)
+            self.lastStateSave=time.time()
+        except (OSError, TypeError, ValueError) as e:
+            Domoticz.Error("Could not save "+STATEFILE+": "+str(e))
+
+    def writeJson(self, fileName, data):
+        # write a JSON file in the plugin home folder, replacing the old file in one step
+        fileName=self.homeFolder+fileName
+        with open(fileName+".tmp","w") as f:
+            json.dump(data,f)
+        os.replace(fileName+".tmp",fileName)
+
+    def createDevice(self, Dev):
+        # create the Domoticz device for one field of DEVSLIST, if it does not exist yet
+        Unit=DEVSLIST[Dev].unit
+        DeviceID="{:04x}{:04x}".format(self.Hwid,Unit)
+        Type=DEVSLIST[Dev].type
+        Subtype=DEVSLIST[Dev].subtype
+        Switchtype=DEVSLIST[Dev].switchtype
+        Options=DEVSLIST[Dev].options
+        Name=self.namePrefix+DEVSLIST[Dev].name
+        if DeviceID not in Devices:
+            Domoticz.Status(f"Creating device for Field {Dev} ...")
+            if ((Type==243) and (Subtype==29)):
+                # below code puts an initial svalue on the kwh device and then changes the type to "computed". This is to work around a BUG in Domoticz for computed kwh devices. See issue 6194 on Github.
+                Domoticz.Unit(DeviceID=DeviceID,Unit=Unit, Name=Name, Type=Type, Subtype=Subtype, Switchtype=Switchtype, Options={}, Used=1).Create()
+                Devices[DeviceID].Units[Unit].sValue="0;0"
+                Devices[DeviceID].Units[Unit].Update()
+                Devices[DeviceID].Units[Unit].Options=Options
+                Devices[DeviceID].Units[Unit].Update(UpdateOptions=True)
+            elif Type==250:
+                # P1 meter: initial value from the energy counters, otherwise Domoticz reports an invalid sValue until the first update
+                Domoticz.Unit(DeviceID=DeviceID,Unit=Unit, Name=Name, Type=Type, Subtype=Subtype, Switchtype=Switchtype, Options=Options, Used=1).Create()
+                inputEnergy=int(self.counters.total("input_energy") or 0)
+                outputEnergy=int(self.counters.total("output_energy") or 0)
+                Devices[DeviceID].Units[Unit].sValue=str(inputEnergy)+";0;"+str(outputEnergy)+";0;0;0"
+                Devices[DeviceID].Units[Unit].Update()
+            else:
+                Domoticz.Unit(DeviceID=DeviceID,Unit=Unit, Name=Name, Type=Type, Subtype=Subtype, Switchtype=Switchtype, Options=Options, Used=1).Create()
+        return DeviceID
+
+    def createOutlierFilter(self):
+        # one outlier filter per numeric field received from the battery, settings from OUTLIERDEFAULTS and plugin_config.json
+        settings={}
+        for Dev in DEVSLIST:
+            deviceType=(DEVSLIST[Dev].type,DEVSLIST[Dev].subtype)
+            if DEVSLIST[Dev].source in DATASOURCES and deviceType in OUTLIERDEFAULTS:
+                settings[Dev]=dict(OUTLIERDEFAULTS[deviceType])
+        for Dev,override in self.config["outlier_settings"].items():
+            if override is None:
+                settings.pop(Dev,None)
+            else:
+                settings.setdefault(Dev,{}).update(override)
+        if not self.config["outlier_filter"]:
+            for Dev in settings:
+                settings[Dev]["min_deviation"]=float("inf") # statistical filter off, hard limits stay
+        return OutlierFilter(settings)
+
+    def createDeadbandFilter(self):
+        # one deadband per device, settings from DEADBANDDEFAULTS and plugin_config.json
+        settings={}
         for Dev in DEVSLIST:
-            Domoticz.Log("DEVSLIST "+str(DEVSLIST[Dev][0])+DEVSLIST[Dev][6])
+            deviceType=(DEVSLIST[Dev].type,DEVSLIST[Dev].subtype)
+            if deviceType in DEADBANDDEFAULTS:
+                settings[Dev]=dict(DEADBANDDEFAULTS[deviceType])
+        for Dev,override in self.config["deadband_settings"].items():
+            if override is None:
+                settings.pop(Dev,None)
+            else:
+                settings.setdefault(Dev,{}).update(override)
+        return DeadbandFilter(settings, max_silence=float(self.config["max_silence"]), enabled=bool(self.config["deadband"]))
+
+    def loadConfig(self):
+        # read the optional plugin_config.json, missing settings get their default value
+        config=dict(CONFIGDEFAULTS)
+        try:
+            with open(self.homeFolder+CONFIGFILE) as f:
+                config.update(json.load(f))
+            Domoticz.Log("Settings loaded from "+CONFIGFILE+": "+str(config))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            Domoticz.Error("Could not read "+CONFIGFILE+", using defaults: "+str(e))
+        return config
+
+    def probeCapabilities(self):
+        # returns the set of DEVSLIST fields reported by this battery, or None if the battery could not be probed
+        # the result is cached per device model and firmware version, so the full probe only runs once after a firmware update
+        client=self.client
+        deviceInfo=self.deviceInfo
+        if not deviceInfo:
+            Domoticz.Error("Probing Marstek device failed, devices will be created when data is received.")
+            return None
+        deviceKey=str(deviceInfo.get("device"))+"_"+str(deviceInfo.get("ver"))
+        cacheFile=self.homeFolder+CAPABILITYCACHE
+        try:
+            with open(cacheFile) as f:
+                cache=json.load(f)
+        except (OSError, ValueError):
+            cache={}
+        if deviceKey in cache:
+            Domoticz.Log("Using cached capabilities for "+deviceKey)
+            return set(cache[deviceKey])
+        Domoticz.Log("Probing capabilities of "+deviceKey)
+        fields=set()
+        snapshot=client.get_snapshot(SOURCEMETHODS.values())
+        probeComplete=not snapshot.missed()
+        for source in DATASOURCES:
+            response=snapshot.result(SOURCEMETHODS[source])
+            if response is None:
+                continue
+            for Dev in response:
+                DevName=self.fieldName(source,Dev)
+                if DevName is not None and DevName in DEVSLIST:
+                    fields.add(DevName)
+        if "output_energy" in fields: # P1 meter combines the EMS values
+            fields.add("P1 meter")
+        if probeComplete: # only cache a complete probe, otherwise try again at next start
+            cache[deviceKey]=sorted(fields)
+            try:
+                with open(cacheFile,"w") as f:
+                    json.dump(cache,f,indent=1)
+            except OSError:
+                Domoticz.Error("Could not write capability cache "+cacheFile)
+        Domoticz.Log("Fields reported by "+deviceKey+": "+str(sorted(fields)))
+        return fields
+
+    def fieldName(self, source, Dev):
+        # maps a field received from the API onto the DEVSLIST key, None if the field is not processed
+        # do not process ID or the energy meter data received from getmode command in certain modes
+        if (Dev!="id" and source!="ESM") or (source=="ESM" and (Dev=="mode" or Dev=="ongrid_power" or Dev=="offgrid_power" or Dev=="bat_soc")) :
+            if source=="ESS": # handle the duplicate ESS field names, also received in other commands
+                if (Dev=="bat_soc" or Dev=="ongrid_power" or Dev=="offgrid_power"):
+                    return "es_"+Dev
+            return Dev
+        return None
 
 
     def onStop(self):
         Domoticz.Log("onStop called")
+        self.saveState()
+        self.client.close()
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        if self.exporter is not None:
+            self.exporter.stop()
+        if self.client.multiplexer is not None:
+            close_multiplexer() # stop the receive thread, otherwise Domoticz cannot stop the plugin
+        if self.client.capture is not None:
+            self.client.capture.close()
+        if self.writer is not None:
+            self.writer.close(timeout=2)
+
+    def sendNotification(self, subject, body):
+        # queued, the writer thread sends it to the notification systems set up in Domoticz
+        if self.writer is None or not self.writer.notify(subject, body):
+            Domoticz.Error("Notification could not be queued: "+subject)
 
     def onConnect(self, Connection, Status, Description):
         Domoticz.Log("onConnect called")
@@ -268,13 +705,23 @@ class MarstekPlugin:
     def onCommand(self, DeviceID, Unit, Command, Level, Color):
         # used when a mode is selected using the selector switch in Domoticz
         if debug: Domoticz.Log("onCommand called for Device " + str(DeviceID) + " Unit " + str(Unit) + ": Parameter '" + str(Command) + "', Level: " + str(Level))
-        modeSelectorUnit=DEVSLIST["select Marstek mode"][0]
+        modeSelectorUnit=DEVSLIST["select Marstek mode"].unit
         expectedDeviceID="{:04x}{:04x}".format(self.Hwid,modeSelectorUnit)
         maxNrOfAttempts=3
         nrAttemptsDone=0
+        if self.dispatcher is not None and Unit==DEVSLIST["fleet_target"].unit and DeviceID=="{:04x}{:04x}".format(self.Hwid,Unit):
+            # new site power target, split over the fleet and sent right away
+            self.fleetTarget=float(Level)
+            Devices[DeviceID].Units[Unit].sValue=str(Level)
+            Devices[DeviceID].Units[Unit].Update()
+            self.runDispatcher(refresh=False)
+            self.checkSetMode()
+            return
         try:
             if str(Command)=="Set Level" and DeviceID==expectedDeviceID: # it is a mode change initiated using the selector switch
-                client = VenusAPIClient(ip=self.IPAddress, port=self.Port, timeout=5)
+                # the selector must follow the next mode reading, also when the change fails and the mode stays the same
+                self.deadband.forget("mode")
+                client=self.client
                 if Level==10: # auto mode (=self consumption)
                     success=client.set_auto_mode()
                     while not success and nrAttemptsDone<maxNrOfAttempts:
@@ -301,11 +748,11 @@ class MarstekPlugin:
                         Domoticz.Error("Change to AI optimisation mode failed.")
                 elif Level==30: # manual mode
                     # check and build parameters. the following devices should contain config data
-                    timeperiodUnit=DEVSLIST["time_period"][0]
-                    starttimeUnit=DEVSLIST["start_time"][0]
-                    endtimeUnit=DEVSLIST["end_time"][0]
-                    weekdayUnit=DEVSLIST["week_set"][0]
-                    mmpowerUnit=DEVSLIST["mm_power"][0]
+                    timeperiodUnit=DEVSLIST["time_period"].unit
+                    starttimeUnit=DEVSLIST["start_time"].unit
+                    endtimeUnit=DEVSLIST["end_time"].unit
+                    weekdayUnit=DEVSLIST["week_set"].unit
+                    mmpowerUnit=DEVSLIST["mm_power"].unit
                     timeperiod=Devices["{:04x}{:04x}".format(self.Hwid,timeperiodUnit)].Units[timeperiodUnit].sValue
                     starttime=Devices["{:04x}{:04x}".format(self.Hwid,starttimeUnit)].Units[starttimeUnit].sValue
                     endtime=Devices["{:04x}{:04x}".format(self.Hwid,endtimeUnit)].Units[endtimeUnit].sValue
@@ -363,8 +810,8 @@ class MarstekPlugin:
                         Domoticz.Error("No valid timeperiod set for manual mode")
                 elif Level==40: # passive mode
                     # check and build parameters for passive mode, note: removed because they did not have an effect
-                    #pmpowerUnit=DEVSLIST["pm_power"][0]
-                    #countdownUnit=DEVSLIST["countdown"][0]
+                    #pmpowerUnit=DEVSLIST["pm_power"].unit
+                    #countdownUnit=DEVSLIST["countdown"].unit
                     #pmpower=Devices["{:04x}{:04x}".format(self.Hwid,pmpowerUnit)].Units[pmpowerUnit].sValue
                     #countdown=Devices["{:04x}{:04x}".format(self.Hwid,countdownUnit)].Units[countdownUnit].sValue
                     #pmpower=int(pmpower)
@@ -408,6 +855,7 @@ class MarstekPlugin:
             Domoticz.Error("Change of mode failed, please check format of input parameters for conversion to integer.")
         except:
             Domoticz.Error("Change of mode failed, an unexpected error occurred.")
+        self.checkSetMode()
 
 
     def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
@@ -416,7 +864,59 @@ class MarstekPlugin:
     def onDisconnect(self, Connection):
         Domoticz.Log("onDisconnect called")
 
+    def checkSetMode(self):
+        # a successful ES.SetMode (selector switch, optimiser or fleet dispatcher) starts a burst to confirm the change
+        stats=self.client.stats.snapshot()
+        setModes=stats["requests"].get("ES.SetMode",0)-stats["failures"].get("ES.SetMode",0)
+        if setModes>self.setModes and self.burst is not None and self.burst.trigger("mode change"):
+            Domoticz.Log("Burst polling: mode change")
+        self.setModes=setModes
+        self.updateHeartbeat()
+
+    def updateHeartbeat(self):
+        # fast heartbeat while a burst runs, the heartbeat of the polling interval otherwise
+        if self.burst is not None and self.burst.active():
+            heartbeat=max(1,min(30,int(round(self.burst.interval))))
+        else:
+            heartbeat=min(30,int(Parameters["Mode1"]))
+        if heartbeat!=self.heartbeat:
+            Domoticz.Heartbeat(heartbeat)
+            self.heartbeat=heartbeat
+
+    def pollBurst(self):
+        # poll mode and power flows while a burst runs, a complete data cycle follows at the end of the burst
+        if self.linkMonitor is not None and self.config["link_adapt"] and self.linkMonitor.interval_factor()>1:
+            self.burst.stop() # no fast polling on a weak link
+        elif self.burst.due(time.monotonic()+0.5*self.heartbeat): # the heartbeat is in whole seconds
+            start=time.monotonic()
+            if start-self.lastDataCycle>=self.burst.normal:
+                # a complete data cycle once per polling interval also during a burst, it holds the burst methods too
+                self.runDataCycle()
+            else:
+                snapshot=self.client.get_snapshot(BURST_METHODS,deadline=start+0.8*self.burst.interval)
+                if self.exporter is not None:
+                    self.exporter.update_snapshot(self.IPAddress,snapshot,values=False)
+                for source in DATASOURCES:
+                    if SOURCEMETHODS[source] not in BURST_METHODS:
+                        continue
+                    response=snapshot.result(SOURCEMETHODS[source])
+                    if response is not None:
+                        self.processValues(source,dict(response))
+                        if source=="EMS" and self.analytics is not None:
+                            self.processAnalytics()
+            if debug: Domoticz.Log("Burst poll took "+str(round(1000*(time.monotonic()-start)))+" ms")
+            self.burst.polled()
+        if not self.burst.active():
+            Domoticz.Log("Burst polling ended, "+str(self.burst.polls)+" burst polls so far")
+            self.heartbeatCounter=0 # the next data cycle follows one polling interval after this one
+            self.runDataCycle()
+        else:
+            self.updateHeartbeat()
+
     def onHeartbeat(self):
+        if self.burst is not None and self.burst.active():
+            self.pollBurst()
+            return
         self.heartbeatCounter+=1
         if debug: Domoticz.Log("onHeartbeat called")
         if self.stillbusy and self.heartbeatCounter<5: # max 5 cycles total wait
@@ -425,26 +925,38 @@ class MarstekPlugin:
         else:
             # skip one or more heartbeats if polling interval > 30 seconds
             if self.heartbeatWaits==self.heartbeatCounter-1:
+                if self.linkMonitor is not None and self.config["link_adapt"] and self.linkSkips+1<self.linkMonitor.interval_factor():
+                    if debug: Domoticz.Log("Skipping data cycle, Wi-Fi link is "+self.linkMonitor.level)
+                    self.linkSkips+=1
+                    self.heartbeatCounter=0
+                    return
+                self.linkSkips=0
                 self.stillbusy=True
-                self.getVenusData()
+                self.runDataCycle()
                 self.heartbeatCounter=0
                 self.stillbusy=False
 
-    def processValues(self, source, response):
+    def runDataCycle(self):
+        # complete data cycle, from onHeartbeat and once per polling interval during a burst
+        self.lastDataCycle=time.monotonic()
+        if not self.deviceInfo:
+            self.retryDeviceInfo()
+        self.getVenusData()
+        self.checkSetMode() # sent by the optimiser or the fleet dispatcher, or a power step during the cycle
+        if time.time()-self.lastStateSave>=float(self.config["state_interval"]):
+            self.saveState()
+
+    def processValues(self, source, response, restored=False):
+        # restored=True: saved values of before a restart, only shown on the devices; they do not go through the
+        # outlier filter, the burst trigger, the energy counters (those show their saved totals) or the analytics
+        if source in DATASOURCES:
+            self.lastResponses[source]=response
         if self.showDataLog: Domoticz.Log(response)
         if debug: Domoticz.Log(response)
         for Dev in response:
 
-            # do not process ID or the energy meter data received from getmode command in certain modes
-            if (Dev!="id" and source!="ESM") or (source=="ESM" and (Dev=="mode" or Dev=="ongrid_power" or Dev=="offgrid_power" or Dev=="bat_soc")) :
-
-                if source=="ESS": # handle the duplicate ESS field names, also received in other commands
-                    if (Dev=="bat_soc" or Dev=="ongrid_power" or Dev=="offgrid_power"):
-                        DevName="es_"+Dev
-                    else:
-                        DevName=Dev
-                else:
-                    DevName=Dev
+            DevName=self.fieldName(source,Dev)
+            if DevName is not None:
 
                 # first check whether any unexpected/new fields are received, avoid key errors
                 if DEVSLIST.get(DevName)==None:
@@ -452,14 +964,41 @@ class MarstekPlugin:
                     Domoticz.Error("API might have changed. Needs to be investigated.")
                 else:
 
-                    type=DEVSLIST[DevName][1]
-                    subtype=DEVSLIST[DevName][2]
-                    Unit=DEVSLIST[DevName][0]
+                    field=DEVSLIST[DevName]
+                    type=field.type
+                    subtype=field.subtype
+                    Unit=field.unit
                     DeviceID="{:04x}{:04x}".format(self.Hwid,Unit)
+                    if DeviceID not in Devices: # field was not reported during the probe
+                        self.createDevice(DevName)
+
+                    try:
+                        value=response[Dev] if field.convert is None else field.convert(response[Dev]) # expression of devices.json
+                    except Exception as e: # e.g. division by 0 or a value of another type than the expression expects
+                        Domoticz.Error("Expression of field "+DevName+" failed for value "+str(response[Dev])+", value skipped: "+field.expression+": "+e.__class__.__name__+": "+str(e))
+                        continue
+                    if debug: Domoticz.Log("processing values "+source+" "+DevName+" "+str(value))
 
-                    if debug: Domoticz.Log("processing values "+source+" "+DevName+" "+str(response[Dev]))
+                    if not restored:
+                        if not self.outlierFilter.accept(DevName,value,field.multiplier):
+                            Domoticz.Log("Value "+str(value)+" of "+DevName+" rejected as outlier")
+                            continue
+                        if DevName=="mode" and value!=self.lastValues.get("mode"):
+                            self.pushedPlan=None # manual mode periods may have been changed, send the complete plan again
+                        if self.burst is not None and self.burst.observe(DevName,value):
+                            Domoticz.Log("Burst polling: "+self.burst.reason)
+                        self.lastValues[DevName]=value
+                        if self.counters.update(DevName,value) is not None:
+                            if debug: Domoticz.Log("counter "+DevName+" total "+str(self.counters.total(DevName))+" increase "+str(self.counters.trackers[DevName].last_delta))
+                    if DevName in self.counters.trackers and self.counters.total(DevName) is None:
+                        continue # no saved total and no number received yet, nothing to show (also not on the P1 meter)
 
-                    if (Devices[DeviceID].Units[Unit].Used==1) : # only process active devices
+                    # only update the device when the value changed significantly (or was not updated for max_silence seconds)
+                    if DevName in self.counters.trackers:
+                        publish=self.deadband.publish(DevName,self.counters.total(DevName))
+                    else:
+                        publish=self.deadband.publish(DevName,value,field.multiplier)
+                    if publish and (Devices[DeviceID].Units[Unit].Used==1) : # only process active devices
                         if ((type==80) or # temperature device
                            (type==113) or # counter device
                            ((type==243) and (subtype==6)) or # percentage device
@@ -467,29 +1006,31 @@ class MarstekPlugin:
                            ((type==243) and (subtype==23)) or # percentage device
                            ((type==243) and (subtype==31)) # custom device
                               ):
-                            multiplier=DEVSLIST[DevName][5]
-                            if multiplier==1:
-                                fieldValue=round(float(multiplier*response[Dev]),0)
+                            multiplier=field.multiplier
+                            if DevName in self.counters.trackers: # cumulative counter, already scaled
+                                fieldValue=round(self.counters.total(DevName),1)
+                            elif multiplier==1:
+                                fieldValue=round(float(multiplier*value),0)
                             else:
-                                fieldValue=round(float(multiplier*response[Dev]),1)
+                                fieldValue=round(float(multiplier*value),1)
                             Devices[DeviceID].Units[Unit].nValue=int(fieldValue)
                             Devices[DeviceID].Units[Unit].sValue=str(int(fieldValue))
                             Devices[DeviceID].Units[Unit].Update()
                         if ((type==243) and (subtype==19)): # text device
-                            fieldValue=response[Dev]
+                            fieldValue=value
                             Devices[DeviceID].Units[Unit].nValue=0
                             fieldText=str(fieldValue)
                             Devices[DeviceID].Units[Unit].sValue=fieldText
                             Devices[DeviceID].Units[Unit].Update()
                         if ((type==243) and (subtype==29)): # kwh device, instant+counter
-                            multiplier=DEVSLIST[DevName][5]
-                            fieldValue=round(float(multiplier*response[Dev]),0)
-                            if fieldValue>=-20000 and fieldValue<20000 : # only "reasonable" values will be processed, not 655xx
-                                Devices[DeviceID].Units[Unit].nValue=0
-                                Devices[DeviceID].Units[Unit].sValue=str(fieldValue)+";1" # supply actual watts , kwh are calculated by Domoticz.
-                                Devices[DeviceID].Units[Unit].Update()
+                            multiplier=field.multiplier
+                            fieldValue=round(float(multiplier*value),0)
+                            # "655xx" values are kept out by the limits of the outlier filter
+                            Devices[DeviceID].Units[Unit].nValue=0
+                            Devices[DeviceID].Units[Unit].sValue=str(fieldValue)+";1" # supply actual watts , kwh are calculated by Domoticz.
+                            Devices[DeviceID].Units[Unit].Update()
                         if (type==244) : # switch device
-                            fieldValue=response[Dev]
+                            fieldValue=value
                             if fieldValue==True:
                                 fieldValue=1
                             else:
@@ -499,8 +1040,8 @@ class MarstekPlugin:
                             Devices[DeviceID].Units[Unit].sValue=fieldText
                             Devices[DeviceID].Units[Unit].Update()
                         if (type==248): # kW device
-                            multiplier=DEVSLIST[DevName][5]
-                            fieldValue=round(float(multiplier*response[Dev]),0)
+                            multiplier=field.multiplier
+                            fieldValue=round(float(multiplier*value),0)
                             Devices[DeviceID].Units[Unit].nValue=int(fieldValue)
                             fieldText=str(fieldValue)
                             Devices[DeviceID].Units[Unit].sValue=fieldText
@@ -508,9 +1049,9 @@ class MarstekPlugin:
 
                         if DevName=="mode":
                             # mode switch will follow mode status received
-                            modeSelectorUnit=DEVSLIST["select Marstek mode"][0]
+                            modeSelectorUnit=DEVSLIST["select Marstek mode"].unit
                             modeswitchDeviceID="{:04x}{:04x}".format(self.Hwid,modeSelectorUnit)
-                            fieldValue=response[Dev]
+                            fieldValue=value
                             if fieldValue=="Auto":
                                 Level=10
                             elif fieldValue=="AI":
@@ -527,16 +1068,20 @@ class MarstekPlugin:
                     # combine 3 EMS values onto one P1 device
                     if source=="EMS":
                         if DevName=="total_power":
-                            self.saveTotalPower=int(response[Dev])
+                            self.saveTotalPower=int(value)
                         if DevName=="input_energy":
-                            self.saveInputEnergy=int(int(response[Dev])/10)
-                        if DevName=="output_energy":
-                            self.saveOutputEnergy=int(int(response[Dev])/10)
+                            self.saveInputEnergy=int(self.counters.total(DevName)) # scaled by the multiplier of the input_energy device
+                        if DevName=="output_energy" and self.counters.total("input_energy") is not None:
+                            self.saveOutputEnergy=int(self.counters.total(DevName))
                             # this is last value of 3, so now it can be processed
-                            Unit=51 # fixed nr !!!
+                            Unit=DEVSLIST["P1 meter"].unit
                             DeviceID="{:04x}{:04x}".format(self.Hwid,Unit)
+                            if DeviceID not in Devices:
+                                self.createDevice("P1 meter")
                             Devices[DeviceID].Units[Unit].Refresh()
-                            if (Devices[DeviceID].Units[Unit].Used==1) : # only process if P1 is an active device
+                            # on a significant change of the power or any change of the energy counters, both deadbands are checked
+                            publish=self.deadband.publish("P1 meter",self.saveTotalPower) | self.deadband.publish("P1 meter energy",(self.saveInputEnergy,self.saveOutputEnergy))
+                            if publish and (Devices[DeviceID].Units[Unit].Used==1) : # only process if P1 is an active device
                                 if debug: Domoticz.Log("Updating P1 meter "+str(self.saveTotalPower)+" "+str(self.saveInputEnergy)+" "+str(self.saveOutputEnergy))
                                 if self.saveTotalPower>=0:
                                     svalueString=str(self.saveInputEnergy)+";0;"+str(self.saveOutputEnergy)+";0;"+str(self.saveTotalPower)+";0"
@@ -550,49 +1095,183 @@ class MarstekPlugin:
             else:
                 if debug: Domoticz.Log("not processing values "+source+" "+Dev+" "+str(response[Dev]))
 
+        if self.exporter is not None:
+            self.exporter.update(self.IPAddress,source,response)
+
 
 
+    def processAnalytics(self):
+        # feed the last accepted EMS values to the grid analytics and load the results onto the EMA devices
+        self.analytics.update(self.lastValues)
+        values=self.analytics.values()
+        self.processValues("EMA",{field:value for field,value in values.items() if field in DEVSLIST})
+        if self.exporter is not None:
+            self.exporter.update(self.IPAddress,"EMA",values) # includes the per phase averages
+
+    def runOptimiser(self):
+        # add the household power without the battery to the load profile, and plan again when it is time
+        if "total_power" in self.lastValues and "es_ongrid_power" in self.lastValues:
+            # battery on-grid power is positive when discharging, so the house would have imported that as well
+            if self.loadProfile.update(self.lastValues["total_power"]+self.lastValues["es_ongrid_power"]):
+                try:
+                    self.writeJson(LOADPROFILE,self.loadProfile.state())
+                except OSError as e:
+                    Domoticz.Error("Could not save the load profile: "+str(e))
+        tariffFile=self.homeFolder+self.config["tariff_file"]
+        try:
+            tariffTime=os.path.getmtime(tariffFile)
+        except OSError:
+            Domoticz.Error("Tariff file "+tariffFile+" not found")
+            return
+        if tariffTime==self.tariffTime and time.time()-self.lastPlanTime<float(self.config["optimiser_interval"]):
+            return
+        soc=self.lastValues.get("soc")
+        capacity=self.lastValues.get("rated_capacity",self.lastValues.get("bat_cap"))
+        if soc is None or not capacity:
+            return # battery status not received yet
+        try:
+            tariff=load_tariff(tariffFile)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            Domoticz.Error("Could not read tariff file "+tariffFile+": "+str(e))
+            return
+        self.tariffTime=tariffTime
+        self.lastPlanTime=time.time()
+        start=time.time()//SLOT*SLOT
+        importPrices,exportPrices=tariff_slots(tariff,start,int(float(self.config["optimiser_hours"])*3600/SLOT))
+        if not importPrices:
+            Domoticz.Error("No prices for the coming hours in "+tariffFile)
+            return
+        current=self.lastValues.get("total_power",0)+self.lastValues.get("es_ongrid_power",0)
+        demand=[current if value is None else value for value in self.loadProfile.forecast(start,len(importPrices))]
+        optimiser=ScheduleOptimiser(capacity*DEVSLIST["rated_capacity"].multiplier, charge_power=float(self.config["optimiser_charge_power"]),
+                                    discharge_power=self.maxOutputPower, min_soc=float(self.config["optimiser_min_soc"]),
+                                    efficiency=float(self.config["optimiser_efficiency"]))
+        planStart=time.monotonic()
+        powers=optimiser.plan(soc,importPrices,exportPrices,demand)
+        plan=manual_config(optimiser.periods(start,powers,importPrices,exportPrices,demand))
+        if debug: Domoticz.Log("Schedule planned in "+str(round(time.monotonic()-planStart,3))+"s: "+str(plan))
+        if self.lastValues.get("mode")!="Manual":
+            if debug: Domoticz.Log("Battery not in manual mode, schedule not sent")
+            return
+        # only send the periods that changed since the last plan
+        pushed=list(self.pushedPlan) if self.pushedPlan is not None else [None]*len(plan)
+        for number,period in enumerate(plan):
+            if pushed[number]==period:
+                continue
+            if self.client.set_manual_mode(**period):
+                pushed[number]=period
+                Domoticz.Log("Manual mode period "+str(number)+" set: "+str(period))
+            else:
+                Domoticz.Error("Manual mode period "+str(number)+" could not be set, retrying at the next plan")
+                self.lastPlanTime=0
+        self.pushedPlan=pushed
+
+    def runDispatcher(self, refresh=True, localStatus=False):
+        # update the battery status of the fleet and send the changed shares of the fleet target
+        # localStatus=True: this cycle brought a new battery status of this battery, otherwise its status ages in the dispatcher
+        localName=self.IPAddress+":"+str(self.Port)
+        if localStatus and "soc" in self.lastValues:
+            self.dispatcher.update(localName,self.lastValues)
+        if refresh: # the other batteries, all at the same time, an offline one holds up the cycle no longer than the cycle deadline
+            received=self.dispatcher.refresh([name for name in self.dispatcher.units if name!=localName],deadline=time.monotonic()+self.cycleDeadline)
+            for name in received:
+                if not received[name]:
+                    Domoticz.Error("No battery status received from fleet member "+name)
+        if self.fleetTarget is None:
+            return
+        results=self.dispatcher.dispatch(self.fleetTarget)
+        for name,result in results.items():
+            if result["sent"]:
+                if result["success"]:
+                    Domoticz.Log("Fleet share of "+name+" set to "+str(result["power"])+" W")
+                else:
+                    Domoticz.Error("Fleet share of "+str(result["power"])+" W not accepted by "+name)
+
+    def processStatistics(self, cycleTime):
+        # summary of the client statistics since the previous cycle, loaded onto the STAT devices
+        stats=self.client.stats.snapshot()
+        summary=self.client.stats.summary(stats,self.lastStats)
+        if self.linkMonitor is not None:
+            self.processLink(stats)
+        self.lastStats=stats
+        values={"cycle_time":cycleTime*1000}
+        if summary["success_rate"] is not None:
+            values["success_rate"]=summary["success_rate"]
+        if summary["rtt_p95"] is not None:
+            values["rtt_p95"]=summary["rtt_p95"]*1000
+        if debug: Domoticz.Log("Communication statistics: "+str(summary)+" next timeout "+str(round(self.client.attempt_timeout(),3))+"s")
+        self.processValues("STAT",values)
+
+    def processLink(self, stats):
+        # evaluate the Wi-Fi link with the statistics of this cycle and load the results onto the LINK devices
+        level=self.linkMonitor.level
+        self.linkMonitor.update_stats(stats,self.lastStats)
+        values=self.linkMonitor.values()
+        if self.linkMonitor.level!=level:
+            Domoticz.Log("Wi-Fi link "+level+" -> "+self.linkMonitor.level+": "+values["link_state"])
+        self.processValues("LINK",{field:value for field,value in values.items() if field in DEVSLIST})
+
     def getVenusData(self):
         if debug: Domoticz.Log("Marstek Plugin getVenusData called")
         self.Hwid=Parameters['HardwareID']
         try:
             self.someResponseReceived=False
-            client = VenusAPIClient(ip=self.IPAddress, port=self.Port, timeout=5)
-            response=client.get_battery_status()
-            if debug: Domoticz.Log("battery status data received: "+str(response))
-            if response is not None:
-                self.someResponseReceived=True
-                self.processValues("BAT",response)
-
-            response=client.get_pv_status()
-            if debug: Domoticz.Log("pv status data received: "+str(response))
-            if response is not None:
-                self.someResponseReceived=True
-                self.processValues("PV",response)
-
-            response=client.get_em_status()
-            if debug: Domoticz.Log("em status data received: "+str(response))
-            if response is not None:
-                self.someResponseReceived=True
-                self.processValues("EMS",response)
-
-            response=client.get_energy_status()
-            if debug: Domoticz.Log("es status data received: "+str(response))
-            if response is not None:
-                self.someResponseReceived=True
-                self.processValues("ESS",response)
-
-            response=client.get_mode()
-            if debug: Domoticz.Log("get mode data received: "+str(response))
-            if response is not None:
-                self.someResponseReceived=True
-                self.processValues("ESM",response)
+            cycleStart=time.monotonic()
+            # all data requested at the same time, retries stop at the cycle deadline
+            methods=list(SOURCEMETHODS.values())
+            if self.linkMonitor is not None:
+                if self.config["link_adapt"]: # on a weak link only EM status and mode in every cycle
+                    methods=self.linkMonitor.methods(methods)
+                if self.linkMonitor.wifi_due():
+                    methods.append("Wifi.GetStatus")
+            snapshot=self.client.get_snapshot(methods,deadline=cycleStart+self.cycleDeadline)
+            if self.exporter is not None:
+                self.exporter.update_snapshot(self.IPAddress,snapshot,values=False)
+            wifi=snapshot.result("Wifi.GetStatus")
+            if wifi is not None and wifi.get("rssi") is not None:
+                self.linkMonitor.update_rssi(wifi["rssi"])
+            missed=[]
+            for source in DATASOURCES: # EMS first, the analytics use its values
+                if SOURCEMETHODS[source] not in methods:
+                    continue # left out on a weak link
+                response=snapshot.result(SOURCEMETHODS[source])
+                if response is not None:
+                    response=dict(response)
+                if debug: Domoticz.Log(source+" data received: "+str(response))
+                if response is not None:
+                    self.someResponseReceived=True
+                    self.processValues(source,response)
+                    if source=="EMS" and self.analytics is not None:
+                        self.processAnalytics()
+                else:
+                    missed.append(source)
+            if missed and self.someResponseReceived:
+                Domoticz.Log("No data for "+str(missed)+" within the cycle deadline of "+str(round(self.cycleDeadline,1))+"s")
+
+            try:
+                self.counters.save()
+            except OSError as e:
+                Domoticz.Error("Could not save the energy counter state: "+str(e))
+            if self.loadProfile is not None:
+                self.runOptimiser()
+            if self.dispatcher is not None:
+                self.runDispatcher(localStatus=snapshot.result(SOURCEMETHODS["BAT"]) is not None)
+            if self.analytics is not None:
+                try:
+                    self.writeJson(ANALYTICSSTATE,self.analytics.state())
+                except OSError as e:
+                    Domoticz.Error("Could not save the grid analytics state: "+str(e))
+            cycleTime=time.monotonic()-cycleStart
+            if self.exporter is not None:
+                self.exporter.observe_cycle(self.IPAddress,cycleTime)
+            self.processStatistics(cycleTime)
 
             if self.emailAlertSent==True and self.someResponseReceived==True:
                 if debug: Domoticz.Log("Communication restored. Data was received again during getVenusData cycle")
                 self.emailAlertSent=False
                 self.failedCycleCount=0
-                sendemail=requests.get("http://127.0.0.1:8080/json.htm?type=command&param=sendnotification&subject='Venus comms working again'&body='Problem solved'")
+                if self.notificationsOn:
+                    self.sendNotification("Venus comms working again","Problem solved")
 
             if self.someResponseReceived==False:
                 Domoticz.Error("No data received during complete cycle. Cycle nr "+str(self.failedCycleCount+1))
@@ -605,7 +1284,7 @@ class MarstekPlugin:
             if self.notificationsOn and self.emailAlertSent==False and self.failedCycleCount>=3:
                 # sending email after 3 full cycle failures of all 6 retrieval commands (usually due to Open API disabled)
                 Domoticz.Log("Sending email alert....")
-                sendemail=requests.get("http://127.0.0.1:8080/json.htm?type=command&param=sendnotification&subject='ATTENTION: Venus communication timeout, check connection and Open API setting'&body='Please check'")
+                self.sendNotification("ATTENTION: Venus communication timeout, check connection and Open API setting","Please check")
                 self.emailAlertSent=True
             return False
 
@@ -614,7 +1293,7 @@ class MarstekPlugin:
             self.failedCycleCount+=1
             if self.notificationsOn and self.emailAlertSent==False:
                 Domoticz.Log("Sending email alert....")
-                sendemail=requests.get("http://127.0.0.1:8080/json.htm?type=command&param=sendnotification&subject='ATTENTION: Venus communication data error'&body='Please check the log and solve the error.'")
+                self.sendNotification("ATTENTION: Venus communication data error","Please check the log and solve the error.")
                 self.emailAlertSent=True
             return False
 
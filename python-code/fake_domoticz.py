@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Fake DomoticzEx module
+
+Stands in for the DomoticzEx module that Domoticz provides to plugins, so that
+plugin.py can run outside Domoticz (see plugin_harness.py). Devices and units
+behave like the Domoticz ones for everything plugin.py uses: Create, Update,
+Refresh, Delete, nValue/sValue, Used and Options. Every call is recorded with
+the time it took, and sValues are checked the way Domoticz checks them, so an
+"Invalid Number sValue" shows up here as well.
+
+Install it before importing the plugin:
+    import sys, fake_domoticz
+    sys.modules["DomoticzEx"] = fake_domoticz
+"""
+
+import time
+from collections import defaultdict
+
+# Devices as the plugin sees them: DeviceID -> Device. Assign to plugin.Devices.
+Devices = {}
+# Every call as (name, details, seconds)
+calls = []
+# Messages logged by the plugin as (level, message)
+messages = []
+# Seconds per heartbeat as set by the plugin
+heartbeat = None
+# Print log messages while running
+echo = False
+
+# sValue formats per (Type, Subtype) as checked by Domoticz: number of ";" separated numbers
+NUMERIC_FORMATS = {
+    (80, 5): 1,     # temperature
+    (113, 0): 1,    # counter
+    (243, 6): 1,    # percentage
+    (243, 8): 1,    # voltage
+    (243, 23): 1,   # current
+    (243, 29): 2,   # kWh: power;energy
+    (243, 31): 1,   # custom sensor
+    (248, 1): 1,    # usage electric
+    (250, 1): 6,    # P1 smart meter: usage1;usage2;return1;return2;cons;prod
+    (242, 1): 1,    # setpoint
+}
+
+
+def _record(name, details, start):
+    calls.append((name, details, time.perf_counter() - start))
+
+
+def _log(level, message):
+    start = time.perf_counter()
+    messages.append((level, str(message)))
+    if echo:
+        print(f"{level}: {message}")
+    _record(level, None, start)
+
+
+def Log(message):
+    _log("Log", message)
+
+
+def Status(message):
+    _log("Status", message)
+
+
+def Error(message):
+    _log("Error", message)
+
+
+def Debug(message):
+    _log("Debug", message)
+
+
+def Debugging(mask):
+    pass
+
+
+def Heartbeat(seconds):
+    global heartbeat
+    heartbeat = seconds
+
+
+class Device:
+    """Domoticz device, holding the units with the same DeviceID"""
+
+    def __init__(self, DeviceID):
+        self.DeviceID = DeviceID
+        self.Units = {}
+        self.TimedOut = 0
+
+    def Refresh(self):
+        start = time.perf_counter()
+        _record("Device.Refresh", self.DeviceID, start)
+
+    def __str__(self):
+        return f"Device {self.DeviceID} with units {sorted(self.Units)}"
+
+
+class Unit:
+    """Domoticz unit (the device as shown in the Domoticz user interface)"""
+
+    def __init__(self, Name, DeviceID, Unit, TypeName="", Type=0, Subtype=0, Switchtype=0, Image=0,
+                 Options=None, Used=0, Description=""):
+        self.Name = Name
+        self.DeviceID = DeviceID
+        self.Unit = Unit
+        self.Type = Type
+        self.SubType = Subtype
+        self.SwitchType = Switchtype
+        self.Image = Image
+        self.Options = dict(Options or {})
+        self.Used = Used
+        self.Description = Description
+        self.nValue = 0
+        self.sValue = ""
+        self.LastLevel = 0
+        self.LastUpdate = None
+        self.BatteryLevel = 255
+        self.SignalLevel = 12
+        self.updates = 0
+        self.errors = 0
+
+    def Create(self):
+        start = time.perf_counter()
+        device = Devices.get(self.DeviceID)
+        if device is None:
+            device = Devices[self.DeviceID] = Device(self.DeviceID)
+        if self.Unit in device.Units:
+            Error(f"Unit {self.Unit} of {self.DeviceID} already exists")
+        device.Units[self.Unit] = self
+        _record("Unit.Create", (self.DeviceID, self.Unit), start)
+
+    def Update(self, Log=False, TypeName="", UpdateProperties=False, UpdateOptions=False, SuppressTriggers=False):
+        start = time.perf_counter()
+        if self.DeviceID not in Devices or Devices[self.DeviceID].Units.get(self.Unit) is not self:
+            Error(f"Update of unit {self.Unit} of {self.DeviceID} that was not created")
+        self._check()
+        self.updates += 1
+        self.LastUpdate = time.strftime("%Y-%m-%d %H:%M:%S")
+        if self.SubType == 62 or self.Type == 244:
+            try:
+                self.LastLevel = int(self.sValue)
+            except ValueError:
+                pass
+        _record("Unit.Update", (self.DeviceID, self.Unit, self.nValue, self.sValue), start)
+
+    def _check(self):
+        # Domoticz refuses values that are not numbers for numeric devices
+        expected = NUMERIC_FORMATS.get((self.Type, self.SubType))
+        if expected is None:
+            return
+        parts = str(self.sValue).split(";")
+        try:
+            if len(parts) < expected:
+                raise ValueError
+            for part in parts[:expected]:
+                float(part)
+        except ValueError:
+            self.errors += 1
+            Error(f"Invalid Number sValue: '{self.sValue}' for device idx: '{self.DeviceID}/{self.Unit}'")
+
+    def Refresh(self):
+        start = time.perf_counter()
+        _record("Unit.Refresh", (self.DeviceID, self.Unit), start)
+
+    def Delete(self):
+        start = time.perf_counter()
+        Devices[self.DeviceID].Units.pop(self.Unit, None)
+        if not Devices[self.DeviceID].Units:
+            del Devices[self.DeviceID]
+        _record("Unit.Delete", (self.DeviceID, self.Unit), start)
+
+    def __str__(self):
+        return f"Unit {self.Unit} '{self.Name}' ({self.Type}/{self.SubType}) nValue={self.nValue} sValue='{self.sValue}'"
+
+
+def reset():
+    """Forget all devices, calls and messages"""
+    global heartbeat
+    Devices.clear()
+    calls.clear()
+    messages.clear()
+    heartbeat = None
+
+
+def call_summary():
+    """Number of calls and total seconds per call name"""
+    summary = defaultdict(lambda: [0, 0.0])
+    for name, _, seconds in calls:
+        summary[name][0] += 1
+        summary[name][1] += seconds
+    return dict(summary)
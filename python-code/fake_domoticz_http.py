@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Stand-in Domoticz web server
+
+Answers the Domoticz JSON API requests (json.htm) the DomoticzWriter sends,
+udevice and sendnotification, like Domoticz does, so the writer and the
+programs using it can be tested without Domoticz. It keeps the connections
+open (HTTP/1.1 keep-alive) and counts them, and it can be made slow, made to
+fail, or taken down and brought back.
+
+Usage:
+    python3 fake_domoticz_http.py [--port 8080] [--delay 0.5]
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeDomoticzHTTP:
+    """HTTP server answering json.htm requests"""
+
+    def __init__(self, port: int = 0, address: str = "127.0.0.1", delay: float = 0.0):
+        """
+        Initialize the stand-in web server
+
+        Args:
+            port: TCP port, 0 = any free port (default: 0), see self.port after start()
+            address: Listen address (default: 127.0.0.1)
+            delay: Seconds before each reply is sent (default: 0.0)
+        """
+        self.address = address
+        self.port = port
+        self.delay = delay
+        self.fail = False          # answer with status ERR
+        self.lock = threading.Lock()
+        self.requests = []         # (time.monotonic(), query parameters) of every request
+        self.devices = {}          # idx -> (nvalue, svalue) of the last udevice
+        self.notifications = []    # (subject, body)
+        self.connections = 0       # TCP connections accepted
+        self.server = None
+        self.thread = None
+
+    def start(self) -> int:
+        """Start answering in a background thread, returns the port"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # headers and body are written apart
+                with fake.lock:
+                    fake.connections += 1
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                if fake.delay > 0:
+                    time.sleep(fake.delay)
+                status = fake._handle(url.path, params)
+                body = json.dumps({"status": status, "title": params.get("param", "")}).encode("utf-8")
+                self.send_response(200 if url.path == "/json.htm" else 404)
+                self.send_header("Content-Type", "application/json;charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.address, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name=f"fake-domoticz-{self.port}", daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def _handle(self, path: str, params: Dict) -> str:
+        with self.lock:
+            self.requests.append((time.monotonic(), params))
+            if path != "/json.htm" or self.fail:
+                return "ERR"
+            if params.get("param") == "udevice" and "idx" in params:
+                self.devices[int(params["idx"])] = (int(params.get("nvalue", 0)), params.get("svalue", ""))
+            elif params.get("param") == "sendnotification":
+                self.notifications.append((params.get("subject", ""), params.get("body", "")))
+            else:
+                return "ERR"
+        return "OK"
+
+    def received(self, param: Optional[str] = None) -> List[Dict]:
+        """Query parameters of the requests received, optionally only those of one param"""
+        with self.lock:
+            return [p for _, p in self.requests if param is None or p.get("param") == param]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Domoticz web server (JSON API)")
+    parser.add_argument("--port", type=int, default=8080, help="TCP port (default: 8080)")
+    parser.add_argument("--address", default="127.0.0.1", help="listen address (default: 127.0.0.1)")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before each reply (default: 0)")
+    args = parser.parse_args()
+    domoticz = FakeDomoticzHTTP(args.port, args.address, args.delay)
+    print(f"Fake Domoticz answering on http://{args.address}:{domoticz.start()}/json.htm, Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"connections: {domoticz.connections}, devices: {domoticz.devices}, notifications: {len(domoticz.notifications)}")
+    except KeyboardInterrupt:
+        domoticz.stop()
+
+
+if __name__ == "__main__":
+    main()
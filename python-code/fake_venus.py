@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Stand-in Marstek Venus battery
+
+Answers the Open API requests over UDP like a Venus E does, with values that
+change a little every request, so the plugin and the library can be run and
+measured without a battery. Latency and packet loss can be added, and like the
+firmware it can drop requests that arrive too close together.
+
+Usage:
+    python3 fake_venus.py [--port 30000] [--latency 0.05] [--loss 0.1] [--min-gap 0.05]
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import random
+import socket
+import threading
+import time
+from typing import Dict, Optional
+
+
+def default_data() -> Dict[str, Dict]:
+    """Result of each method, as reported by a Venus E v3"""
+    return {
+        "Marstek.GetDevice": {"device": "VenusE", "ver": 145, "ble_mac": "123456789012", "wifi_mac": "123456789013",
+                              "wifi_name": "fake", "ip": "127.0.0.1"},
+        "Wifi.GetStatus": {"ssid": "fake", "rssi": -60, "sta_ip": "127.0.0.1", "sta_gate": "127.0.0.254",
+                           "sta_mask": "255.255.255.0", "sta_dns": "127.0.0.254"},
+        "BLE.GetStatus": {"state": "connect", "ble_mac": "123456789012"},
+        "Bat.GetStatus": {"soc": 55, "charg_flag": True, "dischrg_flag": True, "bat_temp": 24.0,
+                          "bat_capacity": 2816.0, "rated_capacity": 5120.0},
+        "PV.GetStatus": {"pv1_power": 1200, "pv1_voltage": 40, "pv1_current": 3, "pv1_state": 1,
+                         "pv2_power": 100, "pv2_voltage": 40, "pv2_current": 2, "pv2_state": 1},
+        "ES.GetStatus": {"bat_soc": 55, "bat_cap": 5120, "pv_power": 0, "ongrid_power": -300, "offgrid_power": 0,
+                         "total_pv_energy": 0, "total_grid_output_energy": 844, "total_grid_input_energy": 1607,
+                         "total_load_energy": 0},
+        "ES.GetMode": {"mode": "Auto", "ongrid_power": -300, "offgrid_power": 0, "bat_soc": 55},
+        "EM.GetStatus": {"ct_state": 1, "a_power": 100, "b_power": -50, "c_power": 20, "total_power": 70,
+                         "input_energy": 123450, "output_energy": 54320},
+    }
+
+
+class FakeVenus:
+    """UDP server answering Open API requests"""
+
+    def __init__(self, port: int = 0, address: str = "127.0.0.1", latency: float = 0.0, loss: float = 0.0,
+                 data: Optional[Dict[str, Dict]] = None, seed: Optional[int] = None, min_gap: float = 0.0):
+        """
+        Initialize the stand-in battery
+
+        Args:
+            port: UDP port, 0 = any free port (default: 0), see self.port after start()
+            address: Listen address (default: 127.0.0.1)
+            latency: Seconds before each reply is sent (default: 0.0)
+            loss: Fraction of the requests that get no reply (default: 0.0)
+            data: Results per method (default: default_data())
+            seed: Seed of the random changes and losses (default: None)
+            min_gap: Requests arriving within this number of seconds after the previous accepted one get
+                     no reply (default: 0.0)
+        """
+        self.address = address
+        self.port = port
+        self.latency = latency
+        self.loss = loss
+        self.data = data if data is not None else default_data()
+        self.drop = set()       # methods that never get a reply
+        self.min_gap = min_gap
+        self.requests = {}      # method -> number of requests received
+        self.too_close = 0      # requests dropped because of min_gap
+        self.accepted = None    # time.monotonic() of the last request accepted
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.delayed = []       # heap of (send time, sequence, reply, address)
+        self.sequence = itertools.count()
+        self.wakeup = threading.Condition()
+        self.sock = None
+        self.thread = None
+        self.sender = None
+
+    def start(self) -> int:
+        """Start answering in a background thread, returns the port"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.address, self.port))
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, name=f"fake-venus-{self.port}", daemon=True)
+        self.thread.start()
+        if self.latency > 0:
+            # one thread sends all delayed replies in time order, also with many requests in flight
+            self.sender = threading.Thread(target=self._send_delayed, name=f"fake-venus-{self.port}-send", daemon=True)
+            self.sender.start()
+        return self.port
+
+    def stop(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        with self.wakeup:
+            self.wakeup.notify()
+
+    def _serve(self):
+        sock = self.sock
+        while True:
+            try:
+                data, address = sock.recvfrom(65535)
+            except OSError:
+                return  # socket closed by stop()
+            try:
+                request = json.loads(data.decode("utf-8"))
+                method = request["method"]
+            except (ValueError, KeyError):
+                continue
+            with self.lock:
+                self.requests[method] = self.requests.get(method, 0) + 1
+                lost = method in self.drop or self.random.random() < self.loss
+                if not lost and self.min_gap > 0:
+                    now = time.monotonic()
+                    if self.accepted is not None and now - self.accepted < self.min_gap:
+                        self.too_close += 1
+                        lost = True
+                    else:
+                        self.accepted = now
+                result = None if lost else self._result(method, request.get("params") or {})
+            if result is None:
+                continue
+            reply = json.dumps({"id": request.get("id"), "src": "VenusE-fake", "result": result}).encode("utf-8")
+            if self.latency > 0:
+                with self.wakeup:
+                    heapq.heappush(self.delayed, (time.monotonic() + self.latency, next(self.sequence), reply, address))
+                    self.wakeup.notify()
+            else:
+                self._reply(sock, reply, address)
+
+    def _send_delayed(self):
+        while True:
+            with self.wakeup:
+                while self.sock is not None and (not self.delayed or self.delayed[0][0] > time.monotonic()):
+                    self.wakeup.wait(self.delayed[0][0] - time.monotonic() if self.delayed else None)
+                sock = self.sock
+                if sock is None:
+                    return
+                _, _, reply, address = heapq.heappop(self.delayed)
+            self._reply(sock, reply, address)
+
+    @staticmethod
+    def _reply(sock, reply: bytes, address):
+        try:
+            sock.sendto(reply, address)
+        except OSError:
+            pass
+
+    def _result(self, method: str, params: Dict) -> Optional[Dict]:
+        if method == "ES.SetMode":
+            mode = params.get("config", {}).get("mode")
+            if mode:
+                self.data["ES.GetMode"]["mode"] = mode
+            return {"id": 0, "set_result": True}
+        result = self.data.get(method)
+        if result is None:
+            return None
+        if method == "EM.GetStatus":
+            # grid power moves a little, the energy counters follow it
+            for phase in ("a_power", "b_power", "c_power"):
+                result[phase] = max(-3000, min(3000, result[phase] + self.random.randint(-20, 20)))
+            result["total_power"] = result["a_power"] + result["b_power"] + result["c_power"]
+            if result["total_power"] > 0:
+                result["input_energy"] += 1
+            else:
+                result["output_energy"] += 1
+        return dict(result, id=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Marstek Venus battery (Open API over UDP)")
+    parser.add_argument("--port", type=int, default=30000, help="UDP port (default: 30000)")
+    parser.add_argument("--address", default="127.0.0.1", help="listen address (default: 127.0.0.1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each reply (default: 0)")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of requests without reply (default: 0)")
+    parser.add_argument("--min-gap", type=float, default=0.0, help="drop requests within this many seconds of the previous one (default: 0)")
+    args = parser.parse_args()
+    venus = FakeVenus(args.port, args.address, args.latency, args.loss, min_gap=args.min_gap)
+    print(f"Fake Venus answering on {args.address}:{venus.start()}, Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"requests: {venus.requests}")
+    except KeyboardInterrupt:
+        venus.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Fleet-scale load test of the UDP client
+
+Starts many stand-in batteries (fake_venus.py) in a separate process, each on
+its own port and optionally spread over loopback addresses, and polls them all
+with the venus_api_v2 library, as the command line poller or the fleet
+dispatcher does. Reports, as JSON lines, the cycles per second, cycle times,
+sockets and file descriptors, threads, CPU per device and the growth of the
+resident memory over the run, so the scaling limit is known before production.
+In collector mode the CPU time and resident memory include the worker
+processes (Linux /proc), so the figures compare with poll mode.
+
+Examples:
+    python3 load_test.py --devices 100 --duration 60
+    python3 load_test.py --devices 250 --latency 0.05 --loss 0.02 --duration 3600 --report 60
+    python3 load_test.py --devices 100 --no-mux          (a new socket per request)
+    python3 load_test.py --devices 50 --mode fleet       (FleetDispatcher refresh + dispatch)
+    python3 load_test.py --devices 20 --min-gap 0.05 --pace   (batteries dropping requests sent too close together)
+    python3 load_test.py --devices 400 --mode collector --processes 4   (FleetCollector worker processes)
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # the venus_*.py modules
+sys.path.insert(0, HERE)
+
+from fake_venus import FakeVenus
+
+
+def simulate(count: int, addresses: int, latency: float, loss: float, seed: int, min_gap: float, connection):
+    """Simulator process: start the batteries, send their addresses, run until told to stop"""
+    batteries = []
+    endpoints = []
+    for i in range(count):
+        address = "127.0.0.1" if addresses <= 1 else f"127.0.{1 + (i % addresses) // 250}.{1 + (i % addresses) % 250}"
+        battery = FakeVenus(0, address, latency, loss, seed=seed + i, min_gap=min_gap)
+        endpoints.append((address, battery.start()))
+        batteries.append(battery)
+    connection.send(endpoints)
+    connection.recv()  # stop
+    requests = sum(sum(battery.requests.values()) for battery in batteries)
+    too_close = sum(battery.too_close for battery in batteries)
+    for battery in batteries:
+        battery.stop()
+    connection.send({"requests_received": requests, "requests_too_close": too_close,
+                     "simulator_cpu_seconds": round(sum(os.times()[:2]), 3)})
+
+
+def process_cpu(pid: int) -> float:
+    """CPU seconds (user + system) of another process, 0 when it is gone (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rpartition(")")[2].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def process_rss_kb(pid: int) -> int:
+    """Resident memory in kB of another process, 0 when it is gone (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def resources(pids=()):
+    """Open file descriptors and sockets, threads, resident memory in kB including pids (Linux /proc, elsewhere partly)"""
+    result = {"threads": threading.active_count()}
+    try:
+        fds = os.listdir("/proc/self/fd")
+        result["fds"] = len(fds)
+        sockets = 0
+        for fd in fds:
+            try:
+                if os.readlink(f"/proc/self/fd/{fd}").startswith("socket:"):
+                    sockets += 1
+            except OSError:
+                pass
+        result["sockets"] = sockets
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    result["rss_kb"] = int(line.split()[1]) + sum(process_rss_kb(pid) for pid in pids)
+    except OSError:
+        result["rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # peak, kB on Linux
+    return result
+
+
+def cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+
+def emit(record):
+    sys.stdout.write(json.dumps(record, separators=(",", ":")) + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the UDP client against many stand-in batteries")
+    parser.add_argument("--devices", type=int, default=100, help="number of stand-in batteries (default: 100)")
+    parser.add_argument("--addresses", type=int, default=1, help="spread the batteries over this many loopback addresses 127.0.x.y (default: 1)")
+    parser.add_argument("--latency", type=float, default=0.0, help="reply latency in seconds (default: 0)")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of requests without reply (default: 0)")
+    parser.add_argument("--mode", choices=("poll", "fleet", "collector"), default="poll",
+                        help="poll: every device is polled as by python -m venus_api_v2 poll; "
+                             "fleet: FleetDispatcher status refresh and dispatch of a random target; "
+                             "collector: FleetCollector worker processes poll back to back, a cycle is one record "
+                             "of every device (default: poll)")
+    parser.add_argument("--methods", default="em,bat,pv,es,mode", help="methods per device per cycle in poll mode (default: em,bat,pv,es,mode)")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run (default: 30)")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between cycle starts, 0 = back to back (default: 0)")
+    parser.add_argument("--report", type=float, default=10, help="seconds between progress lines (default: 10)")
+    parser.add_argument("--workers", type=int, default=0, help="polling threads, 0 = one per device (default: 0)")
+    parser.add_argument("--processes", type=int, default=0, help="worker processes in collector mode, 0 = one per core (default: 0)")
+    parser.add_argument("--no-mux", action="store_true", help="a new socket per request instead of the shared multiplexer")
+    parser.add_argument("--pool-size", type=int, default=1, help="sockets of the multiplexer (default: 1)")
+    parser.add_argument("--timeout", type=float, default=2, help="maximum request timeout in seconds (default: 2)")
+    parser.add_argument("--min-gap", type=float, default=0.0, help="batteries drop requests within this many seconds of the previous one (default: 0)")
+    parser.add_argument("--pace", action="store_true", help="use the request pacing of the client (one RequestPacer per battery)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the simulated losses (default: 1)")
+    parser.add_argument("--log", action="store_true", help="keep the debug logging of every request in API.log")
+    args = parser.parse_args()
+
+    # the batteries run in their own process, so the CPU and memory figures are those of the client only
+    parent, child = multiprocessing.Pipe()
+    simulator = multiprocessing.Process(target=simulate, daemon=True,
+                                        args=(args.devices, args.addresses, args.latency, args.loss, args.seed, args.min_gap, child))
+    simulator.start()
+    endpoints = parent.recv()
+
+    from venus_api_v2 import CLI_METHODS, VenusAPIClient, get_multiplexer, get_pacer, close_multiplexer, _poll_device
+    from venus_dispatch import FleetDispatcher
+    if not args.log:  # measure the client, not the writing of API.log
+        logging.getLogger().setLevel(logging.WARNING)
+    methods = [m.strip() for m in args.methods.split(",") if m.strip() and m.strip() in CLI_METHODS]
+    devices = len(endpoints)
+    collector = None
+    if args.mode == "collector":
+        # the client runs in the worker processes, this process only merges their records
+        from venus_collector import FleetCollector
+        collector = FleetCollector(endpoints, args.processes, 0.0, [CLI_METHODS[m][0] for m in methods], args.timeout,
+                                   args.pace, threads=args.workers,
+                                   log_level=logging.DEBUG if args.log else logging.WARNING)
+        collector.start()
+    worker_cpu = {}  # pid -> CPU seconds last seen, kept when a worker is restarted
+
+    def worker_pids():
+        return [process.pid for process, _ in collector.processes.values()] if collector is not None else []
+
+    def total_cpu() -> float:
+        """CPU seconds of this process and of the collector workers"""
+        for pid in worker_pids():
+            worker_cpu[pid] = max(worker_cpu.get(pid, 0.0), process_cpu(pid))
+        return cpu_seconds() + sum(worker_cpu.values())
+    multiplexer = None if args.no_mux or collector is not None else get_multiplexer(args.pool_size)
+    clients = [] if collector is not None else [
+        VenusAPIClient(ip, port, timeout=args.timeout, multiplexer=multiplexer,
+                       pacer=get_pacer(ip, port) if args.pace else None) for ip, port in endpoints]
+    dispatcher = None
+    if args.mode == "fleet":
+        dispatcher = FleetDispatcher(deadband=0)
+        for client in clients:
+            dispatcher.add_unit(f"{client.ip}:{client.port}", client)
+    pool = ThreadPoolExecutor(max_workers=args.workers or devices)
+    targets = random.Random(args.seed)
+
+    def cycle():
+        if collector is not None:
+            received = 0
+            while received < devices:
+                received += len(collector.receive(args.timeout))
+        elif dispatcher is not None:
+            dispatcher.refresh()
+            dispatcher.dispatch(targets.uniform(-1000, 1000) * len(clients))
+        else:
+            list(pool.map(lambda client: _poll_device(client, methods), clients))
+
+    cycle()  # warm up: sockets, threads and RTT estimates
+    base = resources(worker_pids())
+    emit(dict({"event": "start", "devices": args.devices, "mode": args.mode, "multiplexer": multiplexer is not None,
+               "processes": collector.workers if collector is not None else 1}, **base))
+    cycle_times = []
+    window = []
+    cycles = 0
+    start = last_report = time.monotonic()
+    cpu_start = last_cpu = total_cpu()
+    next_cycle = start
+    while time.monotonic() - start < args.duration:
+        began = time.monotonic()
+        cycle()
+        seconds = time.monotonic() - began
+        cycle_times.append(seconds)
+        window.append(seconds)
+        cycles += 1
+        now = time.monotonic()
+        if now - last_report >= args.report:
+            cpu = total_cpu()
+            emit(dict({"event": "progress", "elapsed": round(now - start, 1), "cycles": cycles,
+                       "cycles_per_second": round(len(window) / (now - last_report), 2),
+                       "cycle_p50_ms": round(1000 * percentile(window, 0.5), 1),
+                       "cycle_p99_ms": round(1000 * percentile(window, 0.99), 1),
+                       "cpu_ms_per_device_cycle": round(1000 * (cpu - last_cpu) / (len(window) * devices), 3)},
+                      **resources(worker_pids())))
+            window = []
+            last_report = now
+            last_cpu = cpu
+        if args.interval:
+            next_cycle += args.interval
+            delay = next_cycle - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_cycle = time.monotonic()
+    elapsed = time.monotonic() - start
+    cpu = total_cpu() - cpu_start
+    end = resources(worker_pids())
+
+    requests = timeouts = failures = 0
+    for client in clients:
+        snapshot = client.stats.snapshot()
+        requests += sum(snapshot["requests"].values())
+        timeouts += sum(snapshot["timeouts"].values())
+        failures += sum(snapshot["failures"].values())
+    collected = {}
+    if collector is not None:
+        collector.stop()
+        totals = collector.values()
+        requests, timeouts, failures = totals["requests"], totals["timeouts"], totals["failures"]
+        collected = {"processes": collector.workers, "pipe_bytes_per_record": round(totals["bytes"] / max(1, totals["records"]), 1),
+                     "worker_restarts": totals["restarts"]}
+    pacing = {}
+    if args.pace and clients:
+        pacers = [client.pacer.snapshot() for client in clients]
+        pacing = {"pacer_rate_mean": round(sum(p["rate"] for p in pacers) / len(pacers), 2),
+                  "pacer_depth_mean": round(sum(p["depth"] for p in pacers) / len(pacers), 2),
+                  "pacer_losses": sum(p["losses"] for p in pacers)}
+    pool.shutdown(wait=True)
+    for client in clients:
+        client.close()
+    if dispatcher is not None:
+        dispatcher.close()
+    if multiplexer is not None:
+        close_multiplexer()
+    parent.send("stop")
+    simulator_totals = parent.recv()
+    simulator.join(5)
+
+    emit(dict({"event": "result", "devices": args.devices, "mode": args.mode, "multiplexer": multiplexer is not None,
+               "seconds": round(elapsed, 1), "cycles": cycles,
+               "cycles_per_second": round(cycles / elapsed, 2) if elapsed > 0 else None,
+               "device_polls_per_second": round(cycles * devices / elapsed, 1) if elapsed > 0 else None,
+               "cycle_p50_ms": round(1000 * percentile(cycle_times, 0.5), 1) if cycle_times else None,
+               "cycle_p99_ms": round(1000 * percentile(cycle_times, 0.99), 1) if cycle_times else None,
+               "cycle_max_ms": round(1000 * max(cycle_times), 1) if cycle_times else None,
+               "requests": requests, "timeouts": timeouts, "failures": failures,
+               "cpu_seconds": round(cpu, 2),
+               "cpu_ms_per_device_cycle": round(1000 * cpu / (cycles * devices), 3) if cycles else None,
+               "fds_start": base.get("fds"), "fds_end": end.get("fds"),
+               "sockets_start": base.get("sockets"), "sockets_end": end.get("sockets"),
+               "threads": end["threads"],
+               "rss_start_kb": base.get("rss_kb"), "rss_end_kb": end.get("rss_kb"),
+               "rss_growth_kb": end.get("rss_kb", 0) - base.get("rss_kb", 0)},
+              **dict(simulator_totals, **pacing, **collected)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Headless plugin harness
+
+Runs plugin.py outside Domoticz: the fake DomoticzEx module of fake_domoticz.py
+takes the place of Domoticz and a stand-in battery (fake_venus.py) the place of
+the Marstek Venus, unless a real battery is given. Reports the time taken by
+each plugin callback and by the Domoticz calls, optionally with a cProfile of
+the whole run, so changes can be measured before they go to the production
+Domoticz.
+
+Examples:
+    python3 plugin_harness.py --cycles 20
+    python3 plugin_harness.py --cycles 100 --profile --latency 0.02 --loss 0.05
+    python3 plugin_harness.py --replay traffic.jsonl --profile
+    python3 plugin_harness.py --battery 192.168.1.11 --cycles 3 --echo
+    python3 plugin_harness.py --config my_plugin_config.json --command 50:10
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # plugin.py and the venus_*.py modules
+sys.path.insert(0, HERE)
+
+import fake_domoticz
+from fake_venus import FakeVenus
+
+sys.modules["DomoticzEx"] = fake_domoticz
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+class PluginHarness:
+    """Loads plugin.py with the fake Domoticz and calls its callbacks, timing each call"""
+
+    def __init__(self, address: str, port: int, home: str, parameters=None):
+        self.home = home
+        self.timings = {}  # callback name -> list of seconds
+        fake_domoticz.reset()
+        import plugin
+        self.plugin = plugin
+        plugin.Devices = fake_domoticz.Devices
+        plugin.Parameters = {"Address": address, "Port": str(port), "Mode1": "30", "Mode2": "No", "Mode3": "No",
+                             "Mode4": "800", "Mode5": "No", "Mode6": "Harness ", "HardwareID": 1,
+                             "HomeFolder": home + os.sep, "Name": "Marstek harness", "Key": "Marstek"}
+        plugin.Parameters.update(parameters or {})
+
+    def call(self, name: str, *args):
+        start = time.perf_counter()
+        try:
+            return getattr(self.plugin, name)(*args)
+        finally:
+            self.timings.setdefault(name, []).append(time.perf_counter() - start)
+
+    def command(self, unit: int, level: int, command: str = "Set Level"):
+        device_id = "{:04x}{:04x}".format(int(self.plugin.Parameters["HardwareID"]), unit)
+        self.call("onCommand", device_id, unit, command, level, None)
+
+    def replay(self, path: str) -> dict:
+        """Feed the results of a capture file (python -m venus_api_v2 poll --capture) into processValues"""
+        from venus_api_v2 import CLI_METHODS, replay_capture
+        sources = {getter: source for source, getter in self.plugin.DATASOURCES.items()}
+        source_of = {method: sources.get(getter) for method, getter in CLI_METHODS.values()}
+        plugin = self.plugin._plugin
+
+        def handler(ip, method, result):
+            source = source_of.get(method)
+            if source is not None and result is not None:
+                start = time.perf_counter()
+                plugin.processValues(source, result)
+                self.timings.setdefault("processValues", []).append(time.perf_counter() - start)
+
+        return replay_capture(path, handler=handler)
+
+    def report(self, client_stats=None):
+        units = [unit for device in fake_domoticz.Devices.values() for unit in device.Units.values()]
+        print(f"Devices: {len(units)} units, {sum(unit.updates for unit in units)} updates")
+        print("\nPlugin callbacks (ms):")
+        print(f"  {'callback':<16}{'calls':>7}{'mean':>10}{'p95':>10}{'max':>10}{'total':>11}")
+        for name, seconds in self.timings.items():
+            print(f"  {name:<16}{len(seconds):>7}{1000 * sum(seconds) / len(seconds):>10.2f}"
+                  f"{1000 * percentile(seconds, 0.95):>10.2f}{1000 * max(seconds):>10.2f}{1000 * sum(seconds):>11.1f}")
+        print("\nDomoticz calls:")
+        for name, (count, seconds) in sorted(fake_domoticz.call_summary().items()):
+            print(f"  {name:<16}{count:>7}{1000 * seconds:>10.2f} ms")
+        if client_stats is not None:
+            print("\nRequests per method:", json.dumps(client_stats["requests"]))
+            print("Timeouts per method:", json.dumps(client_stats["timeouts"]))
+        errors = [message for level, message in fake_domoticz.messages if level == "Error"]
+        print(f"\nErrors logged: {len(errors)}")
+        for message in errors[:20]:
+            print("  " + message)
+        return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run plugin.py without Domoticz and measure it")
+    parser.add_argument("--cycles", type=int, default=10, help="number of data cycles (heartbeats) (default: 10)")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between heartbeats (default: 0)")
+    parser.add_argument("--battery", help="real battery as ip[:port] instead of the stand-in battery")
+    parser.add_argument("--latency", type=float, default=0.0, help="reply latency of the stand-in battery in s (default: 0)")
+    parser.add_argument("--loss", type=float, default=0.0, help="packet loss of the stand-in battery (default: 0)")
+    parser.add_argument("--config", help="plugin_config.json to use")
+    parser.add_argument("--home", help="plugin home folder for the state files (default: a new temporary folder)")
+    parser.add_argument("--parameter", action="append", default=[], metavar="NAME=VALUE",
+                        help="hardware parameter, e.g. Mode5=Yes for debug logging (repeatable)")
+    parser.add_argument("--command", action="append", default=[], metavar="UNIT:LEVEL",
+                        help="onCommand Set Level after the cycles, e.g. 50:10 selects auto mode (repeatable)")
+    parser.add_argument("--replay", help="capture file whose results are fed into processValues after the cycles")
+    parser.add_argument("--profile", action="store_true", help="profile the run with cProfile")
+    parser.add_argument("--top", type=int, default=25, help="number of functions in the profile (default: 25)")
+    parser.add_argument("--profile-out", help="also write the profile data to this file (for snakeviz etc.)")
+    parser.add_argument("--echo", action="store_true", help="print the plugin log messages")
+    parser.add_argument("--strict", action="store_true", help="exit code 1 when the plugin logged errors")
+    args = parser.parse_args()
+
+    home = os.path.abspath(args.home) if args.home else tempfile.mkdtemp(prefix="venus-harness-")
+    os.makedirs(home, exist_ok=True)
+    if args.config:
+        shutil.copyfile(args.config, os.path.join(home, "plugin_config.json"))
+    replay = os.path.abspath(args.replay) if args.replay else None
+    os.chdir(home)  # API.log of the library is written here
+    fake_domoticz.echo = args.echo
+
+    venus = None
+    if args.battery:
+        address, _, port = args.battery.partition(":")
+        port = int(port) if port else 30000
+    else:
+        venus = FakeVenus(latency=args.latency, loss=args.loss)
+        address, port = "127.0.0.1", venus.start()
+    parameters = dict(item.split("=", 1) for item in args.parameter)
+    harness = PluginHarness(address, port, home, parameters)
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    start = time.perf_counter()
+    harness.call("onStart")
+    for cycle in range(args.cycles):
+        harness.call("onHeartbeat")
+        if args.interval:
+            time.sleep(args.interval)
+    for spec in args.command:
+        unit, _, level = spec.partition(":")
+        harness.command(int(unit), int(level))
+    if replay:
+        print("Replay:", json.dumps(harness.replay(replay)))
+    stats = harness.plugin._plugin.client.stats.snapshot()
+    harness.call("onStop")
+    elapsed = time.perf_counter() - start
+    if profiler:
+        profiler.disable()
+    if venus is not None:
+        venus.stop()
+
+    print(f"Run of {args.cycles} cycles against {address}:{port} took {elapsed:.3f}s, home folder {home}\n")
+    errors = harness.report(stats)
+    if profiler:
+        print()
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.top)
+        if args.profile_out:
+            profiler.dump_stats(args.profile_out)
+    return 1 if args.strict and errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,7 +13,7 @@ from typing import Dict, Optional
 # Add venus-poller to path
 #sys.path.insert(0, '/home/pi/marstek-venus-bridge/venus-poller')
 
-from venus_api_v2 import VenusAPIClient
+from venus_api_v2 import VenusAPIClient, get_pacer
 
 # Color codes for terminal output
 GREEN = '\033[92m'
@@ -27,7 +27,8 @@ class APITester:
 
     def __init__(self, ip: str, port: int = 30000):
         """Initialize tester with Venus A connection"""
-        self.client = VenusAPIClient(ip=ip, port=port, timeout=5)
+        # the pacer spaces the requests as far as the firmware needs, no sleeps between the calls
+        self.client = VenusAPIClient(ip=ip, port=port, timeout=5, pacer=get_pacer(ip, port))
         self.original_mode = None
         self.test_results = []
 
@@ -348,19 +349,12 @@ class APITester:
         # Read-only tests
         print(f"\n{YELLOW}=== READ-ONLY TESTS ==={RESET}")
         self.test_get_devices()
-        time.sleep(1)
         self.test_wifi_status()
-        time.sleep(1)
         self.test_bluetooth_status()
-        time.sleep(1)
         self.test_battery_status()
-        time.sleep(1)
         self.test_pv_status()
-        time.sleep(1)
         self.test_em_status()
-        time.sleep(1)
         self.test_energy_status()
-        time.sleep(1)
 
         # Mode change tests
         print(f"\n{YELLOW}=== MODE CHANGE TESTS ==={RESET}")
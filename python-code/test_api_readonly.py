@@ -6,14 +6,13 @@ Tests all available API endpoints and verifies responses.
 """
 
 import sys
-import time
 import json
 from typing import Dict, Optional
 
 # Add venus-poller to path
 #sys.path.insert(0, '/home/pi/marstek-venus-bridge/venus-poller')
 
-from venus_api_v2 import VenusAPIClient
+from venus_api_v2 import VenusAPIClient, get_pacer
 
 # Color codes for terminal output
 GREEN = '\033[92m'
@@ -27,7 +26,8 @@ class APITester:
 
     def __init__(self, ip: str, port: int = 30000):
         """Initialize tester with Venus A connection"""
-        self.client = VenusAPIClient(ip=ip, port=port, timeout=5)
+        # the pacer spaces the requests as far as the firmware needs, no sleeps between the calls
+        self.client = VenusAPIClient(ip=ip, port=port, timeout=5, pacer=get_pacer(ip, port))
         self.original_mode = None
         self.test_results = []
 
@@ -231,21 +231,13 @@ class APITester:
         # Read-only tests
         print(f"\n{YELLOW}=== READ-ONLY TESTS ==={RESET}")
         self.test_get_devices()
-        time.sleep(1)
         self.test_wifi_status()
-        time.sleep(1)
         self.test_bluetooth_status()
-        time.sleep(1)
         self.test_battery_status()
-        time.sleep(1)
         self.test_pv_status()
-        time.sleep(1)
         self.test_em_status()
-        time.sleep(1)
         self.test_energy_status()
-        time.sleep(1)
         self.test_get_mode()
-        time.sleep(1)
 
         # Summary
         self.print_summary()
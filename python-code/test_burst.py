@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Burst polling test
+
+Runs the BurstSchedule of venus_burst.py on simulated time: a power step
+between two samples of the normal polling interval does not start a burst, a
+step between samples close together does, and a burst ends after
+max_duration also when the power keeps stepping.
+
+Usage:
+    python3 test_burst.py
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # the venus_*.py modules
+
+from venus_burst import BurstSchedule
+
+# Color codes for terminal output
+GREEN = '\033[92m'
+RED = '\033[91m'
+RESET = '\033[0m'
+
+
+class BurstTester:
+    """Test cases of the BurstSchedule"""
+
+    def __init__(self):
+        self.test_results = []
+
+    def log_test(self, name: str, passed: bool, expected: str, actual: str):
+        status = f"{GREEN}✓ PASS{RESET}" if passed else f"{RED}✗ FAIL{RESET}"
+        print(f"\n{status} {name}")
+        print(f"  Expected: {expected}")
+        print(f"  Actual:   {actual}")
+        self.test_results.append((name, passed))
+
+    @staticmethod
+    def run(burst: BurstSchedule, now: float, step: float):
+        """Poll until the burst ends, the power stepping by `step` W at every poll, returns the end time"""
+        value = 0.0
+        while burst.active():
+            now = burst.next_poll
+            value = step - value
+            burst.observe("total_power", value, now)
+            burst.polled(now)
+        return now
+
+    def test_normal_interval(self):
+        burst = BurstSchedule(normal=300)
+        burst.observe("total_power", 0, now=0)
+        started = burst.observe("total_power", 600, now=300)
+        self.log_test("Step between two normal cycles 5 minutes apart", not started and not burst.active(),
+                      "no burst", f"burst started: {started}, {burst.bursts} bursts")
+
+    def test_close_samples(self):
+        burst = BurstSchedule(normal=300)
+        burst.observe("total_power", 0, now=0)
+        started = burst.observe("total_power", 600, now=10)
+        end = self.run(burst, 10, 0)
+        self.log_test("Step between samples 10 s apart", started and burst.polls >= burst.hold / burst.fast,
+                      "burst, polled every 2 s during the hold time", f"burst started: {started}, ended after {end - 10:.0f} s, {burst.polls} polls")
+
+    def test_max_duration(self):
+        burst = BurstSchedule(normal=300, max_duration=300)
+        burst.trigger("mode change", now=0)
+        end = self.run(burst, 0, 600)  # a busy household: a step at every poll
+        self.log_test("Burst ends after max_duration while the power keeps stepping", end <= 300 + burst.fast,
+                      "ended after at most 300 s", f"ended after {end:.0f} s, {burst.polls} polls")
+
+    def run_all_tests(self) -> bool:
+        self.test_normal_interval()
+        self.test_close_samples()
+        self.test_max_duration()
+        passed = sum(1 for _, p in self.test_results if p)
+        print(f"\n{passed}/{len(self.test_results)} tests passed")
+        return passed == len(self.test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if BurstTester().run_all_tests() else 1)
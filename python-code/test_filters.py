@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Data filter test
+
+Runs the HampelFilter of venus_filters.py against generated signals: spikes
+rejected, a real step accepted, and spikes that keep coming back, two out of
+every three samples, that must not widen the tolerance until they get through.
+
+Usage:
+    python3 test_filters.py
+"""
+
+import os
+import random
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # the venus_*.py modules
+
+from venus_filters import HampelFilter
+
+# Color codes for terminal output
+GREEN = '\033[92m'
+RED = '\033[91m'
+RESET = '\033[0m'
+
+
+class FilterTester:
+    """Test cases of the HampelFilter"""
+
+    def __init__(self):
+        self.test_results = []
+
+    def log_test(self, name: str, passed: bool, expected: str, actual: str):
+        status = f"{GREEN}✓ PASS{RESET}" if passed else f"{RED}✗ FAIL{RESET}"
+        print(f"\n{status} {name}")
+        print(f"  Expected: {expected}")
+        print(f"  Actual:   {actual}")
+        self.test_results.append((name, passed))
+
+    def test_single_spikes(self):
+        noise = random.Random(1)
+        hampel = HampelFilter(window=7, threshold=5, min_deviation=50)
+        rejected = []
+        for i in range(200):
+            value = 5000 if i % 20 == 10 else 1000 + noise.uniform(-20, 20)
+            if not hampel.accept(value):
+                rejected.append(i)
+        self.log_test("Single spikes rejected", rejected == list(range(10, 200, 20)),
+                      "samples 10, 30, .. 190 rejected", f"rejected {rejected}")
+
+    def test_step(self):
+        hampel = HampelFilter(window=7, threshold=5, min_deviation=50)
+        accepted = [hampel.accept(1000 if i < 20 else 2000) for i in range(30)]
+        self.log_test("Real step accepted at its second sample", accepted[20] is False and all(accepted[21:]),
+                      "sample 20 rejected, 21.. accepted", f"{accepted[19:24]}")
+
+    def test_alternating_spikes(self):
+        noise = random.Random(2)
+        hampel = HampelFilter(window=7, threshold=5, min_deviation=50)
+        spikes = normal = 0
+        for i in range(300):
+            if i >= 10 and i % 3:
+                spikes += hampel.accept(3000 if i % 3 == 1 else 7000)  # two different spikes after each normal value
+            else:
+                normal += not hampel.accept(1000 + noise.uniform(-20, 20))
+        self.log_test("Alternating spikes do not widen the tolerance", spikes == 0 and normal == 0,
+                      "0 spikes accepted, 0 normal values rejected",
+                      f"{spikes} spikes accepted, {normal} normal values rejected, window {list(hampel.samples)}")
+
+    def run_all_tests(self) -> bool:
+        self.test_single_spikes()
+        self.test_step()
+        self.test_alternating_spikes()
+        passed = sum(1 for _, p in self.test_results if p)
+        print(f"\n{passed}/{len(self.test_results)} tests passed")
+        return passed == len(self.test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if FilterTester().run_all_tests() else 1)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Schedule optimiser test
+
+Runs the ScheduleOptimiser of venus_optimiser.py on generated prices: the
+state of charge of the plan stays within min_soc and max_soc in every slot,
+also when the prices make a deep discharge halfway the horizon attractive,
+with numpy (when installed) and with the pure Python version.
+
+Usage:
+    python3 test_optimiser.py
+"""
+
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # the venus_*.py modules
+
+import venus_optimiser
+from venus_optimiser import SLOT, ScheduleOptimiser
+
+# Color codes for terminal output
+GREEN = '\033[92m'
+RED = '\033[91m'
+RESET = '\033[0m'
+
+
+class OptimiserTester:
+    """Test cases of the ScheduleOptimiser"""
+
+    def __init__(self):
+        self.test_results = []
+
+    def log_test(self, name: str, passed: bool, expected: str, actual: str):
+        status = f"{GREEN}✓ PASS{RESET}" if passed else f"{RED}✗ FAIL{RESET}"
+        print(f"\n{status} {name}")
+        print(f"  Expected: {expected}")
+        print(f"  Actual:   {actual}")
+        self.test_results.append((name, passed))
+
+    @staticmethod
+    def soc_path(optimiser: ScheduleOptimiser, soc: float, powers):
+        """State of charge in % after each slot of a plan"""
+        hours = SLOT / 3600
+        path = []
+        for power in powers:
+            if power < 0:
+                soc += -power * optimiser.efficiency * hours / optimiser.capacity * 100
+            else:
+                soc -= power / optimiser.efficiency * hours / optimiser.capacity * 100
+            path.append(soc)
+        return path
+
+    def check_limits(self, backend: str):
+        # expensive evening, then a cheap night to charge again: discharging below min_soc would pay off
+        prices = [0.60] * 16 + [0.05] * 16 + [0.30] * 8
+        optimiser = ScheduleOptimiser(capacity=5120, min_soc=50, max_soc=90)
+        powers = optimiser.plan(80, prices, prices, [600] * len(prices))
+        path = self.soc_path(optimiser, 80, powers)
+        lowest, highest = min(path), max(path)
+        # the powers are rounded to 10 W, allow for the rounding
+        self.log_test(f"State of charge within min_soc and max_soc in every slot ({backend})",
+                      lowest >= 50 - 0.5 and highest <= 90 + 0.5 and any(p > 0 for p in powers),
+                      "50% <= SOC <= 90% in all slots, and the battery is used",
+                      f"lowest {lowest:.1f}%, highest {highest:.1f}%, {sum(1 for p in powers if p > 0)} discharge slots")
+
+    def run_all_tests(self) -> bool:
+        if venus_optimiser.numpy is not None:
+            self.check_limits("numpy")
+        numpy, venus_optimiser.numpy = venus_optimiser.numpy, None
+        try:
+            self.check_limits("pure Python")
+        finally:
+            venus_optimiser.numpy = numpy
+        passed = sum(1 for _, p in self.test_results if p)
+        print(f"\n{passed}/{len(self.test_results)} tests passed")
+        return passed == len(self.test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if OptimiserTester().run_all_tests() else 1)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Store-and-forward spool test
+
+Runs the SegmentSpool of venus_spool.py on its own, and the DomoticzWriter of
+venus_writer.py with a spool against the stand-in Domoticz web server of
+fake_domoticz_http.py: updates kept on disk while Domoticz is down and
+replayed in order when it is back, a restart of the program during the
+outage, a record cut off by a power cut, and the drop accounting of a full
+spool.
+
+Usage:
+    python3 test_spool.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # the venus_*.py modules
+sys.path.insert(0, HERE)
+
+from fake_domoticz_http import FakeDomoticzHTTP
+from venus_spool import SegmentSpool
+from venus_writer import DomoticzWriter
+
+# Color codes for terminal output
+GREEN = '\033[92m'
+RED = '\033[91m'
+RESET = '\033[0m'
+
+
+class SpoolTester:
+    """Test cases of the spool, each in a new temporary folder"""
+
+    def __init__(self):
+        self.test_results = []
+        self.folders = []
+
+    def log_test(self, name: str, passed: bool, expected: str, actual: str):
+        status = f"{GREEN}✓ PASS{RESET}" if passed else f"{RED}✗ FAIL{RESET}"
+        print(f"\n{status} {name}")
+        print(f"  Expected: {expected}")
+        print(f"  Actual:   {actual}")
+        self.test_results.append((name, passed))
+
+    def folder(self) -> str:
+        path = tempfile.mkdtemp(prefix="venus-spool-")
+        self.folders.append(path)
+        return path
+
+    def test_order(self):
+        spool = SegmentSpool(self.folder(), segment_bytes=1000)
+        for i in range(500):
+            spool.append({"i": i})
+        received = []
+        while len(spool):
+            batch = spool.read(37)
+            received += [r["i"] for r in batch[:30]]
+            spool.commit(30)  # the last 7 of each batch are read again
+        stats = spool.stats()
+        spool.close()
+        self.log_test("Records read back in order, in batches", received == list(range(500)) and stats["bytes"] < 1000,
+                      "0..499 once each, delivered segments removed",
+                      f"{len(received)} records, in order: {received == sorted(received)}, stats {stats}")
+
+    def test_restart(self):
+        path = self.folder()
+        spool = SegmentSpool(path, segment_bytes=1000)
+        for i in range(100):
+            spool.append({"i": i})
+        spool.read(40)
+        spool.commit()
+        spool.close()
+        last = max(spool.segments)
+        with open(spool._path(last), "ab") as f:
+            f.write(b'{"i":100,"cut')  # power cut while writing
+        spool = SegmentSpool(path, segment_bytes=1000)
+        spool.append({"i": 101})
+        received = [r["i"] for r in spool.read(1000)]
+        stats = spool.stats()
+        spool.close()
+        self.log_test("Restart continues at the cursor, a cut off record is removed",
+                      received == list(range(40, 100)) + [101] and stats["corrupt"] == 1,
+                      "40..99 and 101, 1 corrupt record",
+                      f"{received[:2]}..{received[-2:]} ({len(received)} records), stats {stats}")
+
+    def test_full(self):
+        spool = SegmentSpool(self.folder(), segment_bytes=1000, max_bytes=4000)
+        dropped = sum(spool.append({"i": i, "v": "x" * 20}) for i in range(1000))
+        remaining = []
+        while len(spool):
+            remaining += [r["i"] for r in spool.read(100)]
+            spool.commit()
+        stats = spool.stats()
+        spool.close()
+        self.log_test("Full spool drops the oldest records and counts them",
+                      dropped == stats["dropped"] and dropped + len(remaining) == 1000 and remaining[-1] == 999
+                      and remaining == sorted(remaining),
+                      "dropped + kept = 1000, the newest kept, in order",
+                      f"{dropped} dropped, {len(remaining)} kept ({remaining[0]}..{remaining[-1]}), stats {stats}")
+
+    def test_outage(self):
+        server = FakeDomoticzHTTP()
+        port = server.start()
+        spool = SegmentSpool(self.folder(), "domoticz")
+        writer = DomoticzWriter(f"http://127.0.0.1:{port}", batch_size=20, max_backoff=0.5, spool=spool)
+        writer.start()
+        server.fail = True
+        writer.update_device(7, 0, "0;1000")
+        while writer.stats()["failed"] == 0:  # spooling from the first failure on
+            time.sleep(0.01)
+        for i in range(1, 300):
+            writer.update_device(7, 0, f"{i};{1000 + i}")  # the same device, every value counts
+            time.sleep(0.002)
+        spooled = writer.stats()["spool"]
+        server.fail = False
+        start = time.monotonic()
+        flushed = writer.flush(10)
+        seconds = time.monotonic() - start
+        writer.close()
+        server.stop()
+        values = [int(p["svalue"].split(";")[0]) for p in server.received("udevice") if "svalue" in p]
+        after = values[-300:]  # the requests during the outage were answered with ERR
+        stats = writer.stats()
+        self.log_test("Updates during an outage replayed in order",
+                      flushed and after == list(range(300)) and stats["dropped"] == 0 and spooled > 250,
+                      "all 300 values of device 7 delivered in order after the outage, none dropped",
+                      f"{spooled} spooled, replayed in {seconds:.2f} s, last 300 in order: {after == list(range(300))}, stats {stats}")
+
+    def test_writer_restart(self):
+        server = FakeDomoticzHTTP()
+        port = server.start()
+        path = self.folder()
+        server.fail = True
+        writer = DomoticzWriter(f"http://127.0.0.1:{port}", max_backoff=0.5, spool=SegmentSpool(path, "domoticz"))
+        writer.start()
+        for idx in range(50):
+            writer.update_device(idx, 0, str(idx))
+        time.sleep(0.3)
+        writer.close(timeout=0.5)  # stopped during the outage
+        server.fail = False
+        server.requests.clear()
+        writer = DomoticzWriter(f"http://127.0.0.1:{port}", spool=SegmentSpool(path, "domoticz"))
+        writer.start()
+        flushed = writer.flush(5)
+        writer.close()
+        server.stop()
+        idxs = [int(p["idx"]) for p in server.received("udevice")]
+        self.log_test("Spool of a stopped writer sent after the next start",
+                      flushed and idxs == list(range(50)),
+                      "devices 0..49 in order",
+                      f"{len(idxs)} updates, in order: {idxs == list(range(50))}, stats {writer.stats()}")
+
+    def run_all_tests(self) -> bool:
+        try:
+            self.test_order()
+            self.test_restart()
+            self.test_full()
+            self.test_outage()
+            self.test_writer_restart()
+        finally:
+            for path in self.folders:
+                shutil.rmtree(path, ignore_errors=True)
+        passed = sum(1 for _, p in self.test_results if p)
+        print(f"\n{passed}/{len(self.test_results)} tests passed")
+        return passed == len(self.test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if SpoolTester().run_all_tests() else 1)
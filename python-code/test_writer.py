@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Domoticz writer test
+
+Runs the DomoticzWriter of venus_writer.py against the stand-in Domoticz web
+server of fake_domoticz_http.py: delivery of updates and notifications, one
+keep-alive connection for many requests, queueing that does not wait for a
+slow server, coalescing per device, and retries after the server was down.
+
+Usage:
+    python3 test_writer.py
+"""
+
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))  # the venus_*.py modules
+sys.path.insert(0, HERE)
+
+from fake_domoticz_http import FakeDomoticzHTTP
+from venus_writer import DomoticzWriter
+
+# Color codes for terminal output
+GREEN = '\033[92m'
+RED = '\033[91m'
+RESET = '\033[0m'
+
+
+class WriterTester:
+    """Test cases of the DomoticzWriter, each against a new stand-in server"""
+
+    def __init__(self):
+        self.test_results = []
+
+    def log_test(self, name: str, passed: bool, expected: str, actual: str):
+        status = f"{GREEN}✓ PASS{RESET}" if passed else f"{RED}✗ FAIL{RESET}"
+        print(f"\n{status} {name}")
+        print(f"  Expected: {expected}")
+        print(f"  Actual:   {actual}")
+        self.test_results.append((name, passed))
+
+    def setup(self, delay: float = 0.0, **kwargs):
+        server = FakeDomoticzHTTP(delay=delay)
+        port = server.start()
+        writer = DomoticzWriter(f"http://127.0.0.1:{port}", **kwargs)
+        writer.start()
+        return server, writer
+
+    def test_delivery(self):
+        server, writer = self.setup()
+        writer.update_device(12, 0, "55")
+        writer.notify("Venus comms working again", "Problem solved")
+        flushed = writer.flush(5)
+        writer.close()
+        server.stop()
+        self.log_test("Update and notification delivered", flushed and server.devices.get(12) == (0, "55")
+                      and server.notifications == [("Venus comms working again", "Problem solved")],
+                      "device 12 = (0, '55'), 1 notification",
+                      f"devices {server.devices}, notifications {server.notifications}, stats {writer.stats()}")
+
+    def test_keep_alive(self):
+        server, writer = self.setup()
+        for idx in range(200):
+            writer.update_device(idx, 0, str(idx))
+        start = time.monotonic()
+        writer.flush(20)
+        seconds = time.monotonic() - start
+        writer.close()
+        server.stop()
+        self.log_test("200 updates over one keep-alive connection", len(server.devices) == 200 and server.connections == 1,
+                      "200 devices, 1 connection",
+                      f"{len(server.devices)} devices, {server.connections} connection(s), {1000 * seconds / 200:.2f} ms per request")
+
+    def test_slow_server(self):
+        server, writer = self.setup(delay=0.5)
+        start = time.monotonic()
+        for i in range(100):
+            writer.update_device(1 + i % 5, 0, str(i))  # 5 devices, updated 20 times each
+        queued = time.monotonic() - start
+        writer.flush(10)
+        writer.close()
+        server.stop()
+        stats = writer.stats()
+        latest = {idx: svalue for idx, (_, svalue) in server.devices.items()}
+        self.log_test("Slow server does not block, updates coalesced", queued < 0.1 and latest == {1: "95", 2: "96", 3: "97", 4: "98", 5: "99"}
+                      and len(server.received("udevice")) < 100,
+                      "100 updates queued in < 100 ms, last value of each of the 5 devices written, fewer than 100 requests",
+                      f"queued in {1000 * queued:.1f} ms, {len(server.received('udevice'))} requests, latest {latest}, stats {stats}")
+
+    def test_server_down(self):
+        server, writer = self.setup(retries=3, max_backoff=1)
+        server.fail = True
+        writer.notify("ATTENTION: Venus communication timeout", "Please check")
+        time.sleep(0.5)
+        failed = writer.stats()["failed"]
+        server.fail = False
+        writer.flush(5)
+        writer.close()
+        server.stop()
+        stats = writer.stats()
+        self.log_test("Notification retried after a failure", failed >= 1 and len(server.notifications) == 1 and stats["retried"] >= 1,
+                      "failed at least once, then delivered once",
+                      f"notifications {server.notifications}, stats {stats}")
+
+    def test_closed(self):
+        server, writer = self.setup()
+        writer.close()
+        queued = writer.update_device(1, 0, "1")
+        server.stop()
+        self.log_test("No queueing after close", not queued and not server.requests, "False, no requests",
+                      f"{queued}, {len(server.requests)} requests")
+
+    def run_all_tests(self) -> bool:
+        self.test_delivery()
+        self.test_keep_alive()
+        self.test_slow_server()
+        self.test_server_down()
+        self.test_closed()
+        passed = sum(1 for _, p in self.test_results if p)
+        print(f"\n{passed}/{len(self.test_results)} tests passed")
+        return passed == len(self.test_results)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if WriterTester().run_all_tests() else 1)
@@ -0,0 +1,232 @@
+"""
+Venus grid analytics
+
+Streaming aggregates of the per-phase grid power reported by EM.GetStatus:
+rolling averages, quarter-hour peak demand (as used for capacity tariffs),
+phase imbalance and the split of import and export energy. Every sample is
+processed in constant (amortized) time, history is never scanned again.
+LoadProfile keeps the typical power per quarter of an hour of the day, used as
+the forecast of the schedule optimiser.
+"""
+
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+PHASES = ("a_power", "b_power", "c_power", "total_power")
+# Rolling average windows in seconds, with the name suffix used in values()
+WINDOWS = ((60, "1m"), (300, "5m"), (900, "15m"))
+# Length of a demand period in seconds (capacity tariffs use quarter-hour averages)
+DEMAND_PERIOD = 900
+# Gaps between samples longer than this are not integrated (seconds)
+MAX_GAP = 900
+# Number of quarters of an hour in a day, the slots of the load profile
+PROFILE_SLOTS = 96
+
+
+class RollingMean:
+    """Time-weighted mean over a sliding time window"""
+
+    __slots__ = ("window", "samples", "area", "duration")
+
+    def __init__(self, window: float):
+        self.window = window
+        self.samples = deque()  # (end time, duration, value * duration)
+        self.area = 0.0
+        self.duration = 0.0
+
+    def add(self, value: float, duration: float, now: float):
+        """Add a value that was valid during the last `duration` seconds up to `now`"""
+        self.samples.append((now, duration, value * duration))
+        self.area += value * duration
+        self.duration += duration
+        # drop samples that ended before the window, each sample is removed only once
+        while self.samples and self.samples[0][0] <= now - self.window:
+            _, old_duration, old_area = self.samples.popleft()
+            self.area -= old_area
+            self.duration -= old_duration
+
+    def mean(self) -> Optional[float]:
+        return self.area / self.duration if self.duration > 0 else None
+
+
+class PhaseAnalytics:
+    """Rolling averages, peak demand, imbalance and import/export energy of the EM grid power"""
+
+    def __init__(self):
+        self.means = {phase: [RollingMean(window) for window, _ in WINDOWS] for phase in PHASES}
+        self.last_time = None
+        self.last_values = None
+        self.import_energy = 0.0    # Wh
+        self.export_energy = 0.0    # Wh
+        self.period_start = None    # start of the current demand period
+        self.period_energy = 0.0    # Wh imported in the current demand period
+        self.month = None
+        self.peak_demand = 0.0      # W, highest demand period average of this month
+        self.peak_time = None
+
+    def update(self, values: Dict, now: Optional[float] = None):
+        """
+        Process one EM.GetStatus sample
+
+        Args:
+            values: dictionary with a_power, b_power, c_power and total_power in W
+            now: time.time() of the sample (default: now)
+        """
+        now = time.time() if now is None else now
+        sample = {phase: float(values[phase]) for phase in PHASES if isinstance(values.get(phase), (int, float))}
+        month = time.strftime("%Y-%m", time.localtime(now))
+        if month != self.month:
+            self.month = month
+            self.peak_demand = 0.0
+            self.peak_time = None
+        period_start = now - now % DEMAND_PERIOD
+        if self.period_start is None:
+            self.period_start = period_start
+
+        if self.last_time is not None and 0 < now - self.last_time <= MAX_GAP:
+            # the previous sample is taken as valid until this one (zero order hold)
+            duration = now - self.last_time
+            for phase, value in self.last_values.items():
+                for mean in self.means[phase]:
+                    mean.add(value, duration, now)
+            total = self.last_values.get("total_power")
+            if total is not None:
+                # split the interval at a demand period boundary
+                before = max(0.0, min(duration, period_start - self.last_time))
+                energy = total * duration / 3600
+                if total >= 0:
+                    self.import_energy += energy
+                    self.period_energy += total * before / 3600
+                else:
+                    self.export_energy -= energy
+                if period_start != self.period_start:
+                    self._close_period()
+                    if total >= 0:
+                        self.period_energy = total * (duration - before) / 3600
+                    self.period_start = period_start
+                elif total >= 0:
+                    self.period_energy += total * (duration - before) / 3600
+        elif period_start != self.period_start:
+            self._close_period()
+            self.period_start = period_start
+        self.last_time = now
+        self.last_values = sample
+
+    def _close_period(self):
+        demand = self.period_energy * 3600 / DEMAND_PERIOD
+        if demand > self.peak_demand:
+            self.peak_demand = demand
+            self.peak_time = self.period_start
+        self.period_energy = 0.0
+
+    def imbalance(self) -> Optional[float]:
+        """Largest deviation of a phase from the average of the 3 phases, in % of that average (1 minute means)"""
+        phases = [self.means[phase][0].mean() for phase in PHASES[:3]]
+        if None in phases:
+            return None
+        phases = [abs(p) for p in phases]
+        average = sum(phases) / 3
+        if average < 1:
+            return 0.0
+        return 100 * max(abs(p - average) for p in phases) / average
+
+    def values(self) -> Dict:
+        """
+        Current aggregates
+
+        Returns:
+            {
+                "grid_power_1m": 412.5, "grid_power_5m": 380.1, "grid_power_15m": 366.0,  # W, total_power averages
+                "a_power_1m": ..., (same for every phase and window)
+                "demand_current": 350.2,       # W, average of the running demand period so far
+                "peak_demand": 1830.0,         # W, highest demand period average this month
+                "phase_imbalance": 12.5,       # %
+                "grid_import_energy": 1520.3,  # Wh since the start
+                "grid_export_energy": 820.0    # Wh since the start
+            }
+        """
+        result = {}
+        for phase in PHASES:
+            prefix = "grid_power" if phase == "total_power" else phase
+            for (window, suffix), mean in zip(WINDOWS, self.means[phase]):
+                value = mean.mean()
+                if value is not None:
+                    result[f"{prefix}_{suffix}"] = value
+        if self.last_time is not None and self.period_start is not None:
+            elapsed = max(self.last_time - self.period_start, 1.0)
+            result["demand_current"] = self.period_energy * 3600 / elapsed
+        result["peak_demand"] = self.peak_demand
+        imbalance = self.imbalance()
+        if imbalance is not None:
+            result["phase_imbalance"] = imbalance
+        result["grid_import_energy"] = self.import_energy
+        result["grid_export_energy"] = self.export_energy
+        return result
+
+    def state(self) -> Dict:
+        """Values to be persisted (peak and energies), see restore()"""
+        return {"month": self.month, "peak_demand": self.peak_demand, "peak_time": self.peak_time,
+                "import_energy": self.import_energy, "export_energy": self.export_energy}
+
+    def restore(self, state: Dict):
+        for key in ("month", "peak_demand", "peak_time", "import_energy", "export_energy"):
+            if key in state:
+                setattr(self, key, state[key])
+
+
+class LoadProfile:
+    """Average power per quarter of an hour of the day, exponentially weighted over the days"""
+
+    __slots__ = ("alpha", "slots", "slot", "slot_sum", "slot_count")
+
+    def __init__(self, alpha: float = 0.3):
+        """
+        Initialize profile
+
+        Args:
+            alpha: Weight of the latest day in the average of a slot (default: 0.3)
+        """
+        self.alpha = alpha
+        self.slots = [None] * PROFILE_SLOTS
+        self.slot = None        # (date, slot number) being collected
+        self.slot_sum = 0.0
+        self.slot_count = 0
+
+    def update(self, value: float, now: Optional[float] = None) -> bool:
+        """
+        Add a power sample
+
+        Returns:
+            True when a quarter of an hour was completed and added to the profile
+        """
+        now = time.time() if now is None else now
+        local = time.localtime(now)
+        slot = (local.tm_yday, (local.tm_hour * 60 + local.tm_min) // 15)
+        completed = False
+        if slot != self.slot:
+            if self.slot is not None and self.slot_count:
+                mean = self.slot_sum / self.slot_count
+                old = self.slots[self.slot[1]]
+                self.slots[self.slot[1]] = mean if old is None else old + self.alpha * (mean - old)
+                completed = True
+            self.slot = slot
+            self.slot_sum = 0.0
+            self.slot_count = 0
+        self.slot_sum += value
+        self.slot_count += 1
+        return completed
+
+    def forecast(self, start: float, count: int) -> List[Optional[float]]:
+        """Expected power of `count` quarters of an hour from time `start`, None for slots without history"""
+        local = time.localtime(start)
+        first = (local.tm_hour * 60 + local.tm_min) // 15
+        return [self.slots[(first + i) % PROFILE_SLOTS] for i in range(count)]
+
+    def state(self) -> Dict:
+        """Values to be persisted, see restore()"""
+        return {"alpha": self.alpha, "slots": self.slots}
+
+    def restore(self, state: Dict):
+        if len(state.get("slots", ())) == PROFILE_SLOTS:
+            self.slots = list(state["slots"])
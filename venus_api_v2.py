@@ -5,11 +5,17 @@ Handles communication with the local Venus A device via UDP JSON-RPC protocol.
 Based on Marstek Device Open API (Rev 1.0)
 """
 
+import argparse
 import socket
 import json
 import logging
+import sys
+import threading
 import time
-from typing import Dict, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Tuple
 import logging
 
 logging.basicConfig(
@@ -20,24 +26,843 @@ level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+# Upper bounds (seconds) of the round trip time histogram buckets
+RTT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the attempts per call histogram buckets
+ATTEMPT_BUCKETS = (1, 2, 3, 4, 5)
+
+
+class Histogram:
+    """Fixed bucket histogram (cumulative counts as used by Prometheus/OpenMetrics)"""
+
+    def __init__(self, buckets=RTT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last entry is the +Inf bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """List of (upper bound, cumulative count), ending with (inf, count)"""
+        result = []
+        total = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+    def copy(self) -> "Histogram":
+        other = Histogram(self.buckets)
+        other.counts = list(self.counts)
+        other.count = self.count
+        other.sum = self.sum
+        return other
+
+    def __sub__(self, previous: "Histogram") -> "Histogram":
+        """Observations made since an earlier copy of the same histogram"""
+        other = Histogram(self.buckets)
+        other.counts = [a - b for a, b in zip(self.counts, previous.counts)]
+        other.count = self.count - previous.count
+        other.sum = self.sum - previous.sum
+        return other
+
+    def merge(self, other: "Histogram"):
+        """Add the observations of a histogram with the same buckets"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile by linear interpolation within the bucket
+
+        Args:
+            q: Quantile between 0 and 1 (e.g. 0.95)
+
+        Returns:
+            Estimated value, the highest finite bound if it falls in the +Inf bucket, None if empty
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        lower = 0.0
+        total = 0
+        for bound, n in zip(self.buckets, self.counts):
+            if n and total + n >= rank:
+                return lower + (bound - lower) * (rank - total) / n
+            total += n
+            lower = bound
+        return float(self.buckets[-1])
+
+
+class ClientStats:
+    """
+    Request counters of a VenusAPIClient, per API method
+
+    Hooks added with add_hook() are called for every event as hook(event, method, value):
+        "rtt"          value = round trip time in seconds of an answered attempt
+        "timeout"      value = timeout in seconds that expired
+        "decode_error" value = number of bytes received
+        "call"         value = number of attempts, after a call returned a result
+        "failure"      value = number of attempts, after a call returned no result
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}       # calls of _send_request
+        self.failures = {}       # calls that returned no result
+        self.timeouts = {}       # attempts that timed out
+        self.retries = {}        # attempts after the first one
+        self.decode_errors = {}  # replies that were no valid JSON
+        self.bytes_sent = {}
+        self.bytes_received = {}
+        self.rtt = {}            # Histogram of round trip times of answered attempts
+        self.attempts = {}       # Histogram of attempts per call
+        self.hooks = []
+
+    def add_hook(self, hook):
+        """Register a callable hook(event, method, value), called on the thread doing the request"""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _event(self, event: str, method: str, value):
+        for hook in self.hooks:
+            try:
+                hook(event, method, value)
+            except Exception as e:
+                logger.warning(f"Instrumentation hook failed: {e}")
+
+    def _add(self, counter: Dict, method: str, n: int = 1):
+        counter[method] = counter.get(method, 0) + n
+
+    def _observe(self, histograms: Dict, method: str, value: float, buckets):
+        histogram = histograms.get(method)
+        if histogram is None:
+            histogram = histograms[method] = Histogram(buckets)
+        histogram.observe(value)
+
+    def record_call(self, method: str, attempts: int, success: bool):
+        with self.lock:
+            self._add(self.requests, method)
+            self._observe(self.attempts, method, attempts, ATTEMPT_BUCKETS)
+            if attempts > 1:
+                self._add(self.retries, method, attempts - 1)
+            if not success:
+                self._add(self.failures, method)
+        if self.hooks:
+            self._event("call" if success else "failure", method, attempts)
+
+    def record_timeout(self, method: str, timeout: float):
+        with self.lock:
+            self._add(self.timeouts, method)
+        if self.hooks:
+            self._event("timeout", method, timeout)
+
+    def record_decode_error(self, method: str, size: int):
+        with self.lock:
+            self._add(self.decode_errors, method)
+        if self.hooks:
+            self._event("decode_error", method, size)
+
+    def record_bytes(self, method: str, sent: int, received: int):
+        with self.lock:
+            self._add(self.bytes_sent, method, sent)
+            self._add(self.bytes_received, method, received)
+
+    def record_rtt(self, method: str, seconds: float):
+        with self.lock:
+            self._observe(self.rtt, method, seconds, RTT_BUCKETS)
+        if self.hooks:
+            self._event("rtt", method, seconds)
+
+    def snapshot(self) -> Dict:
+        """Consistent copy of all counters, safe to use from another thread"""
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "failures": dict(self.failures),
+                "timeouts": dict(self.timeouts),
+                "retries": dict(self.retries),
+                "decode_errors": dict(self.decode_errors),
+                "bytes_sent": dict(self.bytes_sent),
+                "bytes_received": dict(self.bytes_received),
+                "rtt": {method: h.copy() for method, h in self.rtt.items()},
+                "attempts": {method: h.copy() for method, h in self.attempts.items()},
+            }
+
+    @staticmethod
+    def summary(current: Dict, previous: Optional[Dict] = None) -> Dict:
+        """
+        Summarize two snapshots (or one snapshot since the start) over all methods
+
+        Returns:
+            {
+                "requests": 12,
+                "success_rate": 91.7,   # percentage of calls that returned a result, None without calls
+                "timeouts": 2,
+                "rtt_p50": 0.081,       # seconds, None without answered attempts
+                "rtt_p95": 0.240
+            }
+        """
+        previous = previous or {}
+
+        def total(counter):
+            return sum(current[counter].values()) - sum(previous.get(counter, {}).values())
+
+        rtt = Histogram(RTT_BUCKETS)
+        for method, histogram in current["rtt"].items():
+            earlier = previous.get("rtt", {}).get(method)
+            rtt.merge(histogram - earlier if earlier else histogram)
+        requests = total("requests")
+        return {
+            "requests": requests,
+            "success_rate": 100.0 * (requests - total("failures")) / requests if requests else None,
+            "timeouts": total("timeouts"),
+            "rtt_p50": rtt.quantile(0.5),
+            "rtt_p95": rtt.quantile(0.95),
+        }
+
+
+class RTTEstimator:
+    """
+    Smoothed round trip time and variance of one device, as TCP does (RFC 6298)
+
+    The timeout for the next attempt is SRTT + 4 * RTTVAR, doubled after every timeout
+    until a reply is received again, and kept between min_timeout and max_timeout.
+    """
+
+    ALPHA = 0.125       # gain of the smoothed RTT
+    BETA = 0.25         # gain of the RTT variance
+    K = 4
+    GRANULARITY = 0.05  # minimum variance term in seconds
+
+    def __init__(self, min_timeout: float = 0.3, max_timeout: float = 10.0):
+        """
+        Initialize estimator
+
+        Args:
+            min_timeout: Floor of the timeout in seconds (default: 0.3)
+            max_timeout: Ceiling of the timeout in seconds, also used before the first reply (default: 10.0)
+        """
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.backoff = 1
+
+    def observe(self, rtt: float):
+        """Update the estimate with the round trip time of an answered attempt"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.backoff = 1
+
+    def timed_out(self):
+        """Back off exponentially after an attempt timed out"""
+        if self.srtt is not None and self.timeout() < self.max_timeout:
+            self.backoff *= 2
+
+    def timeout(self) -> float:
+        """Timeout in seconds for the next attempt"""
+        if self.srtt is None:
+            return self.max_timeout
+        rto = (self.srtt + max(self.GRANULARITY, self.K * self.rttvar)) * self.backoff
+        return min(self.max_timeout, max(self.min_timeout, rto))
+
+    def state(self) -> Dict:
+        """Estimate to be persisted, see restore()"""
+        return {"srtt": self.srtt, "rttvar": self.rttvar}
+
+    def restore(self, state: Dict):
+        """Continue from a saved estimate, the backoff starts again at 1"""
+        if state.get("srtt") is not None and state.get("rttvar") is not None:
+            self.srtt = float(state["srtt"])
+            self.rttvar = float(state["rttvar"])
+            self.backoff = 1
+
+
+class RequestPacer:
+    """
+    Request rate and depth limit of one device, learned from the replies (token bucket with AIMD)
+
+    The firmware drops requests that arrive too close together. Before each attempt a client takes a
+    token from the bucket, which fills at `rate` tokens per second, and no more than `depth` requests are
+    in flight at a time. The bucket holds one token, so requests are at least 1/rate seconds apart. The
+    pacer starts unconstrained: until the first loss no tokens are needed and the depth is max_depth, so
+    the requests of a snapshot go out at once as long as the device answers. A timeout halves rate and
+    depth (multiplicative decrease), at most once per RECOVERY seconds so one burst of losses counts once.
+    After PROBE_WINDOW answered attempts in a row, while the limit was actually reached, both are raised
+    a step again, the rate by RATE_STEP (additive increase). The pacer so settles just below the highest
+    rate the device answers without loss.
+
+    One pacer is shared by all clients of the same device, see get_pacer().
+    """
+
+    PROBE_WINDOW = 20   # answered attempts in a row before probing a step higher
+    RATE_STEP = 1.0     # requests per second added per probe after a loss
+    DECREASE = 0.5      # factor applied to rate and depth after a loss
+    RECOVERY = 1.0      # seconds after a decrease in which further losses are not counted again
+
+    def __init__(self, rate: Optional[float] = None, depth: Optional[int] = None, min_rate: float = 0.5,
+                 max_rate: float = 50.0, max_depth: int = 8):
+        """
+        Initialize pacer
+
+        Args:
+            rate: Initial requests per second (default: None = max_rate)
+            depth: Initial number of requests in flight (default: None = max_depth)
+            min_rate: Lowest rate after losses (default: 0.5)
+            max_rate: Highest rate probed (default: 50.0)
+            max_depth: Highest depth probed (default: 8)
+        """
+        self.condition = threading.Condition()
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_depth = max_depth
+        self.rate = max_rate if rate is None else min(max(rate, min_rate), max_rate)
+        self.depth = max_depth if depth is None else min(max(int(depth), 1), max_depth)
+        self.tokens = 1.0
+        self.filled = time.monotonic()
+        self.inflight = 0
+        self.answered = 0           # answered attempts since the last probe or loss
+        self.limited = False        # a request had to wait since the last probe or loss
+        self.decreased = None       # time.monotonic() of the last decrease
+        self.losses = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _fill(self, now: float):
+        self.tokens = min(1.0, self.tokens + (now - self.filled) * self.rate)
+        self.filled = now
+
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        """Wait for a token and a free place in flight, False when the deadline came first"""
+        with self.condition:
+            start = now = time.monotonic()
+            while True:
+                self._fill(now)
+                if self.inflight < self.depth and (self.tokens >= 1.0 or self.losses == 0):
+                    break
+                self.limited = True
+                wait = (1.0 - self.tokens) / self.rate if self.inflight < self.depth else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return False
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.condition.wait(wait)
+                now = time.monotonic()
+            if self.losses:
+                self.tokens -= 1.0
+            self.inflight += 1
+            if now > start:
+                self.waits += 1
+                self.wait_seconds += now - start
+            return True
+
+    def release(self, answered: Optional[bool]):
+        """
+        Return the place in flight after an attempt
+
+        Args:
+            answered: True = reply received, False = timed out (counted as a loss),
+                      None = no verdict (e.g. the timeout was shortened by a deadline)
+        """
+        with self.condition:
+            self.inflight -= 1
+            if answered:
+                self.answered += 1
+                if self.answered >= self.PROBE_WINDOW:
+                    if self.limited:
+                        self.rate = min(self.max_rate, self.rate + self.RATE_STEP)
+                        self.depth = min(self.max_depth, self.depth + 1)
+                    self.answered = 0
+                    self.limited = False
+            elif answered is False:
+                now = time.monotonic()
+                if self.decreased is None or now - self.decreased >= self.RECOVERY:
+                    self.losses += 1
+                    self.rate = max(self.min_rate, self.rate * self.DECREASE)
+                    self.depth = max(1, int(self.depth * self.DECREASE))
+                    self.decreased = now
+                self.answered = 0
+                self.limited = False
+            self.condition.notify_all()
+
+    def snapshot(self) -> Dict:
+        """Current limits and counters"""
+        with self.condition:
+            return {"rate": self.rate, "depth": self.depth, "inflight": self.inflight, "losses": self.losses,
+                    "waits": self.waits, "wait_seconds": self.wait_seconds}
+
+    def state(self) -> Dict:
+        """Learned limits to be persisted, see restore()"""
+        with self.condition:
+            return {"rate": self.rate, "depth": self.depth, "losses": self.losses}
+
+    def restore(self, state: Dict):
+        """Continue from saved limits, only when they were learned from losses, else start unconstrained"""
+        with self.condition:
+            if not state.get("losses"):
+                return
+            self.losses = int(state["losses"])
+            if state.get("rate") is not None:
+                self.rate = min(max(float(state["rate"]), self.min_rate), self.max_rate)
+            if state.get("depth") is not None:
+                self.depth = min(max(int(state["depth"]), 1), self.max_depth)
+
+
+_pacers = {}
+_pacers_lock = threading.Lock()
+
+
+def get_pacer(ip: str, port: int = 30000, **kwargs) -> RequestPacer:
+    """Process-wide RequestPacer of a device, created on first use with the RequestPacer arguments given"""
+    with _pacers_lock:
+        pacer = _pacers.get((ip, port))
+        if pacer is None:
+            pacer = _pacers[(ip, port)] = RequestPacer(**kwargs)
+        return pacer
+
+
+class UDPMultiplexer:
+    """
+    UDP sockets shared by all clients of the process
+
+    Requests of all clients go out over a small, fixed pool of sockets. A receive thread per
+    socket hands each reply to the waiting request, matched on source IP address and request id.
+    Request ids are unique within the multiplexer, so clients talking to the same device do not
+    get each other's replies, and requests to different devices overlap without waiting.
+    """
+
+    def __init__(self, pool_size: int = 1):
+        """
+        Initialize multiplexer and start the receive threads
+
+        Args:
+            pool_size: Number of sockets (default: 1), devices are spread over the sockets by address
+        """
+        self.lock = threading.Lock()
+        self.pending = {}  # (ip, request id) -> Future
+        self.request_id = 0
+        self.stray_replies = 0
+        self.decode_errors = 0
+        self.running = True
+        self.sockets = []
+        self.threads = []
+        for i in range(pool_size):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("", 0))
+            sock.settimeout(0.5)  # lets the receive thread notice close()
+            thread = threading.Thread(target=self._receive, args=(sock,), name=f"venus-udp-{i}", daemon=True)
+            self.sockets.append(sock)
+            self.threads.append(thread)
+            thread.start()
+
+    def next_request_id(self) -> int:
+        with self.lock:
+            self.request_id += 1
+            return self.request_id
+
+    def submit(self, ip: str, port: int, message: bytes, request_id: int) -> Future:
+        """
+        Send a request without waiting
+
+        Returns:
+            Future with result (reply bytes, decoded reply), call cancel() to stop waiting
+        """
+        future = Future()
+        key = (ip, request_id)
+        with self.lock:
+            self.pending[key] = future
+        future.add_done_callback(lambda f: self._forget(key))
+        sock = self.sockets[hash((ip, port)) % len(self.sockets)]
+        try:
+            sock.sendto(message, (ip, port))
+        except OSError:
+            future.cancel()
+            raise
+        logger.debug(f"Sent to {ip}:{port}: {message}")
+        return future
+
+    def exchange(self, ip: str, port: int, message: bytes, request_id: int, timeout: float):
+        """
+        Send a request and wait for the reply
+
+        Returns:
+            (reply bytes, decoded reply)
+
+        Raises:
+            socket.timeout when no reply was received within timeout seconds
+        """
+        future = self.submit(ip, port, message, request_id)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise socket.timeout(f"no reply from {ip}:{port} within {timeout:.2f}s")
+
+    def _forget(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def _receive(self, sock: socket.socket):
+        while self.running:
+            try:
+                data, addr = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                break  # socket closed
+            try:
+                response = json.loads(data.decode('utf-8'))
+                key = (addr[0], response.get("id"))
+            except (ValueError, AttributeError):
+                self.decode_errors += 1
+                logger.warning(f"Invalid reply from {addr}: {data[:100]}")
+                continue
+            with self.lock:
+                future = self.pending.get(key)
+            if future is None or not future.set_running_or_notify_cancel():
+                self.stray_replies += 1  # late reply after a timeout, or a reply to another process
+                logger.debug(f"Reply without waiting request from {addr}: {response}")
+                continue
+            future.set_result((data, response))
+
+    def close(self):
+        """Stop the receive threads and close the sockets, waiting requests are cancelled"""
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        for sock in self.sockets:
+            sock.close()
+        with self.lock:
+            pending = list(self.pending.values())
+        for future in pending:
+            future.cancel()
+
+
+_multiplexer = None
+_multiplexer_lock = threading.Lock()
+
+
+def get_multiplexer(pool_size: int = 1) -> UDPMultiplexer:
+    """Process-wide UDPMultiplexer, created on first use"""
+    global _multiplexer
+    with _multiplexer_lock:
+        if _multiplexer is None:
+            _multiplexer = UDPMultiplexer(pool_size)
+        return _multiplexer
+
+
+def close_multiplexer():
+    """Close the process-wide UDPMultiplexer, if it was created"""
+    global _multiplexer
+    with _multiplexer_lock:
+        if _multiplexer is not None:
+            _multiplexer.close()
+            _multiplexer = None
+
+
+class TrafficCapture:
+    """
+    Records every request and reply of one or more clients in a JSON lines file
+
+    The first line holds the wall clock time at the start, the other lines one attempt each:
+        {"ip": "192.168.1.11", "port": 30000, "method": "EM.GetStatus", "attempt": 1,
+         "t_send": 0.0, "t_recv": 0.084, "request": "{...}", "reply": "{...}", "status": "ok"}
+    Times are time.monotonic() seconds since the start of the capture, status is "ok",
+    "timeout" or "error" (with an "error" message). reply is None unless status is "ok".
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.file = open(path, "a", encoding="utf-8")
+        self._write({"capture": 1, "wall": time.time()})
+
+    def _write(self, record: Dict):
+        with self.lock:
+            self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self.file.flush()
+
+    def record(self, client: "VenusAPIClient", method: str, attempt: int, message: bytes,
+               sent_at: float, received_at: float, reply: Optional[bytes], status: str, error: str = None):
+        record = {
+            "ip": client.ip, "port": client.port, "method": method, "attempt": attempt,
+            "t_send": round(sent_at - self.start, 6), "t_recv": round(received_at - self.start, 6),
+            "request": message.decode("utf-8"),
+            "reply": reply.decode("utf-8", "replace") if reply is not None else None,
+            "status": status,
+        }
+        if error:
+            record["error"] = error
+        self._write(record)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class ReplayExhausted(Exception):
+    """The capture holds no more replies for the requested method"""
+
+
+class ReplayTransport:
+    """
+    Answers client requests from a TrafficCapture file instead of the network
+
+    Pass it as multiplexer to a VenusAPIClient. Each request gets the next captured attempt of the same
+    device and method: the captured reply (with the request id of the new request), a timeout or an error.
+    The attempts are taken in the order they were sent, also when the capture holds them in the order
+    they completed (concurrent requests). Safe to use from several threads, as get_snapshot() does.
+    With realtime=True every attempt takes as long as it took when captured.
+    """
+
+    def __init__(self, path: str, realtime: bool = False):
+        self.realtime = realtime
+        self.lock = threading.Lock()
+        self.request_id = 0
+        self.records = []
+        self.queues = {}  # (ip, port, method) -> list of records, in send order
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if "method" in record:
+                    self.records.append(record)
+        self.records.sort(key=lambda record: record["t_send"])  # written when completed, replayed as sent
+        for record in self.records:
+            self.queues.setdefault((record["ip"], record["port"], record["method"]), []).append(record)
+        self.positions = {key: 0 for key in self.queues}
+
+    def next_request_id(self) -> int:
+        with self.lock:
+            self.request_id += 1
+            return self.request_id
+
+    def exchange(self, ip: str, port: int, message: bytes, request_id: int, timeout: float):
+        method = json.loads(message.decode("utf-8"))["method"]
+        key = (ip, port, method)
+        with self.lock:
+            position = self.positions.get(key, 0)
+            queue = self.queues.get(key, [])
+            if position >= len(queue):
+                raise ReplayExhausted(f"no more captured attempts for {method} of {ip}:{port}")
+            self.positions[key] = position + 1
+        record = queue[position]
+        if self.realtime:
+            time.sleep(min(timeout, record["t_recv"] - record["t_send"]))
+        if record["status"] == "timeout":
+            raise socket.timeout("captured timeout")
+        if record["status"] != "ok":
+            raise OSError(record.get("error", "captured error"))
+        data = record["reply"].encode("utf-8")
+        try:  # give the reply the id of the new request, as the device would
+            response = json.loads(data.decode("utf-8"))
+            response["id"] = request_id
+            data = json.dumps(response, separators=(",", ":")).encode("utf-8")
+        except ValueError:
+            pass  # undecodable replies are replayed as captured
+        return data, None
+
+
+def replay_capture(path: str, realtime: bool = False, handler=None) -> Dict:
+    """
+    Feed a capture through a VenusAPIClient, call by call as they were made
+
+    Args:
+        path: TrafficCapture file
+        realtime: Keep the captured timing between calls and of each attempt (default: False = full speed)
+        handler: Optional callable handler(ip, method, result), called with each call result
+
+    Returns:
+        {"calls": 120, "results": 117, "seconds": 0.031, "calls_per_second": 3870.9}
+    """
+    transport = ReplayTransport(path, realtime)
+    clients = {}
+    calls = results = 0
+    start = time.monotonic()
+    first_send = None
+    for record in transport.records:
+        if record["attempt"] != 1:
+            continue  # retries are done by the client itself
+        if realtime:
+            if first_send is None:
+                first_send = record["t_send"]
+            delay = start + record["t_send"] - first_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        key = (record["ip"], record["port"])
+        client = clients.get(key)
+        if client is None:
+            client = clients[key] = VenusAPIClient(record["ip"], record["port"], multiplexer=transport)
+        params = json.loads(record["request"]).get("params")
+        try:
+            result = client._send_request(record["method"], params, retry_delay=None if realtime else 0)
+        except ReplayExhausted:
+            break
+        calls += 1
+        if result is not None:
+            results += 1
+        if handler is not None:
+            handler(record["ip"], record["method"], result)
+    seconds = time.monotonic() - start
+    return {"calls": calls, "results": results, "seconds": round(seconds, 6),
+            "calls_per_second": round(calls / seconds, 1) if seconds > 0 else None}
+
+
+# Status of a snapshot value
+FRESH = "fresh"      # received in this snapshot
+STALE = "stale"      # not received this time, the value of an earlier reply
+MISSING = "missing"  # never received, or the earlier reply is older than max_age
+
+# Methods of a snapshot by default: all status methods of a data cycle
+SNAPSHOT_METHODS = ("EM.GetStatus", "Bat.GetStatus", "PV.GetStatus", "ES.GetStatus", "ES.GetMode")
+
+
+class SnapshotField(NamedTuple):
+    """One value of a Snapshot"""
+    value: Any
+    timestamp: Optional[float]  # time.time() when the reply holding the value was received, None when missing
+    status: str                 # FRESH, STALE or MISSING
+
+
+class MethodResult(NamedTuple):
+    """Result of one API method in a Snapshot"""
+    result: Optional[Mapping]   # read-only result without "id", None when missing
+    timestamp: Optional[float]  # time.time() when the reply was received, None when missing
+    status: str                 # FRESH, STALE or MISSING
+
+
+class Snapshot(NamedTuple):
+    """
+    Immutable view of one device, see VenusAPIClient.get_snapshot()
+
+    Every field carries the receive time and status of the method that reported it, so a
+    consumer can tell a value of this cycle from one kept from an earlier cycle.
+    """
+    device: str         # "ip:port"
+    taken: float        # time.time() when the requests were sent
+    seconds: float      # time until the last reply or give-up
+    results: Mapping    # API method -> MethodResult
+
+    def status(self, method: str) -> str:
+        result = self.results.get(method)
+        return result.status if result is not None else MISSING
+
+    def result(self, method: str, stale: bool = False) -> Optional[Mapping]:
+        """Result of a method, None when it is not fresh (or missing, with stale=True)"""
+        result = self.results.get(method)
+        if result is None or result.status == MISSING or (result.status == STALE and not stale):
+            return None
+        return result.result
+
+    def field(self, method: str, name: str) -> SnapshotField:
+        result = self.results.get(method)
+        if result is None or result.result is None or name not in result.result:
+            return SnapshotField(None, None, MISSING)
+        return SnapshotField(result.result[name], result.timestamp, result.status)
+
+    def fields(self) -> Iterator[Tuple[str, str, SnapshotField]]:
+        """All values as (method, field, SnapshotField), missing methods are left out"""
+        for method, result in self.results.items():
+            if result.result is not None:
+                for name, value in result.result.items():
+                    yield method, name, SnapshotField(value, result.timestamp, result.status)
+
+    def missed(self) -> List[str]:
+        """Methods without a fresh result"""
+        return [method for method, result in self.results.items() if result.status != FRESH]
+
+    def as_dict(self) -> Dict:
+        """Plain dictionary, e.g. for JSON"""
+        return {"device": self.device, "ts": round(self.taken, 3), "seconds": round(self.seconds, 4),
+                "methods": {method: {"status": result.status,
+                                     "ts": round(result.timestamp, 3) if result.timestamp is not None else None,
+                                     "result": dict(result.result) if result.result is not None else None}
+                            for method, result in self.results.items()}}
+
+
 class VenusAPIClient:
     """Client for communicating with Venus A via UDP JSON-RPC"""
 
-    def __init__(self, ip: str, port: int = 30000, timeout: int = 10):
+    def __init__(self, ip: str, port: int = 30000, timeout: int = 10,
+                 adaptive_timeout: bool = True, min_timeout: float = 0.3,
+                 multiplexer: Optional["UDPMultiplexer"] = None, capture: Optional["TrafficCapture"] = None,
+                 pacer: Optional[RequestPacer] = None):
         """
         Initialize Venus API client
 
         Args:
             ip: Venus A IP address
             port: UDP port (default: 30000)
-            timeout: Request timeout in seconds
+            timeout: Request timeout in seconds, the ceiling when adaptive_timeout is on
+            adaptive_timeout: Derive the timeout of each attempt from the measured round trip times (default: True)
+            min_timeout: Floor of the adaptive timeout in seconds (default: 0.3)
+            multiplexer: Shared UDPMultiplexer (see get_multiplexer()) or another transport with the same
+                         next_request_id() and exchange() methods (e.g. ReplayTransport),
+                         default None = a new socket per request
+            capture: TrafficCapture recording every request and reply (default: None)
+            pacer: RequestPacer limiting the request rate to the device (see get_pacer()), default None = no limit
         """
         self.ip = ip
         self.port = port
         self.timeout = timeout
         self.request_id = 0
+        self.stats = ClientStats()
+        self.rtt_estimator = RTTEstimator(min_timeout, timeout) if adaptive_timeout else None
+        self.multiplexer = multiplexer
+        self.capture = capture
+        self.pacer = pacer
+        self.deadline = None  # time.monotonic() after which requests give up, used when no deadline is passed
+        self.last_results = {}  # API method -> (result, time.time() received), the stale values of get_snapshot()
+        self.pool = None        # threads of get_snapshot(), see close()
+        self.pool_size = 0
+        self.id_lock = threading.Lock()
+
+    def attempt_timeout(self) -> float:
+        """Timeout in seconds for the next attempt"""
+        if self.rtt_estimator is None:
+            return self.timeout
+        return self.rtt_estimator.timeout()
+
+    def _exchange(self, message: bytes, request_id: int, timeout: float):
+        """
+        Send one request datagram and wait for the reply
+
+        Returns:
+            (reply bytes, decoded reply or None if not decoded yet)
+
+        Raises:
+            socket.timeout when no reply was received within timeout seconds
+        """
+        if self.multiplexer is not None:
+            return self.multiplexer.exchange(self.ip, self.port, message, request_id, timeout)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(timeout)
+            sock.sendto(message, (self.ip, self.port))
+            logger.debug(f"Sent to {self.ip}:{self.port}: {message}")
+            data, addr = sock.recvfrom(65535)
+        return data, None
 
-    def _send_request(self, method: str, params: Dict = None, max_retries: int = 2, retry_delay: float = 3.0) -> Optional[Dict]:
+    def _send_request(self, method: str, params: Dict = None, max_retries: int = 2, retry_delay: Optional[float] = None,
+                      deadline: Optional[float] = None) -> Optional[Dict]:
         """
         Send UDP JSON-RPC request to Venus A with retry logic
 
@@ -45,7 +870,10 @@ class VenusAPIClient:
             method: API method name (e.g., "Bat.GetStatus")
             params: Method parameters (default: {"id": 0})
             max_retries: Maximum number of retry attempts (default: 2)
-            retry_delay: Delay in seconds between retries (default: 3.0)
+            retry_delay: Delay in seconds between retries (default: 3.0, or the current
+                         attempt timeout when it is shorter and adaptive_timeout is on)
+            deadline: time.monotonic() value after which no attempts or retry delays are done,
+                      the timeout of the last attempt is shortened to end there (default: self.deadline)
 
         Returns:
             Response dictionary or None on error
@@ -53,78 +881,126 @@ class VenusAPIClient:
         if params is None:
             params = {"id": 0}
 
+        if deadline is None:
+            deadline = self.deadline
         last_error = None
+        attempts = 0
 
         for attempt in range(max_retries + 1):
             # Wait before retry (but not on first attempt)
             if attempt > 0:
-                logger.info(f"Retry {attempt}/{max_retries} for {method} after {retry_delay}s")
-                time.sleep(retry_delay)
+                delay = retry_delay
+                if delay is None:
+                    delay = 3.0 if self.rtt_estimator is None else min(3.0, self.attempt_timeout())
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    last_error = f"{last_error}, no time left for a retry before the deadline"
+                    break
+                logger.info(f"Retry {attempt}/{max_retries} for {method} after {delay:.2f}s")
+                time.sleep(delay)
 
-            self.request_id += 1
+            if self.multiplexer is not None:
+                request_id = self.multiplexer.next_request_id()
+            else:
+                with self.id_lock:  # get_snapshot() sends from several threads
+                    self.request_id += 1
+                    request_id = self.request_id
             request = {
-                "id": self.request_id,
+                "id": request_id,
                 "method": method,
                 "params": params
             }
 
-            sock = None
+            if self.pacer is not None and not self.pacer.acquire(deadline):
+                last_error = "Deadline passed while waiting for the request pacer" if last_error is None else \
+                    f"{last_error}, deadline passed while waiting for the request pacer"
+                break
+            timeout = self.attempt_timeout()
+            clipped = False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    last_error = "Deadline passed before the request could be sent"
+                    if self.pacer is not None:
+                        self.pacer.release(None)
+                    break
+                clipped = remaining < timeout
+                timeout = min(timeout, remaining)
+            attempts += 1
+            answered = None  # verdict for the pacer: reply received, lost, or unknown
             try:
-                # Create UDP socket
-                logger.debug(f"Setting up socket")
-                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                sock.settimeout(self.timeout)
-                logger.debug(f"Socket setup done")
-
-                # Send request
+                # Send request and receive response
                 message = json.dumps(request).encode('utf-8')
-                sock.sendto(message, (self.ip, self.port))
-                logger.debug(f"Sent to {self.ip}:{self.port}: {request}")
-
-                # Receive response
-                data, addr = sock.recvfrom(65535)
-                response = json.loads(data.decode('utf-8'))
-                logger.debug(f"Received from {addr}: {response}")
+                data = None
+                sent_at = time.monotonic()
+                data, response = self._exchange(message, request_id, timeout)
+                answered = True
+                rtt = time.monotonic() - sent_at
+                if self.capture is not None:
+                    self.capture.record(self, method, attempts, message, sent_at, sent_at + rtt, data, "ok")
+                self.stats.record_rtt(method, rtt)
+                if self.rtt_estimator is not None:
+                    self.rtt_estimator.observe(rtt)
+                self.stats.record_bytes(method, len(message), len(data))
+                if response is None:
+                    try:
+                        response = json.loads(data.decode('utf-8'))
+                    except ValueError:
+                        self.stats.record_decode_error(method, len(data))
+                        raise
+                logger.debug(f"Received from {self.ip}:{self.port}: {response}")
 
                 # Check for errors
                 if "error" in response:
                     error = response['error']
                     logger.error(f"API error: {error}")
                     # Don't retry on permanent errors (method not found, invalid params, feature not supported)
+                    self.stats.record_call(method, attempts, False)
                     return None
 
                 # Success
                 if attempt > 0:
                     logger.info(f"Request succeeded on attempt {attempt + 1}")
+                self.stats.record_call(method, attempts, True)
                 return response.get("result")
 
             except socket.timeout:
-                last_error = f"Timeout waiting for response from {self.ip}:{self.port}"
+                last_error = f"Timeout ({timeout:.2f}s) waiting for response from {self.ip}:{self.port}"
                 logger.warning(last_error)
+                self.stats.record_timeout(method, timeout)
+                if self.capture is not None:
+                    self.capture.record(self, method, attempts, message, sent_at, time.monotonic(), None, "timeout")
+                if self.rtt_estimator is not None and not clipped:
+                    self.rtt_estimator.timed_out()
+                if not clipped:
+                    answered = False
                 # Continue to retry
                 continue
 
             except Exception as e:
                 last_error = f"Error communicating with Venus A: {e}"
                 logger.warning(last_error)
+                if self.capture is not None and data is None:  # replies that could not be decoded are already captured
+                    self.capture.record(self, method, attempts, message, sent_at, time.monotonic(), None, "error", str(e))
                 # Continue to retry
                 continue
 
             finally:
-                if sock:
-                    try:
-                        sock.close()
-                    except:
-                        pass
+                if self.pacer is not None:
+                    self.pacer.release(answered)
 
         # All retries exhausted
-        logger.error(f"Request failed after {max_retries + 1} attempts: {last_error}")
+        self.stats.record_call(method, attempts, False)
+        logger.error(f"Request {method} failed after {attempts} attempts: {last_error}")
         return None
 
-    def get_devices(self, mac: str) -> Optional[Dict]:
+    def get_devices(self, mac: str, deadline: Optional[float] = None) -> Optional[Dict]:
         """
         Get devices (Marstek.GetDevice)
 
+        Args:
+            mac: BLE MAC address of the device, or "0"
+            deadline: time.monotonic() value after which retries stop (default: self.deadline)
+
         Returns:
             {
                 "device": "venusC,
@@ -138,7 +1014,7 @@ class VenusAPIClient:
         params = {
             "ble_mac": mac,
         }
-        return self._send_request("Marstek.GetDevice",params)
+        return self._send_request("Marstek.GetDevice",params,deadline=deadline)
 
     def get_wifi_status(self) -> Optional[Dict]:
         """
@@ -168,10 +1044,13 @@ class VenusAPIClient:
         """
         return self._send_request("BLE.GetStatus")
 
-    def get_battery_status(self) -> Optional[Dict]:
+    def get_battery_status(self, deadline: Optional[float] = None) -> Optional[Dict]:
         """
         Get battery status (Bat.GetStatus)
 
+        Args:
+            deadline: time.monotonic() value after which retries stop (default: self.deadline)
+
         Returns:
             {
                 "soc": 98,
@@ -182,7 +1061,7 @@ class VenusAPIClient:
                 "rated_capacity": 2560.0
             }
         """
-        return self._send_request("Bat.GetStatus")
+        return self._send_request("Bat.GetStatus", deadline=deadline)
 
     def get_pv_status(self) -> Optional[Dict]:
         """
@@ -232,17 +1111,76 @@ class VenusAPIClient:
         """
         return self._send_request("ES.GetStatus")
 
+    def get_snapshot(self, methods: Sequence[str] = SNAPSHOT_METHODS, deadline: Optional[float] = None,
+                     max_age: Optional[float] = None) -> Snapshot:
+        """
+        Get the results of several methods at once, as one consistent view of the device
+
+        The requests are sent at the same time, one thread each (over the shared socket when the client
+        has a multiplexer), so the snapshot takes about one round trip instead of one per method.
+        A method without reply keeps its last result, marked stale.
+
+        Args:
+            methods: API methods without parameters (default: SNAPSHOT_METHODS)
+            deadline: time.monotonic() value after which retries stop (default: self.deadline)
+            max_age: Results older than this number of seconds are missing instead of stale (default: None = any age)
+
+        Returns:
+            Snapshot with a MethodResult per method
+        """
+        methods = tuple(methods)
+        taken = time.time()
+        start = time.monotonic()
+        if len(methods) == 1:
+            replies = [self._timed_request(methods[0], deadline)]
+        else:
+            replies = list(self._executor(len(methods)).map(lambda method: self._timed_request(method, deadline), methods))
+        now = time.time()
+        results = {}
+        for method, (result, received) in zip(methods, replies):
+            if result is not None:
+                result = dict(result)
+                result.pop("id", None)
+                self.last_results[method] = (result, received)
+                results[method] = MethodResult(MappingProxyType(result), received, FRESH)
+                continue
+            last = self.last_results.get(method)
+            if last is not None and (max_age is None or now - last[1] <= max_age):
+                results[method] = MethodResult(MappingProxyType(last[0]), last[1], STALE)
+            else:
+                results[method] = MethodResult(None, None, MISSING)
+        return Snapshot(f"{self.ip}:{self.port}", taken, time.monotonic() - start, MappingProxyType(results))
+
+    def _timed_request(self, method: str, deadline: Optional[float]):
+        result = self._send_request(method, deadline=deadline)
+        return result, time.time()
+
+    def _executor(self, workers: int) -> ThreadPoolExecutor:
+        if self.pool is None or self.pool_size < workers:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
+            self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"venus-{self.ip}")
+            self.pool_size = workers
+        return self.pool
+
+    def close(self):
+        """Stop the threads of get_snapshot(), a later snapshot starts them again"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
     def get_data(self) -> Optional[Dict]:
         """
         Fetch comprehensive data from Venus A
 
-        Combines battery and energy system data into single dictionary.
+        Combines battery and energy system data into single dictionary, both requested at the same time.
 
         Returns:
             Dictionary with Venus data or None on error
         """
-        bat_data = self.get_battery_status()
-        es_data = self.get_energy_status()
+        snapshot = self.get_snapshot(("Bat.GetStatus", "ES.GetStatus"))
+        bat_data = snapshot.result("Bat.GetStatus")
+        es_data = snapshot.result("ES.GetStatus")
 
         if not bat_data and not es_data:
             logger.error("Failed to fetch any data from Venus A")
@@ -423,3 +1361,222 @@ class VenusAPIClient:
             }
         """
         return self._send_request("ES.GetMode")
+
+
+# Short method names used on the command line: name : (API method, VenusAPIClient getter)
+CLI_METHODS = {
+    "bat": ("Bat.GetStatus", "get_battery_status"),
+    "pv": ("PV.GetStatus", "get_pv_status"),
+    "em": ("EM.GetStatus", "get_em_status"),
+    "es": ("ES.GetStatus", "get_energy_status"),
+    "mode": ("ES.GetMode", "get_mode"),
+    "wifi": ("Wifi.GetStatus", "get_wifi_status"),
+    "ble": ("BLE.GetStatus", "get_bluetooth_status"),
+}
+
+
+def discover(port: int = 30000, timeout: float = 3.0, address: str = "255.255.255.255") -> List[Dict]:
+    """
+    Find Marstek devices on the local network (Marstek.GetDevice broadcast, par 2.2.2)
+
+    Args:
+        port: UDP port of the Open API (default: 30000)
+        timeout: Seconds to wait for replies (default: 3.0)
+        address: Broadcast address (default: 255.255.255.255)
+
+    Returns:
+        List of Marstek.GetDevice results, one per device that replied
+    """
+    request = {"id": 1, "method": "Marstek.GetDevice", "params": {"ble_mac": "0"}}
+    devices = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.sendto(json.dumps(request).encode('utf-8'), (address, port))
+        end = time.monotonic() + timeout
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, addr = sock.recvfrom(65535)
+                result = json.loads(data.decode('utf-8')).get("result")
+            except socket.timeout:
+                break
+            except ValueError:
+                continue
+            if result:
+                result.setdefault("ip", addr[0])
+                devices.append(result)
+    return devices
+
+
+def _parse_device(spec: str, default_port: int):
+    """Split "ip[:port]" """
+    ip, _, port = spec.partition(":")
+    return ip, int(port) if port else default_port
+
+
+def _emit(record: Dict):
+    """Write one compact JSON line to stdout and flush it immediately"""
+    sys.stdout.write(json.dumps(record, separators=(",", ":")) + "\n")
+    sys.stdout.flush()
+
+
+def _poll_device(client: VenusAPIClient, methods: List[str], deadline: Optional[float] = None) -> Dict:
+    return _snapshot_record(client.get_snapshot([CLI_METHODS[name][0] for name in methods], deadline), methods)
+
+
+def _snapshot_record(snapshot: Snapshot, methods: List[str]) -> Dict:
+    """Output record of the poll command: the fresh result per CLI method name, None when not received"""
+    record = {"ts": round(snapshot.taken, 3), "device": snapshot.device}
+    for name in methods:
+        result = snapshot.result(CLI_METHODS[name][0])
+        record[name] = dict(result) if result is not None else None
+    record["cycle_ms"] = round(snapshot.seconds * 1000, 1)
+    return record
+
+
+def _run_poll(args, only_changes: bool) -> int:
+    methods = [m.strip() for m in args.methods.split(",") if m.strip()]
+    unknown = [m for m in methods if m not in CLI_METHODS]
+    if unknown:
+        sys.stderr.write(f"Unknown method(s) {unknown}, choose from {sorted(CLI_METHODS)}\n")
+        return 2
+    multiplexer = get_multiplexer()  # one socket for all devices, however many are polled
+    capture = TrafficCapture(args.capture) if args.capture else None
+    clients = [VenusAPIClient(ip, port, timeout=args.timeout, multiplexer=multiplexer, capture=capture,
+                              pacer=get_pacer(ip, port) if args.pace else None)
+               for ip, port in (_parse_device(d, args.port) for d in args.device)]
+    last = {}
+    cycle = 0
+    next_cycle = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+            while args.count == 0 or cycle < args.count:
+                deadline = time.monotonic() + args.interval  # a cycle does not run into the next one
+                futures = [pool.submit(_poll_device, client, methods, deadline) for client in clients]
+                for future in as_completed(futures):  # write each device as soon as it is done
+                    record = future.result()
+                    if only_changes:
+                        values = {k: v for k, v in record.items() if k not in ("ts", "cycle_ms")}
+                        if last.get(record["device"]) == values:
+                            continue
+                        last[record["device"]] = values
+                    _emit(record)
+                cycle += 1
+                next_cycle += args.interval
+                delay = next_cycle - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_cycle = time.monotonic()  # cycle took longer than the interval, do not try to catch up
+    finally:
+        for client in clients:
+            client.close()
+    return 0
+
+
+def _run_snapshot(args) -> int:
+    names = [m.strip() for m in args.methods.split(",") if m.strip()]
+    unknown = [m for m in names if m not in CLI_METHODS]
+    if unknown:
+        sys.stderr.write(f"Unknown method(s) {unknown}, choose from {sorted(CLI_METHODS)}\n")
+        return 2
+    ip, port = _parse_device(args.device, args.port)
+    client = VenusAPIClient(ip, port, timeout=args.timeout, multiplexer=get_multiplexer(),
+                            pacer=get_pacer(ip, port) if args.pace else None)
+    deadline = time.monotonic() + args.deadline if args.deadline else None
+    try:
+        snapshot = client.get_snapshot([CLI_METHODS[name][0] for name in names], deadline)
+    finally:
+        client.close()
+    _emit(snapshot.as_dict())
+    return 0 if not snapshot.missed() else 1
+
+
+def _run_set_mode(args) -> int:
+    ip, port = _parse_device(args.device, args.port)
+    client = VenusAPIClient(ip, port, timeout=args.timeout)
+    if args.mode == "auto":
+        success = client.set_auto_mode()
+    elif args.mode == "ai":
+        success = client.set_ai_mode()
+    elif args.mode == "manual":
+        success = client.set_manual_mode(args.power, args.period, args.start, args.end, args.week, 1)
+    elif args.mode == "passive":
+        success = client.set_passive_mode(args.power, args.countdown)
+    else:
+        success = client.set_ups_mode(args.power)
+    _emit({"ts": round(time.time(), 3), "device": f"{ip}:{port}", "mode": args.mode, "success": success})
+    return 0 if success else 1
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point, see python -m venus_api_v2 --help"""
+    parser = argparse.ArgumentParser(prog="python -m venus_api_v2",
+                                     description="Marstek Venus Open API client, output as JSON lines on stdout")
+    parser.add_argument("--port", type=int, default=30000, help="default UDP port of the devices (default: 30000)")
+    parser.add_argument("--timeout", type=float, default=5, help="maximum request timeout in seconds (default: 5)")
+    parser.add_argument("--pace", action="store_true", help="limit the request rate per device, learned from the lost requests")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("discover", help="find devices with a Marstek.GetDevice broadcast")
+    cmd.add_argument("--wait", type=float, default=3.0, help="seconds to wait for replies (default: 3)")
+    cmd.add_argument("--broadcast", default="255.255.255.255", help="broadcast address")
+
+    for name, interval, methods, help_text in (
+            ("poll", 60.0, "bat,pv,em,es,mode", "poll devices and write one JSON object per device per cycle"),
+            ("watch", 2.0, "em,mode", "poll devices fast and only write a JSON object when the values changed")):
+        cmd = commands.add_parser(name, help=help_text)
+        cmd.add_argument("device", nargs="+", help="device as ip or ip:port, several devices are polled concurrently")
+        cmd.add_argument("--interval", type=float, default=interval, help=f"seconds between cycles (default: {interval:g})")
+        cmd.add_argument("--methods", default=methods, help=f"comma separated, from {','.join(CLI_METHODS)} (default: {methods})")
+        cmd.add_argument("--count", type=int, default=0, help="stop after this number of cycles (default: 0 = never)")
+        cmd.add_argument("--capture", help="also record all requests and replies in this file, for replay")
+
+    cmd = commands.add_parser("snapshot", help="get several methods at once, with the receive time and status of each")
+    cmd.add_argument("device", help="device as ip or ip:port")
+    cmd.add_argument("--methods", default="em,bat,pv,es,mode", help=f"comma separated, from {','.join(CLI_METHODS)} (default: em,bat,pv,es,mode)")
+    cmd.add_argument("--deadline", type=float, default=None, help="seconds after which retries stop (default: none)")
+
+    cmd = commands.add_parser("set-mode", help="change the operating mode")
+    cmd.add_argument("device", help="device as ip or ip:port")
+    cmd.add_argument("mode", choices=("auto", "ai", "manual", "passive", "ups"))
+    cmd.add_argument("--power", type=int, default=0, help="power in W for manual/passive/ups mode")
+    cmd.add_argument("--period", type=int, default=9, help="manual mode period number 0-9 (default: 9)")
+    cmd.add_argument("--start", default="00:00", help="manual mode start time HH:MM (default: 00:00)")
+    cmd.add_argument("--end", default="23:59", help="manual mode end time HH:MM (default: 23:59)")
+    cmd.add_argument("--week", type=int, default=127, help="manual mode week bitmask (default: 127 = all days)")
+    cmd.add_argument("--countdown", type=int, default=300, help="passive mode duration in seconds (default: 300)")
+
+    cmd = commands.add_parser("replay", help="feed a capture file through the client and report the throughput")
+    cmd.add_argument("file", help="file written with --capture")
+    cmd.add_argument("--realtime", action="store_true", help="keep the captured timing (default: full speed)")
+    cmd.add_argument("--results", action="store_true", help="also write every call result as a JSON line")
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "discover":
+            for device in discover(args.port, args.wait, args.broadcast):
+                _emit(device)
+            return 0
+        if args.command == "replay":
+            handler = None
+            if args.results:
+                handler = lambda ip, method, result: _emit({"device": ip, "method": method, "result": result})
+            _emit(replay_capture(args.file, args.realtime, handler))
+            return 0
+        if args.command in ("poll", "watch"):
+            return _run_poll(args, only_changes=(args.command == "watch"))
+        if args.command == "snapshot":
+            return _run_snapshot(args)
+        return _run_set_mode(args)
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:  # output closed by the consumer
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
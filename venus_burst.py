@@ -0,0 +1,131 @@
+"""
+Venus burst polling
+
+After a mode change (ES.SetMode) or a large step in the grid or battery power
+the values move fast for a while: the battery ramps, the household load
+settles. A BurstSchedule polls the methods that show this at a fast rate for
+a short hold time, then stretches the interval step by step until it is back
+at the normal poll interval. So a mode change is confirmed within seconds and
+the transient is recorded at a high resolution, without polling fast all the
+time.
+"""
+
+import time
+from typing import Dict, Optional
+
+# Methods polled during a burst, they hold the mode and the power flows
+BURST_METHODS = ("EM.GetStatus", "ES.GetMode", "ES.GetStatus")
+
+# Fields of which a large step starts a burst (grid power, battery power)
+STEP_FIELDS = ("total_power", "ongrid_power", "es_ongrid_power")
+
+
+class BurstSchedule:
+    """Fast polling after a change, decaying back to the normal interval"""
+
+    def __init__(self, normal: float, fast: float = 2.0, hold: float = 30.0, decay: float = 1.5,
+                 step: float = 500.0, max_gap: float = 30.0, max_duration: float = 300.0):
+        """
+        Initialize schedule
+
+        Args:
+            normal: Normal poll interval in seconds, a burst ends when its interval reaches it
+            fast: Poll interval in seconds during the hold time (default: 2.0)
+            hold: Seconds after the last trigger during which the fast interval is kept (default: 30.0)
+            decay: Factor by which the interval grows after the hold time, per poll (default: 1.5)
+            step: Change of a STEP_FIELDS value between two samples that starts a burst, in W (default: 500.0)
+            max_gap: Samples further apart than this, in seconds, are not compared: a step between them is
+                     no sign of a transient still going on (default: 30.0)
+            max_duration: Seconds after which a burst ends, also while it is triggered again (default: 300.0)
+        """
+        self.normal = normal
+        self.fast = fast
+        self.hold = hold
+        self.decay = max(1.01, decay)
+        self.step = step
+        self.max_gap = max_gap
+        self.max_duration = max_duration
+        self.last = {}            # field -> (last value seen, time.monotonic() it was seen)
+        self.started = None       # time.monotonic() of the start of the running burst
+        self.triggered = None     # time.monotonic() of the last trigger
+        self.interval = None      # current burst interval, None when no burst is running
+        self.next_poll = None     # time.monotonic() of the next burst poll
+        self.reason = ""
+        self.bursts = 0
+        self.polls = 0
+
+    def active(self) -> bool:
+        return self.interval is not None
+
+    def trigger(self, reason: str, now: Optional[float] = None) -> bool:
+        """
+        Start a burst, or restart the hold time of the running one
+
+        Returns:
+            True when a new burst started
+        """
+        now = time.monotonic() if now is None else now
+        started = self.interval is None
+        self.triggered = now
+        self.interval = self.fast
+        self.reason = reason
+        if started:
+            self.bursts += 1
+            self.started = now
+            self.next_poll = now + self.fast
+        else:
+            self.next_poll = min(self.next_poll, now + self.fast)
+        return started
+
+    def observe(self, field: str, value, now: Optional[float] = None) -> bool:
+        """
+        Follow a value of STEP_FIELDS, a step of at least `step` since a sample at most max_gap seconds
+        earlier triggers a burst
+
+        Returns:
+            True when a new burst started
+        """
+        if field not in STEP_FIELDS:
+            return False
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return False
+        now = time.monotonic() if now is None else now
+        last = self.last.get(field)
+        self.last[field] = (value, now)
+        if last is None or now - last[1] > self.max_gap or abs(value - last[0]) < self.step:
+            return False
+        return self.trigger(f"step of {value - last[0]:+.0f} W in {field}", now)
+
+    def due(self, now: Optional[float] = None) -> bool:
+        """True when a burst poll is due"""
+        now = time.monotonic() if now is None else now
+        return self.interval is not None and now >= self.next_poll - 0.05 * self.interval
+
+    def polled(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Register a burst poll and plan the next one
+
+        Returns:
+            Seconds to the next burst poll, or None when the burst ended (back at the normal interval)
+        """
+        now = time.monotonic() if now is None else now
+        self.polls += 1
+        if now - self.triggered >= self.hold:
+            self.interval *= self.decay
+        if self.interval >= self.normal or now - self.started >= self.max_duration:
+            self.interval = None
+            self.next_poll = None
+            return None
+        self.next_poll = now + self.interval
+        return self.interval
+
+    def stop(self):
+        """End the running burst"""
+        self.interval = None
+        self.next_poll = None
+
+    def values(self) -> Dict:
+        """Counters for metrics"""
+        return {"bursts": self.bursts, "burst_polls": self.polls}
@@ -0,0 +1,411 @@
+"""
+Venus fleet collector
+
+Polls a large number of Marstek Venus batteries with several processes, for
+aggregation servers with more cores than one Python process can use. The
+device list is split over worker processes (shards). Each worker has its own
+UDP multiplexer and polling threads, decodes the replies and sends one compact
+record per cycle to the parent over a pipe: the values of each method as a
+tuple, with the field names sent only once per layout, and no values for a
+result that is stale. The parent merges the records into Snapshots for the
+exporter and the sinks (JSON lines, Domoticz writer), so the JSON decoding
+and the bookkeeping of the UDP client, which hold the GIL, are spread over the
+cores. A worker that stops is started again.
+
+The workers are started with the "spawn" method, so a program using
+FleetCollector must create it under if __name__ == "__main__".
+
+See python -m venus_collector --help.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import wait
+from types import MappingProxyType
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from venus_api_v2 import (CLI_METHODS, FRESH, MISSING, SNAPSHOT_METHODS, STALE, MethodResult, Snapshot,
+                          VenusAPIClient, close_multiplexer, get_multiplexer, get_pacer, _emit, _parse_device,
+                          _snapshot_record)
+
+logger = logging.getLogger(__name__)
+
+# Messages of a worker to the parent, the first element of each message
+LAYOUT = "layout"  # (LAYOUT, layout id, field names)
+CYCLE = "cycle"    # (CYCLE, cycle seconds, records, client totals)
+DONE = "done"      # (DONE,) after the last cycle
+
+
+def shard_devices(devices: Sequence[Tuple[str, int]], workers: int) -> List[List[Tuple[int, str, int]]]:
+    """
+    Split a device list over workers, round robin so every worker gets about the same number
+
+    Returns:
+        Per worker a list of (index in devices, ip, port)
+    """
+    return [[(index, ip, port) for index, (ip, port) in enumerate(devices) if index % workers == number]
+            for number in range(workers)]
+
+
+def _worker(number: int, shard: List[Tuple[int, str, int]], methods: Tuple[str, ...], interval: float,
+            timeout: float, pace: bool, max_age: Optional[float], threads: int, count: int, log_level: int,
+            connection):
+    """Worker process: poll the devices of one shard every interval and send the records to the parent"""
+    logging.getLogger().setLevel(log_level)
+    multiplexer = get_multiplexer()  # one socket for the whole shard
+    clients = [VenusAPIClient(ip, port, timeout=timeout, multiplexer=multiplexer,
+                              pacer=get_pacer(ip, port) if pace else None) for _, ip, port in shard]
+    pool = ThreadPoolExecutor(max_workers=min(len(clients), threads) if threads else len(clients),
+                              thread_name_prefix=f"collector-{number}")
+    layouts = {}  # (method, field names) -> layout id
+
+    def send(message):
+        connection.send_bytes(pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+
+    def encode(method: str, result: MethodResult):
+        if result.status == MISSING:
+            return None
+        if result.status == STALE:
+            return (None, result.timestamp, None)  # the parent still has these values
+        keys = tuple(result.result)
+        layout = layouts.get((method, keys))
+        if layout is None:
+            layout = layouts[(method, keys)] = len(layouts)
+            send((LAYOUT, layout, keys))
+        return (layout, result.timestamp, tuple(result.result.values()))
+
+    cycle = 0
+    next_cycle = time.monotonic()
+    try:
+        while count == 0 or cycle < count:
+            start = time.monotonic()
+            deadline = start + interval if interval > 0 else None  # a cycle does not run into the next one
+            snapshots = list(pool.map(lambda client: client.get_snapshot(methods, deadline, max_age), clients))
+            records = [(index, snapshot.taken, snapshot.seconds,
+                        tuple(encode(method, snapshot.results[method]) for method in methods))
+                       for (index, _, _), snapshot in zip(shard, snapshots)]
+            totals = {"requests": 0, "failures": 0, "timeouts": 0}
+            for client in clients:
+                stats = client.stats.snapshot()
+                for counter in totals:
+                    totals[counter] += sum(stats[counter].values())
+            send((CYCLE, time.monotonic() - start, records, totals))
+            cycle += 1
+            next_cycle += interval
+            delay = next_cycle - time.monotonic()
+            if delay <= 0:
+                next_cycle = time.monotonic()  # cycle took longer than the interval, do not try to catch up
+                delay = 0
+            if (count == 0 or cycle < count) and connection.poll(delay):
+                break  # told to stop
+        send((DONE,))
+    except (BrokenPipeError, EOFError, KeyboardInterrupt):
+        pass  # parent gone or stopping
+    finally:
+        pool.shutdown(wait=False)
+        for client in clients:
+            client.close()
+        close_multiplexer()
+
+
+class FleetCollector:
+    """Device list polled by worker processes, merged into Snapshots in this process"""
+
+    def __init__(self, devices: Sequence[Tuple[str, int]], workers: int = 0, interval: float = 10.0,
+                 methods: Sequence[str] = SNAPSHOT_METHODS, timeout: float = 5.0, pace: bool = False,
+                 max_age: Optional[float] = None, threads: int = 0, count: int = 0,
+                 exporter=None, log_level: int = logging.WARNING):
+        """
+        Initialize collector, call start() to start the workers
+
+        Args:
+            devices: (ip, port) of every battery
+            workers: Number of worker processes (default: 0 = one per core), never more than devices
+            interval: Seconds between the polls of a device (default: 10.0)
+            methods: API methods polled (default: SNAPSHOT_METHODS)
+            timeout: Maximum request timeout in seconds (default: 5.0)
+            pace: Limit the request rate per device, learned from the lost requests (default: False)
+            max_age: Results older than this number of seconds are missing instead of stale (default: None = any age)
+            threads: Devices polled at the same time per worker (default: 0 = all of its shard)
+            count: Cycles per worker before it stops (default: 0 = until stop())
+            exporter: MetricsExporter that gets every snapshot, the cycle time of each worker and the
+                      collector counters (default: None)
+            log_level: Logging level in the workers (default: WARNING, DEBUG writes every request to API.log)
+        """
+        self.devices = [(ip, int(port)) for ip, port in devices]
+        self.names = [f"{ip}:{port}" for ip, port in self.devices]
+        self.workers = max(1, min(len(self.devices), workers or os.cpu_count() or 1))
+        self.shards = shard_devices(self.devices, self.workers)
+        self.interval = interval
+        self.methods = tuple(methods)
+        self.options = (timeout, pace, max_age, threads, count, log_level)
+        self.count = count
+        self.exporter = exporter
+        self.context = multiprocessing.get_context("spawn")  # no threads or sockets of this process in the workers
+        self.lock = threading.Lock()
+        self.processes = {}   # worker number -> (process, connection)
+        self.layouts = {}     # worker number -> {layout id: field names}
+        self.restart_at = {}  # worker number -> time.monotonic() of the restart of a worker that stopped
+        self.finished = set()
+        self.latest = {}      # device -> last Snapshot
+        self.totals = {}      # worker number -> request totals of its clients
+        self.retired = {}     # request totals of the workers that stopped, so the counters keep counting
+        self.counts = {"cycles": 0, "records": 0, "bytes": 0, "restarts": 0}
+        self.running = False
+        if exporter is not None:
+            exporter.add_counter("venus_collector", "collector", self.values, label="counter",
+                                 help_text="Worker cycles, device records and bytes received, and worker restarts")
+
+    def start(self):
+        """Start the worker processes"""
+        self.running = True
+        for number in range(self.workers):
+            self._spawn(number)
+        logger.info(f"Collector: {len(self.devices)} devices over {self.workers} workers")
+
+    def _spawn(self, number: int):
+        parent, child = self.context.Pipe()
+        timeout, pace, max_age, threads, count, log_level = self.options
+        process = self.context.Process(target=_worker, name=f"venus-collector-{number}", daemon=True,
+                                       args=(number, self.shards[number], self.methods, self.interval, timeout,
+                                             pace, max_age, threads, count, log_level, child))
+        process.start()
+        child.close()
+        self.processes[number] = (process, parent)
+        self.layouts[number] = {}
+
+    def done(self) -> bool:
+        """True when all workers finished their cycles (count > 0)"""
+        return len(self.finished) == self.workers
+
+    def receive(self, timeout: Optional[float] = None) -> List[Snapshot]:
+        """
+        Wait for the records of the workers and merge them
+
+        Args:
+            timeout: Seconds to wait for a record (default: None = until one arrives)
+
+        Returns:
+            The Snapshots received, empty when none arrived within the timeout
+        """
+        now = time.monotonic()
+        for number, at in list(self.restart_at.items()):
+            if now >= at and self.running:
+                del self.restart_at[number]
+                self._spawn(number)
+        connections = {connection: number for number, (_, connection) in self.processes.items()}
+        if not connections:
+            if timeout:
+                time.sleep(timeout)
+            return []
+        snapshots = []
+        for connection in wait(list(connections), timeout):
+            number = connections[connection]
+            try:
+                data = connection.recv_bytes()
+            except (EOFError, OSError):
+                self._lost(number)
+                continue
+            message = pickle.loads(data)
+            with self.lock:
+                self.counts["bytes"] += len(data)
+            if message[0] == LAYOUT:
+                self.layouts[number][message[1]] = message[2]
+            elif message[0] == CYCLE:
+                snapshots += self._merge(number, message[1], message[2], message[3])
+            elif message[0] == DONE:
+                self.finished.add(number)
+                self._close(number)
+        return snapshots
+
+    def _merge(self, number: int, seconds: float, records, totals: Dict) -> List[Snapshot]:
+        layouts = self.layouts[number]
+        snapshots = []
+        for index, taken, duration, encoded in records:
+            device = self.names[index]
+            last = self.latest.get(device)
+            results = {}
+            for method, item in zip(self.methods, encoded):
+                if item is None:
+                    results[method] = MethodResult(None, None, MISSING)
+                elif item[0] is None:
+                    previous = last.results.get(method) if last is not None else None
+                    if previous is None or previous.result is None:
+                        results[method] = MethodResult(None, None, MISSING)
+                    else:
+                        results[method] = MethodResult(previous.result, item[1], STALE)
+                else:
+                    layout, timestamp, values = item
+                    results[method] = MethodResult(MappingProxyType(dict(zip(layouts[layout], values))), timestamp, FRESH)
+            snapshot = Snapshot(device, taken, duration, MappingProxyType(results))
+            self.latest[device] = snapshot
+            snapshots.append(snapshot)
+            if self.exporter is not None:
+                self.exporter.update_snapshot(device, snapshot)
+        with self.lock:
+            self.totals[number] = totals
+            self.counts["cycles"] += 1
+            self.counts["records"] += len(records)
+        if self.exporter is not None:
+            self.exporter.observe_cycle(f"worker{number}", seconds)
+        return snapshots
+
+    def _lost(self, number: int):
+        """A worker stopped without DONE, start it again after one interval"""
+        process, _ = self.processes[number]
+        process.join(1)
+        logger.error(f"Collector worker {number} stopped (exit code {process.exitcode}), restart in {self.interval:g} s")
+        self._close(number)
+        if self.running:
+            self.restart_at[number] = time.monotonic() + max(1.0, self.interval)
+            with self.lock:
+                self.counts["restarts"] += 1
+                for counter, n in self.totals.pop(number, {}).items():
+                    self.retired[counter] = self.retired.get(counter, 0) + n
+
+    def _close(self, number: int):
+        process, connection = self.processes.pop(number)
+        connection.close()
+        process.join(1)
+
+    def stop(self, timeout: float = 5.0):
+        """Tell the workers to stop and wait up to `timeout` seconds for them, then end them"""
+        self.running = False
+        self.restart_at.clear()
+        for process, connection in self.processes.values():
+            try:
+                connection.send_bytes(b"stop")
+            except OSError:
+                pass
+        end = time.monotonic() + timeout
+        for process, connection in self.processes.values():
+            process.join(max(0.0, end - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join(1)
+            connection.close()
+        self.processes.clear()
+
+    def values(self) -> Dict[str, int]:
+        """Collector counters, with the requests, failures and timeouts of all workers"""
+        with self.lock:
+            values = dict(self.counts, **self.retired)
+            for totals in self.totals.values():
+                for counter, n in totals.items():
+                    values[counter] = values.get(counter, 0) + n
+        return values
+
+
+def _parse_fleet_map(specs: List[str], default_port: int) -> Dict[Tuple[str, str, str], int]:
+    """device/method.field=idx specifications, e.g. 192.168.1.11/em.total_power=123"""
+    from venus_writer import _parse_map
+    mapping = {}
+    for spec in specs:
+        device, slash, rest = spec.partition("/")
+        if not slash:
+            raise ValueError(f"invalid mapping {spec!r}, expected device/method.field=idx")
+        ip, port = _parse_device(device, default_port)
+        for (method, field), idx in _parse_map([rest]).items():
+            mapping[(f"{ip}:{port}", method, field)] = idx
+    return mapping
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point, see python -m venus_collector --help"""
+    parser = argparse.ArgumentParser(prog="python -m venus_collector",
+                                     description="Poll many batteries with several worker processes, "
+                                                 "output as JSON lines on stdout")
+    parser.add_argument("device", nargs="*", help="battery as ip or ip:port")
+    parser.add_argument("--file", help="file with one battery (ip or ip:port) per line, # for comments")
+    parser.add_argument("--port", type=int, default=30000, help="default UDP port of the batteries (default: 30000)")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes (default: 0 = one per core)")
+    parser.add_argument("--threads", type=int, default=0, help="batteries polled at the same time per worker (default: 0 = all)")
+    parser.add_argument("--interval", type=float, default=10, help="seconds between polls (default: 10)")
+    parser.add_argument("--methods", default="em,bat,pv,es,mode", help=f"comma separated, from {','.join(CLI_METHODS)} (default: em,bat,pv,es,mode)")
+    parser.add_argument("--count", type=int, default=0, help="number of polls, 0 = until interrupted (default: 0)")
+    parser.add_argument("--timeout", type=float, default=5, help="maximum request timeout in seconds (default: 5)")
+    parser.add_argument("--pace", action="store_true", help="limit the request rate per battery, learned from the lost requests")
+    parser.add_argument("--quiet", action="store_true", help="no JSON line per battery, only the totals at the end")
+    parser.add_argument("--exporter-port", type=int, default=0, help="serve the values on this /metrics port (default: 0 = off)")
+    parser.add_argument("--exporter-address", default="127.0.0.1", help="listen address of the exporter (default: 127.0.0.1)")
+    parser.add_argument("--url", help="Domoticz web server, to write the --map fields to Domoticz devices")
+    parser.add_argument("--username", help="Domoticz user name")
+    parser.add_argument("--password", help="Domoticz password")
+    parser.add_argument("--map", action="append", default=[], metavar="DEVICE/METHOD.FIELD=IDX",
+                        help="write a field to a Domoticz device, e.g. 192.168.1.11/em.total_power=123 (repeatable)")
+    parser.add_argument("--spool", metavar="DIR", help="keep the Domoticz updates in this folder while Domoticz is down")
+    args = parser.parse_args(argv)
+
+    specs = list(args.device)
+    if args.file:
+        with open(args.file) as f:
+            specs += [line.split("#")[0].strip() for line in f if line.split("#")[0].strip()]
+    if not specs:
+        parser.error("no batteries, give them as arguments or with --file")
+    names = [m.strip() for m in args.methods.split(",") if m.strip()]
+    unknown = [m for m in names if m not in CLI_METHODS]
+    try:
+        mapping = _parse_fleet_map(args.map, args.port)
+    except ValueError as e:
+        sys.stderr.write(f"{e}\n")
+        return 2
+    unknown += [method for _, method, _ in mapping if method not in names]
+    if unknown:
+        sys.stderr.write(f"Unknown or not polled method(s) {sorted(set(unknown))}, choose from --methods {','.join(names)}\n")
+        return 2
+
+    exporter = None
+    if args.exporter_port:
+        from venus_exporter import MetricsExporter
+        exporter = MetricsExporter(port=args.exporter_port, address=args.exporter_address)
+        exporter.start()
+    writer = None
+    if mapping:
+        from venus_spool import SegmentSpool
+        from venus_writer import DomoticzWriter
+        spool = SegmentSpool(args.spool, "domoticz") if args.spool else None
+        writer = DomoticzWriter(args.url or "http://127.0.0.1:8080", args.username, args.password, spool=spool)
+        writer.start()
+    collector = FleetCollector([_parse_device(spec, args.port) for spec in specs], args.workers, args.interval,
+                               [CLI_METHODS[name][0] for name in names], args.timeout, args.pace,
+                               threads=args.threads, count=args.count, exporter=exporter)
+    collector.start()
+    by_device = {}
+    for (device, method, field), idx in mapping.items():
+        by_device.setdefault(device, []).append((CLI_METHODS[method][0], field, idx))
+    try:
+        while not collector.done():
+            for snapshot in collector.receive(1.0):
+                if not args.quiet:
+                    _emit(_snapshot_record(snapshot, names))
+                for method, field, idx in by_device.get(snapshot.device, ()):
+                    result = snapshot.result(method)
+                    if result is not None and field in result:
+                        value = result[field]
+                        writer.update_device(idx, 0, int(value) if isinstance(value, bool) else value)
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:  # output closed by the consumer
+        pass
+    finally:
+        collector.stop()
+        if writer is not None:
+            writer.close(timeout=10)
+        if exporter is not None:
+            exporter.stop()
+    totals = dict(collector.values(), devices=len(collector.devices), workers=collector.workers)
+    if writer is not None:
+        totals["writer"] = writer.stats()
+    _emit(totals)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Venus energy counters
+
+The Marstek Venus reports lifetime energy totals as cumulative counters. These
+start again from 0 after some firmware restarts, may wrap around, and have been
+seen to change scale after a firmware update. CounterTracker turns such a raw
+counter into a total that only goes up, plus the increase per interval.
+"""
+
+import json
+import logging
+import math
+import os
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Counter sizes at which a raw counter may wrap around to 0
+WRAP_LIMITS = (2 ** 16, 2 ** 32)
+# Ratios between two raw readings that are taken as a change of scale by the firmware
+RESCALE_FACTORS = (10.0, 100.0, 1000.0, 0.1, 0.01, 0.001)
+
+
+class CounterTracker:
+    """Monotonic total of one cumulative device counter"""
+
+    __slots__ = ("scale", "multiplier", "rescale_tolerance", "min_rescale_value", "max_rate",
+                 "last_raw", "last_time", "total", "last_delta", "day", "today",
+                 "resets", "wraps", "rescales", "glitches")
+
+    def __init__(self, scale: float = 1.0, rescale_tolerance: float = 0.02,
+                 min_rescale_value: float = 100, max_rate: Optional[float] = None):
+        """
+        Initialize tracker
+
+        Args:
+            scale: Multiplier from raw counter units to total units (default: 1.0)
+            rescale_tolerance: Relative tolerance when comparing the ratio of two readings to RESCALE_FACTORS (default: 0.02)
+            min_rescale_value: Raw values below this are never taken as a change of scale (default: 100)
+            max_rate: Maximum plausible increase in total units per second, larger jumps are ignored
+                      and the counter continues from the new value (default: None = no check)
+        """
+        self.scale = scale
+        self.multiplier = scale  # scale as configured, self.scale also follows changes of scale by the firmware
+        self.rescale_tolerance = rescale_tolerance
+        self.min_rescale_value = min_rescale_value
+        self.max_rate = max_rate
+        self.last_raw = None
+        self.last_time = None
+        self.total = None
+        self.last_delta = 0.0
+        self.day = None
+        self.today = 0.0
+        self.resets = 0
+        self.wraps = 0
+        self.rescales = 0
+        self.glitches = 0
+
+    def _rescale_factor(self, raw: float) -> Optional[float]:
+        if self.last_raw < self.min_rescale_value or raw < self.min_rescale_value:
+            return None
+        ratio = raw / self.last_raw
+        for factor in RESCALE_FACTORS:
+            if abs(ratio / factor - 1) <= self.rescale_tolerance:
+                return factor
+        return None
+
+    def update(self, raw: float, now: Optional[float] = None) -> float:
+        """
+        Process a new raw reading
+
+        Args:
+            raw: Counter value as reported by the device
+            now: Time of the reading, time.time() (default: now)
+
+        Returns:
+            Increase of the total since the previous reading, in total units (never negative)
+        """
+        now = time.time() if now is None else now
+        day = time.strftime("%Y-%m-%d", time.localtime(now))
+        if day != self.day:
+            self.day = day
+            self.today = 0.0
+        if self.last_raw is None:
+            # first reading ever: continue from the value the device reports
+            self.last_raw = raw
+            self.last_time = now
+            if self.total is None:
+                self.total = raw * self.scale
+            self.last_delta = 0.0
+            return 0.0
+
+        difference = raw - self.last_raw
+        factor = self._rescale_factor(raw) if difference != 0 else None
+        if factor is not None:
+            # same energy reported in other units: adapt the scale, no increase
+            self.scale /= factor
+            self.rescales += 1
+            delta = 0.0
+            logger.warning(f"Counter changed scale by a factor {factor:g} ({self.last_raw} -> {raw})")
+        elif difference >= 0:
+            delta = difference * self.scale
+        else:
+            wrap = next((limit for limit in WRAP_LIMITS
+                         if self.last_raw < limit and self.last_raw > 0.9 * limit and raw < 0.1 * limit), None)
+            if wrap is not None:
+                delta = (raw + wrap - self.last_raw) * self.scale
+                self.wraps += 1
+                logger.info(f"Counter wrapped around at {wrap} ({self.last_raw} -> {raw})")
+            else:
+                # reset of the device counter: it counts again from 0
+                delta = raw * self.scale
+                self.resets += 1
+                logger.warning(f"Counter reset detected ({self.last_raw} -> {raw})")
+
+        if self.max_rate is not None and delta > self.max_rate * max(now - self.last_time, 1.0):
+            self.glitches += 1
+            logger.warning(f"Implausible counter jump of {delta:g} ignored ({self.last_raw} -> {raw})")
+            delta = 0.0
+
+        self.last_raw = raw
+        self.last_time = now
+        self.total += delta
+        self.today += delta
+        self.last_delta = delta
+        return delta
+
+    def state(self) -> Dict:
+        """Values to be persisted, see restore()"""
+        return {"scale": self.scale, "multiplier": self.multiplier, "last_raw": self.last_raw,
+                "last_time": self.last_time, "total": self.total, "day": self.day, "today": self.today}
+
+    def restore(self, state: Dict):
+        """Continue from a saved state, converted to the configured multiplier if that changed since"""
+        multiplier = self.multiplier
+        for key, value in state.items():
+            if key in ("scale", "multiplier", "last_raw", "last_time", "total", "day", "today"):
+                setattr(self, key, value)
+        if "multiplier" not in state and "scale" in state:
+            self.multiplier = state["scale"]  # saved before the multiplier was kept
+        self.set_multiplier(multiplier)
+
+    def set_multiplier(self, multiplier: float):
+        """
+        Change the configured multiplier, the total and the scale are converted to the new total units
+
+        Args:
+            multiplier: Multiplier from raw counter units to total units
+        """
+        if math.isclose(multiplier, self.multiplier):
+            return
+        factor = multiplier / self.multiplier
+        logger.warning(f"Counter multiplier changed from {self.multiplier:g} to {multiplier:g}, total converted")
+        self.scale *= factor
+        if self.total is not None:
+            self.total *= factor
+        self.today *= factor
+        self.last_delta *= factor
+        self.multiplier = multiplier
+
+
+class CounterBank:
+    """CounterTrackers of one device, persisted in a JSON file"""
+
+    def __init__(self, settings: Dict[str, Dict], path: Optional[str] = None):
+        """
+        Initialize trackers and load their state
+
+        Args:
+            settings: counter name -> CounterTracker keyword arguments
+            path: JSON file to keep the state in between restarts (default: None = not persisted)
+        """
+        self.trackers = {name: CounterTracker(**kwargs) for name, kwargs in settings.items()}
+        self.path = path
+        self.dirty = False
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self.restore(json.load(f))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.error(f"Counter state {path} could not be read, starting again from the device values: {e}")
+
+    def update(self, name: str, raw, now: Optional[float] = None) -> Optional[float]:
+        """Process a reading of counter name, returns the increase (None if not a tracked counter or not a number)"""
+        tracker = self.trackers.get(name)
+        if tracker is None or isinstance(raw, bool) or not isinstance(raw, (int, float)):
+            return None
+        self.dirty = True
+        return tracker.update(raw, now)
+
+    def set_multiplier(self, name: str, multiplier: float):
+        """Change the configured multiplier of counter name, see CounterTracker.set_multiplier()"""
+        tracker = self.trackers[name]
+        if not math.isclose(multiplier, tracker.multiplier):
+            tracker.set_multiplier(multiplier)
+            self.dirty = True
+
+    def total(self, name: str) -> Optional[float]:
+        return self.trackers[name].total
+
+    def today(self) -> Dict[str, float]:
+        """Increase of each counter since midnight"""
+        return {name: tracker.today for name, tracker in self.trackers.items()}
+
+    def events(self) -> Dict[str, int]:
+        """Number of resets, wraparounds, rescales and ignored jumps over all counters"""
+        result = {"reset": 0, "wrap": 0, "rescale": 0, "glitch": 0}
+        for tracker in self.trackers.values():
+            result["reset"] += tracker.resets
+            result["wrap"] += tracker.wraps
+            result["rescale"] += tracker.rescales
+            result["glitch"] += tracker.glitches
+        return result
+
+    def state(self) -> Dict:
+        return {name: tracker.state() for name, tracker in self.trackers.items()}
+
+    def restore(self, state: Dict):
+        for name, tracker_state in state.items():
+            if name in self.trackers:
+                self.trackers[name].restore(tracker_state)
+
+    def save(self):
+        """Write the state if it changed, replacing the file in one step"""
+        if self.path is None or not self.dirty:
+            return
+        temp = self.path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(self.state(), f)
+        os.replace(temp, self.path)
+        self.dirty = False
@@ -0,0 +1,261 @@
+"""
+Venus fleet dispatcher
+
+Splits one site power target over several Marstek Venus batteries. Each battery
+gets a share in proportion to the energy it can still deliver (discharging) or
+take (charging), reduced at high and low temperatures, within its own power
+limits and respecting its charge and discharge permission flags. What one
+battery cannot take is handed to the others (water-filling).
+
+The ES.SetMode commands are sent to all batteries at the same time, and only to
+the batteries whose share changed by more than the deadband, so the fleet
+follows a new target in about one round trip.
+"""
+
+import argparse
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from venus_api_v2 import VenusAPIClient, get_multiplexer, _parse_device, _emit
+
+logger = logging.getLogger(__name__)
+
+# Setpoints are rounded to this number of W
+POWER_ROUNDING = 10
+
+
+class FleetUnit:
+    """State and limits of one battery of the fleet"""
+
+    __slots__ = ("name", "client", "max_charge", "max_discharge", "soc", "capacity", "temperature",
+                 "charge_allowed", "discharge_allowed", "updated", "setpoint")
+
+    def __init__(self, name: str, client: Optional[VenusAPIClient], max_charge: float = 1200, max_discharge: float = 800):
+        self.name = name
+        self.client = client
+        self.max_charge = max_charge
+        self.max_discharge = max_discharge
+        self.soc = None
+        self.capacity = None
+        self.temperature = None
+        self.charge_allowed = True
+        self.discharge_allowed = True
+        self.updated = None     # time.monotonic() of the last status
+        self.setpoint = None    # last power sent, None = nothing sent yet
+
+
+class FleetDispatcher:
+    """Site power target split over a fleet of batteries"""
+
+    def __init__(self, deadband: float = 50, min_soc: float = 10, max_soc: float = 100,
+                 temperature_limits=(0, 10, 40, 50), max_age: float = 300, period: int = 9):
+        """
+        Initialize dispatcher
+
+        Args:
+            deadband: A new share is only sent when it differs more than this from the last one, in W (default: 50)
+            min_soc: Batteries do not discharge below this state of charge in % (default: 10)
+            max_soc: Batteries do not charge above this state of charge in % (default: 100)
+            temperature_limits: (no power below, full power from, full power up to, no power above) in C,
+                                the share is reduced linearly in between (default: (0, 10, 40, 50))
+            max_age: Batteries without a status for this number of seconds get no share (default: 300)
+            period: Manual mode period number used for the setpoint (default: 9)
+        """
+        self.deadband = deadband
+        self.min_soc = min_soc
+        self.max_soc = max_soc
+        self.temperature_limits = temperature_limits
+        self.max_age = max_age
+        self.period = period
+        self.units = {}
+        self.pool = None
+
+    def add_unit(self, name: str, client: Optional[VenusAPIClient], max_charge: float = 1200,
+                 max_discharge: float = 800) -> FleetUnit:
+        """Add a battery, client None for a battery that only reports its status (it always gets share 0)"""
+        unit = self.units[name] = FleetUnit(name, client, max_charge, max_discharge)
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+        return unit
+
+    def update(self, name: str, status: Dict):
+        """
+        Store the battery status of one unit
+
+        Args:
+            name: Unit name
+            status: Bat.GetStatus result (soc, rated_capacity, bat_temp, charg_flag, dischrg_flag)
+        """
+        unit = self.units[name]
+        unit.soc = status.get("soc", unit.soc)
+        unit.capacity = status.get("rated_capacity", unit.capacity)
+        unit.temperature = status.get("bat_temp", unit.temperature)
+        unit.charge_allowed = bool(status.get("charg_flag", unit.charge_allowed))
+        unit.discharge_allowed = bool(status.get("dischrg_flag", unit.discharge_allowed))
+        unit.updated = time.monotonic()
+
+    def refresh(self, names: Optional[List[str]] = None, deadline: Optional[float] = None) -> Dict[str, bool]:
+        """
+        Get the battery status of the units at the same time
+
+        Args:
+            names: Units to refresh (default: None = all with a client)
+            deadline: time.monotonic() value after which retries stop (default: None = the client default)
+
+        Returns:
+            name -> status received
+        """
+        names = [name for name in (names if names is not None else self.units) if self.units[name].client is not None]
+        results = dict(zip(names, self._executor().map(lambda name: self.units[name].client.get_battery_status(deadline),
+                                                        names)))
+        for name, status in results.items():
+            if status is not None:
+                self.update(name, status)
+        return {name: status is not None for name, status in results.items()}
+
+    def _temperature_factor(self, temperature) -> float:
+        if temperature is None:
+            return 1.0
+        low_stop, low_full, high_full, high_stop = self.temperature_limits
+        if temperature <= low_stop or temperature >= high_stop:
+            return 0.0
+        if temperature < low_full:
+            return (temperature - low_stop) / (low_full - low_stop)
+        if temperature > high_full:
+            return (high_stop - temperature) / (high_stop - high_full)
+        return 1.0
+
+    def allocate(self, target: float) -> Dict[str, float]:
+        """
+        Split a site target
+
+        Args:
+            target: Site power in W, positive = discharge, negative = charge
+
+        Returns:
+            Power per unit in W (same sign), units that cannot contribute get 0.
+            The sum is less than the target when the fleet cannot deliver it.
+        """
+        discharge = target > 0
+        now = time.monotonic()
+        weights = {}
+        limits = {}
+        shares ={name: 0.0 for name in self.units}
+        for name, unit in self.units.items():
+            if unit.client is None or unit.soc is None or unit.updated is None or now - unit.updated > self.max_age:
+                continue
+            capacity = unit.capacity or 1
+            if discharge:
+                if not unit.discharge_allowed:
+                    continue
+                weight = max(unit.soc - self.min_soc, 0) * capacity
+                limit = unit.max_discharge
+            else:
+                if not unit.charge_allowed:
+                    continue
+                weight = max(self.max_soc - unit.soc, 0) * capacity
+                limit = unit.max_charge
+            weight *= self._temperature_factor(unit.temperature)
+            if weight > 0 and limit > 0:
+                weights[name] = weight
+                limits[name] = limit
+
+        # water-filling: share in proportion to the weights, what a unit cannot take goes to the others
+        remaining = abs(target)
+        while remaining > 1e-6 and weights:
+            total = sum(weights.values())
+            capped = [name for name in weights if remaining * weights[name] / total >= limits[name]]
+            if not capped:
+                for name in weights:
+                    shares[name] += remaining * weights[name] / total
+                break
+            for name in capped:
+                shares[name] += limits[name]
+                remaining -= limits[name]
+                del weights[name]
+        sign = 1 if discharge else -1
+        return {name: sign * round(share / POWER_ROUNDING) * POWER_ROUNDING for name, share in shares.items()}
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=max(len(self.units), 1), thread_name_prefix="venus-dispatch")
+        return self.pool
+
+    def _send(self, unit: FleetUnit, power: float) -> bool:
+        return unit.client.set_manual_mode(int(power), self.period, "00:00", "23:59", 127, 1)
+
+    def dispatch(self, target: float) -> Dict[str, Dict]:
+        """
+        Split a site target and send the changed shares, all at the same time
+
+        Returns:
+            name -> {"power": share in W, "sent": command sent, "success": command accepted (None when not sent)}
+        """
+        shares = self.allocate(target)
+        changed = [name for name, power in shares.items()
+                   if self.units[name].client is not None and
+                   (self.units[name].setpoint is None or abs(power - self.units[name].setpoint) > self.deadband or
+                    (power == 0) != (self.units[name].setpoint == 0))]
+        results = {name: {"power": power, "sent": False, "success": None} for name, power in shares.items()}
+        if changed:
+            outcomes = self._executor().map(lambda name: self._send(self.units[name], shares[name]), changed)
+            for name, success in zip(changed, outcomes):
+                results[name]["sent"] = True
+                results[name]["success"] = success
+                if success:
+                    self.units[name].setpoint = shares[name]
+                else:
+                    logger.error(f"Setpoint {shares[name]} W not accepted by {name}")
+        return results
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point, see python -m venus_dispatch --help"""
+    parser = argparse.ArgumentParser(prog="python -m venus_dispatch",
+                                     description="Split a site power target over several batteries, output as JSON lines")
+    parser.add_argument("target", help="site power in W (positive = discharge, negative = charge), or - to read targets from stdin, one per line")
+    parser.add_argument("device", nargs="+", help="device as ip or ip:port")
+    parser.add_argument("--port", type=int, default=30000, help="default UDP port of the devices (default: 30000)")
+    parser.add_argument("--timeout", type=float, default=5, help="maximum request timeout in seconds (default: 5)")
+    parser.add_argument("--max-charge", type=float, default=1200, help="maximum charging power per battery in W (default: 1200)")
+    parser.add_argument("--max-discharge", type=float, default=800, help="maximum discharging power per battery in W (default: 800)")
+    parser.add_argument("--min-soc", type=float, default=10, help="lowest state of charge in %% (default: 10)")
+    parser.add_argument("--deadband", type=float, default=50, help="only send shares that changed more than this in W (default: 50)")
+    parser.add_argument("--dry-run", action="store_true", help="only show the shares, do not send them")
+    args = parser.parse_args(argv)
+
+    multiplexer = get_multiplexer()
+    dispatcher = FleetDispatcher(deadband=args.deadband, min_soc=args.min_soc)
+    for spec in args.device:
+        ip, port = _parse_device(spec, args.port)
+        client = VenusAPIClient(ip, port, timeout=args.timeout, multiplexer=multiplexer)
+        dispatcher.add_unit(f"{ip}:{port}", client, args.max_charge, args.max_discharge)
+    targets = (line for line in sys.stdin if line.strip()) if args.target == "-" else [args.target]
+    try:
+        for target in targets:
+            dispatcher.refresh()
+            start = time.monotonic()
+            if args.dry_run:
+                results = {name: {"power": power} for name, power in dispatcher.allocate(float(target)).items()}
+            else:
+                results = dispatcher.dispatch(float(target))
+            _emit({"ts": round(time.time(), 3), "target": float(target), "units": results,
+                   "dispatch_ms": round((time.monotonic() - start) * 1000, 1)})
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        dispatcher.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""
+Venus OpenMetrics exporter
+
+Serves the latest Marstek Venus values and the VenusAPIClient instrumentation
+on a local HTTP endpoint in OpenMetrics text format (Prometheus compatible).
+
+A scrape only reads the in-memory snapshot, it never starts UDP traffic to the
+battery. Values are pushed in by the Domoticz plugin or any other program using
+the venus_api_v2 library.
+"""
+
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+from venus_api_v2 import FRESH, MISSING, STALE, Histogram, Snapshot, VenusAPIClient
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Upper bounds (seconds) of the data collection cycle histogram buckets
+CYCLE_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    """Escape a label value"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class MetricsExporter:
+    """In-memory snapshot of battery values and client health, served over HTTP"""
+
+    def __init__(self, port: int = 9108, address: str = "127.0.0.1", prefix: str = "marstek"):
+        """
+        Initialize exporter
+
+        Args:
+            port: TCP port of the /metrics endpoint (default: 9108)
+            address: Listen address (default: 127.0.0.1, use 0.0.0.0 to allow remote scrapes)
+            prefix: Name prefix of the battery value metrics (default: "marstek")
+        """
+        self.port = port
+        self.address = address
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.values = {}    # (device, source, field) -> value
+        self.modes = {}     # device -> mode string
+        self.clients = {}   # device -> VenusAPIClient
+        self.cycles = {}    # device -> Histogram of cycle durations
+        self.counters = {}  # (name, device) -> (label, help, getter returning {label value: count}, kind)
+        self.received = {}  # (device, method) -> (time.time() of the reply, status) of the last snapshot
+        self.server = None
+        self.thread = None
+
+    def update(self, device: str, source: str, response: Dict):
+        """
+        Store the latest values of one API response
+
+        Args:
+            device: Device label, e.g. the battery IP address
+            source: Source of the response (e.g. "BAT", "EMS")
+            response: Result dictionary as returned by VenusAPIClient
+        """
+        with self.lock:
+            for field, value in response.items():
+                if field == "id":
+                    continue
+                if field == "mode":
+                    self.modes[device] = str(value)
+                elif isinstance(value, bool):
+                    self.values[(device, source, field)] = int(value)
+                elif isinstance(value, (int, float)):
+                    self.values[(device, source, field)] = value
+
+    def update_snapshot(self, device: str, snapshot: Snapshot, values: bool = True):
+        """
+        Store a snapshot of VenusAPIClient.get_snapshot(): the age and status of each method, and its fresh values
+
+        Args:
+            device: Device label, e.g. the battery IP address
+            snapshot: Snapshot of the device
+            values: Also store the fresh results, with the API method as source (default: True),
+                    False when they are already passed to update()
+        """
+        with self.lock:
+            for method, result in snapshot.results.items():
+                self.received[(device, method)] = (result.timestamp, result.status)
+        if values:
+            for method, result in snapshot.results.items():
+                if result.status == FRESH:
+                    self.update(device, method, result.result)
+
+    def add_client(self, device: str, client: VenusAPIClient):
+        """Export the request counters of a client"""
+        with self.lock:
+            self.clients[device] = client
+
+    def add_counter(self, name: str, device: str, getter, label: str = "metric", help_text: str = "",
+                    kind: str = "counter"):
+        """
+        Export a set of counters kept elsewhere, read at every scrape
+
+        Args:
+            name: Metric family name, "_total" is added to the samples of a counter
+            device: Device label
+            getter: Callable returning {label value: count}, must be safe to call from another thread
+            label: Name of the label that holds the keys of the getter result (default: "metric")
+            help_text: Description of the counter
+            kind: "counter" for values that only go up, "gauge" for values that also go down or are
+                  reset, e.g. daily totals (default: "counter")
+        """
+        if kind not in ("counter", "gauge"):
+            raise ValueError(f"kind {kind!r}, expected counter or gauge")
+        with self.lock:
+            self.counters[(name, device)] = (label, help_text, getter, kind)
+
+    def observe_cycle(self, device: str, seconds: float):
+        """Record the duration of one complete data collection cycle"""
+        with self.lock:
+            histogram = self.cycles.get(device)
+            if histogram is None:
+                histogram = self.cycles[device] = Histogram(CYCLE_BUCKETS)
+            histogram.observe(seconds)
+
+    def render(self) -> str:
+        """Build the OpenMetrics text exposition of the current snapshot"""
+        with self.lock:
+            values = dict(self.values)
+            modes = dict(self.modes)
+            clients = dict(self.clients)
+            cycles = {device: h.copy() for device, h in self.cycles.items()}
+            counters = dict(self.counters)
+            received = dict(self.received)
+
+        lines = []
+        by_field = {}
+        for (device, source, field), value in values.items():
+            by_field.setdefault(field, []).append((device, source, value))
+        for field in sorted(by_field):
+            name = f"{self.prefix}_{field}"
+            lines.append(f"# TYPE {name} gauge")
+            for device, source, value in by_field[field]:
+                lines.append(f'{name}{{device="{_escape(device)}",source="{source}"}} {_number(value)}')
+
+        if modes:
+            name = f"{self.prefix}_mode"
+            lines.append(f"# TYPE {name} info")
+            for device, mode in modes.items():
+                lines.append(f'{name}_info{{device="{_escape(device)}",mode="{_escape(mode)}"}} 1')
+
+        if received:
+            now = time.time()
+            name = "venus_snapshot_age_seconds"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"# UNIT {name} seconds")
+            lines.append(f"# HELP {name} Time since the last reply of the method")
+            for (device, method), (timestamp, status) in received.items():
+                if timestamp is not None:
+                    lines.append(f'{name}{{device="{_escape(device)}",method="{method}"}} {_number(now - timestamp)}')
+            name = "venus_snapshot_status"
+            lines.append(f"# TYPE {name} stateset")
+            lines.append(f"# HELP {name} Result of the method in the last snapshot")
+            for (device, method), (timestamp, status) in received.items():
+                for state in (FRESH, STALE, MISSING):
+                    lines.append(f'{name}{{device="{_escape(device)}",method="{method}",{name}="{state}"}} {int(status == state)}')
+
+        stats = {device: client.stats.snapshot() for device, client in clients.items()}
+        for counter, help_text in (("requests", "Requests sent, including retried requests once"),
+                                   ("failures", "Requests that returned no result"),
+                                   ("timeouts", "Attempts that timed out"),
+                                   ("retries", "Attempts after the first one"),
+                                   ("decode_errors", "Replies that were no valid JSON"),
+                                   ("bytes_sent", "UDP payload bytes sent"),
+                                   ("bytes_received", "UDP payload bytes received")):
+            name = f"venus_client_{counter}"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"# HELP {name} {help_text}")
+            for device, snapshot in stats.items():
+                for method, n in sorted(snapshot[counter].items()):
+                    lines.append(f'{name}_total{{device="{_escape(device)}",method="{method}"}} {n}')
+
+        name = "venus_client_rtt_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        lines.append(f"# UNIT {name} seconds")
+        for device, snapshot in stats.items():
+            for method, histogram in sorted(snapshot["rtt"].items()):
+                self._histogram(lines, name, f'device="{_escape(device)}",method="{method}"', histogram)
+
+        for name, attribute in (("venus_client_srtt_seconds", "srtt"), ("venus_client_rttvar_seconds", "rttvar")):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"# UNIT {name} seconds")
+            for device, client in clients.items():
+                value = getattr(client.rtt_estimator, attribute, None)
+                if value is not None:
+                    lines.append(f'{name}{{device="{_escape(device)}"}} {_number(value)}')
+        pacers = {device: client.pacer.snapshot() for device, client in clients.items() if client.pacer is not None}
+        if pacers:
+            for name, key, help_text in (("venus_pacer_rate", "rate", "Requests per second allowed by the request pacer"),
+                                         ("venus_pacer_depth", "depth", "Requests in flight allowed by the request pacer")):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"# HELP {name} {help_text}")
+                for device, pacer in pacers.items():
+                    lines.append(f'{name}{{device="{_escape(device)}"}} {_number(pacer[key])}')
+            name = "venus_pacer_losses"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"# HELP {name} Lost requests that lowered the pacer limits")
+            for device, pacer in pacers.items():
+                lines.append(f'{name}_total{{device="{_escape(device)}"}} {pacer["losses"]}')
+            name = "venus_pacer_wait_seconds"
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"# UNIT {name} seconds")
+            lines.append(f"# HELP {name} Time requests waited for the request pacer")
+            for device, pacer in pacers.items():
+                lines.append(f'{name}_total{{device="{_escape(device)}"}} {_number(pacer["wait_seconds"])}')
+
+        name = "venus_client_timeout_seconds"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"# UNIT {name} seconds")
+        for device, client in clients.items():
+            lines.append(f'{name}{{device="{_escape(device)}"}} {_number(client.attempt_timeout())}')
+
+        name = "venus_client_attempts"
+        lines.append(f"# TYPE {name} histogram")
+        for device, snapshot in stats.items():
+            for method, histogram in sorted(snapshot["attempts"].items()):
+                self._histogram(lines, name, f'device="{_escape(device)}",method="{method}"', histogram)
+
+        name = "venus_cycle_duration_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        lines.append(f"# UNIT {name} seconds")
+        for device, histogram in cycles.items():
+            self._histogram(lines, name, f'device="{_escape(device)}"', histogram)
+
+        families = {}
+        for (name, device), (label, help_text, getter, kind) in counters.items():
+            families.setdefault(name, []).append((device, label, help_text, getter, kind))
+        for name, members in sorted(families.items()):
+            kind = members[0][4]
+            lines.append(f"# TYPE {name} {kind}")
+            if members[0][2]:
+                lines.append(f"# HELP {name} {members[0][2]}")
+            sample = f"{name}_total" if kind == "counter" else name
+            for device, label, help_text, getter, _ in members:
+                for key, n in sorted(getter().items()):
+                    lines.append(f'{sample}{{device="{_escape(device)}",{label}="{_escape(key)}"}} {_number(n)}')
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def _histogram(self, lines, name: str, labels: str, histogram: Histogram):
+        for bound, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{labels},le="{_number(bound)}"}} {count}')
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+        lines.append(f"{name}_sum{{{labels}}} {_number(histogram.sum)}")
+
+    def start(self):
+        """Start serving /metrics in a background thread"""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Exporter: " + format % args)
+
+        self.server = ThreadingHTTPServer((self.address, self.port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="venus-exporter", daemon=True)
+        self.thread.start()
+        logger.info(f"Metrics exporter listening on {self.address}:{self.port}")
+
+    def stop(self):
+        """Stop the HTTP server"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.thread = None
@@ -0,0 +1,228 @@
+"""
+Venus data filters
+
+Streaming filters applied to the values received from the Marstek Venus before
+they are stored, so that bad readings never reach the database, and deadbands
+that decide which of the remaining values are worth writing at all.
+"""
+
+import logging
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Scale factor of the median absolute deviation to estimate the standard deviation of normal data
+MAD_SCALE = 1.4826
+
+
+class HampelFilter:
+    """
+    Rolling median / median absolute deviation (Hampel) outlier filter for one metric
+
+    A value is rejected when it lies outside the hard limits, or when it deviates more than
+    max(threshold * 1.4826 * MAD, min_deviation) from the median of the last `window` values.
+    A real step in the signal is accepted at its second sample: a rejected value is confirmed
+    when the next value lies within the same tolerance of it, and the window then restarts
+    from the new level. The window is kept sorted, so each sample costs O(window), a constant
+    for the small fixed window.
+    """
+
+    __slots__ = ("window", "threshold", "min_deviation", "low", "high",
+                 "samples", "ordered", "pending", "accepted", "rejected")
+
+    def __init__(self, window: int = 7, threshold: float = 5.0, min_deviation: float = 0.0,
+                 low: Optional[float] = None, high: Optional[float] = None):
+        """
+        Initialize filter
+
+        Args:
+            window: Number of recent values the median is taken over (default: 7)
+            threshold: Allowed deviation in estimated standard deviations (default: 5.0)
+            min_deviation: Deviation from the median that is always allowed (default: 0.0)
+            low: Values below this limit are always rejected (default: None = no limit)
+            high: Values above this limit are always rejected (default: None = no limit)
+        """
+        self.window = window
+        self.threshold = threshold
+        self.min_deviation = min_deviation
+        self.low = low
+        self.high = high
+        self.samples = deque()
+        self.ordered = []
+        self.pending = None
+        self.accepted = 0
+        self.rejected = 0
+
+    def _add(self, value: float):
+        if len(self.samples) == self.window:
+            old = self.samples.popleft()
+            del self.ordered[bisect_left(self.ordered, old)]
+        self.samples.append(value)
+        insort(self.ordered, value)
+
+    def accept(self, value: float) -> bool:
+        """Returns True if the value can be used, False if it is an outlier"""
+        if (self.low is not None and value < self.low) or (self.high is not None and value > self.high):
+            self.rejected += 1
+            return False
+        n = len(self.ordered)
+        if n < 3:
+            self._add(value)
+            self.accepted += 1
+            return True
+        median = self.ordered[n // 2]
+        mad = sorted(abs(x - median) for x in self.ordered)[n // 2]
+        tolerance = max(self.threshold * MAD_SCALE * mad, self.min_deviation)
+        pending = self.pending
+        if abs(value - median) <= tolerance:
+            self._add(value)
+        elif pending is not None and abs(value - pending) <= tolerance:
+            # level shift confirmed by two samples, start again from the new level
+            self.samples.clear()
+            self.ordered = []
+            self._add(pending)
+            self._add(value)
+        else:
+            self.pending = value  # kept out of the window, so spikes do not widen the tolerance
+            self.rejected += 1
+            return False
+        self.pending = None
+        self.accepted += 1
+        return True
+
+
+class OutlierFilter:
+    """Set of HampelFilters, one per metric, created from per-metric settings"""
+
+    def __init__(self, settings: Dict[str, Dict]):
+        """
+        Initialize filters
+
+        Args:
+            settings: metric name -> HampelFilter keyword arguments, metrics without settings are not filtered
+        """
+        self.filters = {metric: HampelFilter(**kwargs) for metric, kwargs in settings.items()}
+
+    def accept(self, metric: str, value, scale: float = 1) -> bool:
+        """
+        Check one value
+
+        Args:
+            metric: Metric name
+            value: Value as received, values that are not a number are not filtered
+            scale: Multiplier applied before the check, the settings are in scaled units (default: 1)
+
+        Returns:
+            True if the value can be used, False if it is an outlier
+        """
+        hampel = self.filters.get(metric)
+        if hampel is None or isinstance(value, bool) or not isinstance(value, (int, float)):
+            return True
+        if hampel.accept(value * scale):
+            return True
+        logger.info(f"Outlier rejected for {metric}: {value}")
+        return False
+
+    def rejected(self) -> Dict[str, int]:
+        """Number of rejected values per metric"""
+        return {metric: hampel.rejected for metric, hampel in self.filters.items()}
+
+
+class Deadband:
+    """
+    Publish decision for one metric: only significant changes, and at least every max_silence seconds
+
+    A numeric value is significant when it differs more than max(absolute, relative * |last|) from
+    the last published value, so a slow drift is published once it adds up. Other values (text,
+    flags) are significant when they changed. Each decision is O(1).
+    """
+
+    __slots__ = ("absolute", "relative", "max_silence", "last", "last_time", "published", "suppressed")
+
+    def __init__(self, absolute: float = 0.0, relative: float = 0.0, max_silence: Optional[float] = 300.0):
+        """
+        Initialize deadband
+
+        Args:
+            absolute: Change that is always significant, in the units of the metric (default: 0.0 = any change)
+            relative: Change relative to the last published value that is significant, e.g. 0.02 = 2% (default: 0.0)
+            max_silence: Seconds after which the value is published even without change (default: 300, None = never)
+        """
+        self.absolute = absolute
+        self.relative = relative
+        self.max_silence = max_silence
+        self.last = None
+        self.last_time = None
+        self.published = 0
+        self.suppressed = 0
+
+    def publish(self, value, now: float) -> bool:
+        """Returns True if the value should be published (and takes it as the last published value)"""
+        last = self.last
+        if last is None or (self.max_silence is not None and now - self.last_time >= self.max_silence):
+            significant = True
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                isinstance(last, (int, float)) and not isinstance(last, bool):
+            significant = abs(value - last) > max(self.absolute, self.relative * abs(last))
+        else:
+            significant = value != last
+        if significant:
+            self.last = value
+            self.last_time = now
+            self.published += 1
+        else:
+            self.suppressed += 1
+        return significant
+
+
+class DeadbandFilter:
+    """Set of Deadbands, one per metric, created on first use from per-metric settings"""
+
+    def __init__(self, settings: Dict[str, Dict], max_silence: Optional[float] = 300.0, enabled: bool = True):
+        """
+        Initialize filter
+
+        Args:
+            settings: metric name -> Deadband keyword arguments, other metrics are published when they change
+            max_silence: Default of the Deadbands, seconds after which a value is published anyway (default: 300)
+            enabled: False = publish every value (default: True)
+        """
+        self.settings = settings
+        self.max_silence = max_silence
+        self.enabled = enabled
+        self.deadbands = {}
+
+    def publish(self, metric: str, value, scale: float = 1, now: Optional[float] = None) -> bool:
+        """
+        Decide whether to publish one value
+
+        Args:
+            metric: Metric name
+            value: Value as received
+            scale: Multiplier applied to numbers before the check, the settings are in scaled units (default: 1)
+            now: time.monotonic() of the value (default: now)
+
+        Returns:
+            True if the value should be published
+        """
+        if not self.enabled:
+            return True
+        deadband = self.deadbands.get(metric)
+        if deadband is None:
+            kwargs = dict(self.settings.get(metric) or {})
+            kwargs.setdefault("max_silence", self.max_silence)
+            deadband = self.deadbands[metric] = Deadband(**kwargs)
+        if scale != 1 and isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = value * scale
+        return deadband.publish(value, time.monotonic() if now is None else now)
+
+    def forget(self, metric: str):
+        """Publish the next value of a metric in any case"""
+        self.deadbands.pop(metric, None)
+
+    def suppressed(self) -> Dict[str, int]:
+        """Number of values not published per metric"""
+        return {metric: deadband.suppressed for metric, deadband in self.deadbands.items()}
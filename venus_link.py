@@ -0,0 +1,215 @@
+"""
+Venus Wi-Fi link monitor
+
+Follows the quality of the Wi-Fi link of a Marstek Venus: the signal strength
+(rssi of Wifi.GetStatus, polled at a low rate) and the share of request attempts
+that time out (from the ClientStats of the VenusAPIClient). The two are
+correlated, so a diagnosis can tell losses caused by a weak signal from a
+battery that does not answer at all with a good signal (Open API switched off,
+battery offline). From the link level a poll schedule follows: on a weak link
+the optional methods are requested less often and the interval is stretched,
+while EM status and mode keep priority.
+"""
+
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+# Link levels, from best to worst
+GOOD = "good"
+WEAK = "weak"
+POOR = "poor"
+DOWN = "down"
+LEVELS = (GOOD, WEAK, POOR, DOWN)
+
+# Poll schedule per link level: (interval factor, optional methods every n cycles, 0 = never)
+SCHEDULES = {GOOD: (1, 1), WEAK: (1, 2), POOR: (2, 4), DOWN: (4, 0)}
+
+# Methods that are always requested, in this order (the others are optional)
+PRIORITY_METHODS = ("EM.GetStatus", "ES.GetMode")
+
+
+def _correlation(pairs) -> Optional[float]:
+    """Pearson correlation coefficient of (x, y) pairs, None without variation"""
+    n = len(pairs)
+    if n < 3:
+        return None
+    mean_x = sum(x for x, _ in pairs) / n
+    mean_y = sum(y for _, y in pairs) / n
+    sxx = sum((x - mean_x) ** 2 for x, _ in pairs)
+    syy = sum((y - mean_y) ** 2 for _, y in pairs)
+    if sxx <= 0 or syy <= 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in pairs) / (sxx * syy) ** 0.5
+
+
+class LinkMonitor:
+    """Signal strength and request loss of one battery, the link level and the poll schedule that follows"""
+
+    def __init__(self, wifi_interval: float = 300, weak_rssi: float = -70, poor_rssi: float = -80,
+                 weak_loss: float = 0.05, poor_loss: float = 0.2, window: int = 10, samples: int = 48,
+                 recovery: int = 3):
+        """
+        Initialize monitor
+
+        Args:
+            wifi_interval: Seconds between Wifi.GetStatus requests (default: 300)
+            weak_rssi: Signal below this in dBm makes the link weak (default: -70)
+            poor_rssi: Signal below this in dBm makes the link poor (default: -80)
+            weak_loss: Share of attempts timing out from which the link is weak (default: 0.05)
+            poor_loss: Share of attempts timing out from which the link is poor (default: 0.2)
+            window: Number of data cycles over which the loss is counted (default: 10)
+            samples: Number of (rssi, loss) pairs kept for the correlation (default: 48)
+            recovery: Evaluations in a row at a better level before the link level goes up, also the number
+                      of cycles without any reply after which the link is down (default: 3)
+        """
+        self.wifi_interval = wifi_interval
+        self.weak_rssi = weak_rssi
+        self.poor_rssi = poor_rssi
+        self.weak_loss = weak_loss
+        self.poor_loss = poor_loss
+        self.recovery = recovery
+        self.cycles = deque(maxlen=window)   # (attempts, timeouts) per data cycle
+        self.pairs = deque(maxlen=samples)   # (rssi, loss since the previous rssi)
+        self.rssi = None
+        self.rssi_time = None                # time.time() of the last rssi
+        self.wifi_time = None                # time.time() of the last Wifi.GetStatus request
+        self.since_rssi = [0, 0]             # attempts and timeouts since the last rssi
+        self.level = GOOD
+        self.better = 0                      # evaluations in a row at a better level
+        self.cycle = 0
+
+    def wifi_due(self, now: Optional[float] = None) -> bool:
+        """True when Wifi.GetStatus should be requested in this cycle (marks it as requested)"""
+        now = time.time() if now is None else now
+        if self.wifi_interval <= 0:
+            return False
+        if self.wifi_time is not None and now - self.wifi_time < self.wifi_interval:
+            return False
+        self.wifi_time = now
+        return True
+
+    def update_rssi(self, rssi: float, now: Optional[float] = None):
+        """Store the rssi of a Wifi.GetStatus reply, paired with the loss since the previous one"""
+        attempts, timeouts = self.since_rssi
+        if attempts > 0:
+            self.pairs.append((float(rssi), timeouts / attempts))
+        self.since_rssi = [0, 0]
+        self.rssi = float(rssi)
+        self.rssi_time = time.time() if now is None else now
+
+    def update_stats(self, current: Dict, previous: Optional[Dict] = None):
+        """
+        Count the attempts and timeouts of one data cycle and evaluate the link level
+
+        Args:
+            current: ClientStats.snapshot() after the cycle
+            previous: ClientStats.snapshot() after the previous cycle (default: None = since the start)
+        """
+        previous = previous or {}
+
+        def total(counter):
+            return sum(current[counter].values()) - sum(previous.get(counter, {}).values())
+
+        attempts = total("requests") + total("retries")
+        timeouts = total("timeouts")
+        self.cycles.append((attempts, timeouts))
+        self.since_rssi[0] += attempts
+        self.since_rssi[1] += timeouts
+        self._evaluate()
+
+    def loss(self) -> Optional[float]:
+        """Share of the attempts of the last cycles that timed out, None without attempts"""
+        attempts = sum(a for a, _ in self.cycles)
+        return sum(t for _, t in self.cycles) / attempts if attempts else None
+
+    def correlation(self) -> Optional[float]:
+        """Correlation of rssi and loss, strongly negative when the losses follow the signal strength"""
+        return _correlation(self.pairs)
+
+    def _answered(self) -> bool:
+        """False when none of the last `recovery` cycles got a reply"""
+        recent = list(self.cycles)[-self.recovery:]
+        return any(timeouts < attempts for attempts, timeouts in recent)
+
+    def _evaluate(self):
+        loss = self.loss()
+        if self.cycles and not self._answered():
+            level = DOWN
+        elif (loss is not None and loss >= self.poor_loss) or (self.rssi is not None and self.rssi < self.poor_rssi):
+            level = POOR
+        elif (loss is not None and loss >= self.weak_loss) or (self.rssi is not None and self.rssi < self.weak_rssi):
+            level = WEAK
+        else:
+            level = GOOD
+        if LEVELS.index(level) >= LEVELS.index(self.level):
+            self.level = level  # worse at once
+            self.better = 0
+        else:
+            self.better += 1
+            if self.better >= self.recovery:
+                self.level = level  # better only after a few evaluations, no flapping
+                self.better = 0
+
+    def diagnosis(self) -> str:
+        """Short description of the link and the most likely cause of the losses"""
+        loss = self.loss()
+        correlation = self.correlation()
+        signal = f"signal {self.rssi:.0f} dBm" if self.rssi is not None else "signal unknown"
+        if self.cycles and not self._answered():
+            if self.rssi is not None and self.rssi >= self.weak_rssi:
+                return f"No reply with a good {signal}: Open API switched off or battery offline"
+            if self.rssi is not None:
+                return f"No reply, weak {signal}: battery out of Wi-Fi range"
+            return "No reply: check the connection and the Open API setting"
+        if loss is None or loss < self.weak_loss:
+            return f"OK, {signal}"
+        text = f"{loss * 100:.0f}% lost, {signal}"
+        if (self.rssi is not None and self.rssi < self.weak_rssi) or (correlation is not None and correlation <= -0.5):
+            return text + ": weak Wi-Fi signal"
+        return text + ": losses with a good signal, network or firmware"
+
+    def interval_factor(self) -> int:
+        """Data cycles are this many times further apart than configured"""
+        return SCHEDULES[self.level][0]
+
+    def methods(self, methods: Sequence[str]) -> List[str]:
+        """
+        The methods to request in the next cycle, priority methods first
+
+        Args:
+            methods: All methods of a full cycle
+
+        Returns:
+            The priority methods present in `methods`, plus the others when they are due at this link level
+        """
+        self.cycle += 1
+        every = SCHEDULES[self.level][1]
+        selected = [method for method in PRIORITY_METHODS if method in methods]
+        if every and self.cycle % every == 0:
+            selected += [method for method in methods if method not in PRIORITY_METHODS]
+        return selected
+
+    def values(self) -> Dict:
+        """Values for devices and metrics"""
+        loss = self.loss()
+        correlation = self.correlation()
+        values = {"link_level": self.level, "link_state": self.diagnosis()}
+        if self.rssi is not None:
+            values["rssi"] = self.rssi
+        if loss is not None:
+            values["link_loss"] = round(loss * 100, 1)
+        if correlation is not None:
+            values["rssi_loss_correlation"] = round(correlation, 2)
+        return values
+
+    def state(self) -> Dict:
+        """Values to be persisted, see restore()"""
+        return {"rssi": self.rssi, "rssi_time": self.rssi_time, "pairs": list(self.pairs)}
+
+    def restore(self, state: Dict):
+        if state.get("rssi") is not None:
+            self.rssi = float(state["rssi"])
+            self.rssi_time = state.get("rssi_time")
+        for rssi, loss in state.get("pairs", []):
+            self.pairs.append((float(rssi), float(loss)))
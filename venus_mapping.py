@@ -0,0 +1,257 @@
+"""
+Venus device mapping
+
+Loads the mapping of the Marstek Venus fields onto Domoticz devices from a
+versioned JSON file (devices.json) with named settings per field, applies the
+firmware quirks that match the battery model and firmware version and the
+overrides of the user, and compiles every field into a DeviceField. A field
+can have an expression that corrects the value received (flip a sign, fix a
+scale), e.g. "-value" or "value / 10 if value > 6000 else value". Expressions
+are checked against a small set of allowed operations and compiled into a
+function once, when the mapping is loaded, so converting a sample is one
+function call.
+
+Check a mapping with python -m venus_mapping devices.json [--overrides file].
+"""
+
+import argparse
+import ast
+import json
+import sys
+from typing import Any, Callable, Dict, List, Optional
+
+# Version of the devices.json layout this module reads
+MAPPING_VERSION = 1
+
+# Settings of a field, with their default when they are optional (None = required)
+FIELD_DEFAULTS = {"unit": None, "type": None, "subtype": None, "switchtype": 0, "options": {},
+                  "multiplier": 1, "name": None, "source": None, "expression": None}
+# Settings that quirks and user overrides may change, the others identify the Domoticz device
+OVERRIDABLE = ("switchtype", "options", "multiplier", "name", "expression")
+
+# Functions an expression may call, the only names besides "value"
+EXPRESSION_FUNCTIONS = {"abs": abs, "min": min, "max": max, "round": round, "int": int, "float": float}
+EXPRESSION_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call,
+                    ast.Name, ast.Load, ast.Constant,
+                    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.USub, ast.UAdd,
+                    ast.Not, ast.And, ast.Or, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+def compile_expression(text: str) -> Callable[[Any], Any]:
+    """
+    Compile an expression of the received value into a function
+
+    Args:
+        text: Python expression of `value`, using numbers, arithmetic, comparisons, "x if c else y",
+              and the functions abs, min, max, round, int and float
+
+    Returns:
+        Function of one argument, the value received
+
+    Raises:
+        ValueError: The expression is not valid or uses something that is not allowed
+    """
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"invalid expression {text!r}: {e.msg}") from None
+    for node in ast.walk(tree):
+        if not isinstance(node, EXPRESSION_NODES):
+            raise ValueError(f"{type(node).__name__} not allowed in expression {text!r}")
+        if isinstance(node, ast.Name) and node.id != "value" and node.id not in EXPRESSION_FUNCTIONS:
+            raise ValueError(f"unknown name {node.id!r} in expression {text!r}, use value")
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.func.id not in EXPRESSION_FUNCTIONS
+                                           or node.keywords):
+            raise ValueError(f"only {', '.join(EXPRESSION_FUNCTIONS)} can be called in expression {text!r}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f"only numbers allowed in expression {text!r}")
+    # the body becomes a lambda, compiled once; no builtins are reachable from it
+    function = ast.Expression(ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg="value")], kwonlyargs=[], kw_defaults=[], defaults=[]),
+        body=tree.body))
+    ast.fix_missing_locations(function)
+    return eval(compile(function, "<expression>", "eval"), {"__builtins__": {}, **EXPRESSION_FUNCTIONS})
+
+
+class DeviceField:
+    """A field of the battery and the Domoticz device that shows it"""
+    __slots__ = ("key", "unit", "type", "subtype", "switchtype", "options", "multiplier", "name", "source",
+                 "expression", "convert")
+
+    def __init__(self, key: str, unit: int, type: int, subtype: int, switchtype: int = 0, options: Optional[Dict] = None,
+                 multiplier: float = 1, name: str = "", source: str = "", expression: Optional[str] = None):
+        """
+        Initialize field
+
+        Args:
+            key: Field name, as received from the API (es_ prefix for the duplicate ES.GetStatus fields)
+            unit: Domoticz unit number, unique within the plugin
+            type: Domoticz device type
+            subtype: Domoticz device subtype
+            switchtype: Domoticz switch type (default: 0)
+            options: Domoticz device options (default: None = no options)
+            multiplier: Scale from the value received to the device value (default: 1)
+            name: Device name (the prefix of the hardware page is put in front)
+            source: Data source, e.g. "BAT", or a source calculated by the plugin
+            expression: Correction of the value received, see compile_expression() (default: None)
+        """
+        self.key = key
+        self.unit = int(unit)
+        self.type = int(type)
+        self.subtype = int(subtype)
+        self.switchtype = int(switchtype)
+        self.options = dict(options or {})
+        self.multiplier = multiplier
+        self.name = str(name)
+        self.source = str(source)
+        self.expression = expression
+        # None without expression, so the hot path can skip the call
+        self.convert = compile_expression(expression) if expression else None
+
+    def value(self, raw):
+        """The value received, corrected by the expression"""
+        return raw if self.convert is None else self.convert(raw)
+
+    def __repr__(self):
+        return (f"DeviceField({self.key!r}, unit={self.unit}, type={self.type}/{self.subtype}, "
+                f"multiplier={self.multiplier}, source={self.source!r}, expression={self.expression!r})")
+
+
+def load_devices(path: str) -> Dict:
+    """
+    Read a devices.json file
+
+    Raises:
+        OSError: The file cannot be read
+        ValueError: Not valid JSON, or of another version
+    """
+    with open(path) as f:
+        document = json.load(f)
+    if not isinstance(document, dict) or not isinstance(document.get("devices"), dict):
+        raise ValueError(f"{path}: no \"devices\" object")
+    if document.get("version") != MAPPING_VERSION:
+        raise ValueError(f"{path}: version {document.get('version')}, this plugin reads version {MAPPING_VERSION}")
+    return document
+
+
+def _version(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def matching_quirks(document: Dict, model: Optional[str] = None, version=None) -> List[Dict]:
+    """
+    The quirks of a devices.json document that apply to a battery
+
+    Each quirk may have "device" (model as reported by Marstek.GetDevice), "min_ver" and "max_ver" (firmware
+    version, both included), "note", and "fields" with the settings to change per field. A quirk with a
+    condition on the model or version does not apply when that is not known.
+    """
+    version = _version(version)
+    quirks = []
+    for quirk in document.get("quirks", []):
+        if "device" in quirk and quirk["device"] != model:
+            continue
+        if ("min_ver" in quirk or "max_ver" in quirk) and version is None:
+            continue
+        if "min_ver" in quirk and version < int(quirk["min_ver"]):
+            continue
+        if "max_ver" in quirk and version > int(quirk["max_ver"]):
+            continue
+        quirks.append(quirk)
+    return quirks
+
+
+def _override(specs: Dict[str, Dict], overrides: Dict, origin: str):
+    for key, changes in overrides.items():
+        if key not in specs:
+            raise ValueError(f"{origin}: unknown field {key!r}")
+        unknown = [setting for setting in changes if setting not in OVERRIDABLE]
+        if unknown:
+            raise ValueError(f"{origin}: {key} {unknown} cannot be changed, only {', '.join(OVERRIDABLE)}")
+        specs[key].update(changes)
+
+
+def compile_mapping(document: Dict, overrides: Optional[Dict] = None, model: Optional[str] = None,
+                    version=None) -> Dict[str, DeviceField]:
+    """
+    Compile the fields of a devices.json document
+
+    Args:
+        document: Document as returned by load_devices()
+        overrides: Settings to change per field, e.g. {"pv1_power": {"multiplier": 1}} (default: None)
+        model: Battery model, to select the quirks (default: None = only quirks without a model)
+        version: Firmware version, to select the quirks (default: None = only quirks without a version)
+
+    Returns:
+        DeviceField per field, in the order of the document
+
+    Raises:
+        ValueError: A field misses a setting, has an unknown setting or an invalid expression,
+                    or two fields have the same unit
+    """
+    specs = {}
+    for key, spec in document["devices"].items():
+        unknown = [setting for setting in spec if setting not in FIELD_DEFAULTS and setting != "note"]
+        if unknown:
+            raise ValueError(f"field {key}: unknown setting(s) {unknown}")
+        missing = [setting for setting, default in FIELD_DEFAULTS.items() if default is None and setting not in spec
+                   and setting != "expression"]
+        if missing:
+            raise ValueError(f"field {key}: missing setting(s) {missing}")
+        specs[key] = {setting: spec.get(setting, default) for setting, default in FIELD_DEFAULTS.items()}
+    for quirk in matching_quirks(document, model, version):
+        _override(specs, quirk.get("fields", {}), f"quirk {quirk.get('note', '')}".strip())
+    _override(specs, overrides or {}, "override")
+    fields = {}
+    units = {}
+    for key, spec in specs.items():
+        try:
+            field = DeviceField(key, **spec)
+        except ValueError as e:
+            raise ValueError(f"field {key}: {e}") from None
+        if field.unit in units:
+            raise ValueError(f"fields {units[field.unit]} and {key} have the same unit {field.unit}")
+        units[field.unit] = key
+        fields[key] = field
+    return fields
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point, see python -m venus_mapping --help"""
+    parser = argparse.ArgumentParser(prog="python -m venus_mapping",
+                                     description="Check a device mapping file and show the compiled fields")
+    parser.add_argument("file", nargs="?", default="devices.json", help="mapping file (default: devices.json)")
+    parser.add_argument("--overrides", help="JSON file with the changes per field, or plugin_config.json (its device_overrides)")
+    parser.add_argument("--device", help="battery model, to apply its quirks (e.g. VenusE)")
+    parser.add_argument("--ver", help="firmware version, to apply its quirks")
+    parser.add_argument("--test", metavar="FIELD=VALUE", action="append", default=[],
+                        help="show the conversion of a value received, e.g. ongrid_power=-300 (repeatable)")
+    args = parser.parse_args(argv)
+    try:
+        document = load_devices(args.file)
+        overrides = None
+        if args.overrides:
+            with open(args.overrides) as f:
+                overrides = json.load(f)
+            overrides = overrides.get("device_overrides", overrides)
+        fields = compile_mapping(document, overrides, args.device, args.ver)
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"{e}\n")
+        return 1
+    for field in fields.values():
+        print(f"{field.unit:>4}  {field.key:<26}{field.type:>4}/{field.subtype:<4}{field.multiplier:>8}  "
+              f"{field.source:<5}{field.name}" + (f"  [{field.expression}]" if field.expression else ""))
+    for spec in args.test:
+        key, _, raw = spec.partition("=")
+        if key not in fields:
+            sys.stderr.write(f"unknown field {key!r}\n")
+            return 1
+        print(f"{key}: {raw} -> {fields[key].value(float(raw))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""
+Venus schedule optimiser
+
+Plans the charging and discharging of the battery over 15 minute slots against
+an import/export price list and a forecast of the household power, and turns
+the plan into the (at most 10) manual mode periods of the Marstek Venus.
+
+The plan is found by dynamic programming over the discretized state of charge:
+for every slot, from the last to the first, the lowest cost to the end of the
+horizon is calculated for every state of charge. numpy is used when available,
+the pure Python version is fast enough for one or two days of slots.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:  # optional, only makes the planning faster
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# Length of a plan slot in seconds
+SLOT = 900
+# Number of manual mode periods of the Marstek Venus (time_num 0..9)
+MAX_PERIODS = 10
+# Power of the plan is rounded to this number of W
+POWER_ROUNDING = 10
+
+
+def load_tariff(path: str) -> List[Tuple[float, float, float]]:
+    """
+    Read a price file
+
+    CSV lines "start,import_price[,export_price]" (a header line is skipped), or JSON
+    {"prices": [{"start": ..., "price": ..., "export_price": ...}, ...]}. The start is an ISO
+    date/time (local time unless it has an offset) or a Unix timestamp. Each price is valid
+    until the next start, the last one for as long as the one before it. Without an export
+    price, exported energy is taken as worth the import price.
+
+    Returns:
+        Sorted list of (start timestamp, import price, export price) per kWh
+    """
+    if path.endswith(".json"):
+        with open(path) as f:
+            rows = [(item["start"], item["price"], item.get("export_price")) for item in json.load(f)["prices"]]
+    else:
+        with open(path, newline="") as f:
+            rows = [(row[0], row[1], row[2] if len(row) > 2 and row[2] != "" else None)
+                    for row in csv.reader(f) if row and not row[0].startswith("#")]
+        if rows and not _is_number(rows[0][1]):
+            rows = rows[1:]  # header
+    tariff = []
+    for start, price, export_price in rows:
+        if isinstance(start, (int, float)) or _is_number(start):
+            timestamp = float(start)
+        else:
+            timestamp = datetime.fromisoformat(str(start).replace("Z", "+00:00")).timestamp()
+        price = float(price)
+        tariff.append((timestamp, price, price if export_price is None else float(export_price)))
+    tariff.sort()
+    return tariff
+
+
+def _is_number(text) -> bool:
+    try:
+        float(text)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def tariff_slots(tariff: List[Tuple[float, float, float]], start: float, max_slots: int) -> Tuple[List[float], List[float]]:
+    """
+    Import and export price of the slots from `start`, up to the end of the price list
+
+    Returns:
+        (import prices, export prices), one per slot, at most max_slots long
+    """
+    if not tariff:
+        return [], []
+    last_length = tariff[-1][0] - tariff[-2][0] if len(tariff) > 1 else 3600
+    end = tariff[-1][0] + last_length
+    import_prices, export_prices = [], []
+    index = 0
+    slot_start = start
+    while len(import_prices) < max_slots and slot_start < end:
+        while index + 1 < len(tariff) and tariff[index + 1][0] <= slot_start:
+            index += 1
+        if tariff[index][0] > slot_start:
+            break  # no price known for this slot
+        import_prices.append(tariff[index][1])
+        export_prices.append(tariff[index][2])
+        slot_start += SLOT
+    return import_prices, export_prices
+
+
+class ScheduleOptimiser:
+    """Lowest cost charge/discharge plan of one battery"""
+
+    def __init__(self, capacity: float, charge_power: float = 1200, discharge_power: float = 800,
+                 min_soc: float = 10, max_soc: float = 100, efficiency: float = 0.95,
+                 soc_steps: int = 100, max_periods: int = MAX_PERIODS):
+        """
+        Initialize optimiser
+
+        Args:
+            capacity: Usable energy of the battery from 0 to 100% in Wh (rated_capacity)
+            charge_power: Maximum charging power in W (default: 1200)
+            discharge_power: Maximum discharging power in W (default: 800, maxOutputPower)
+            min_soc: Lowest state of charge in % the plan may use (default: 10)
+            max_soc: Highest state of charge in % (default: 100)
+            efficiency: Efficiency of charging, and of discharging (default: 0.95)
+            soc_steps: Number of steps the state of charge is divided into (default: 100)
+            max_periods: Maximum number of periods of the compressed plan (default: 10)
+        """
+        self.capacity = capacity
+        self.charge_power = charge_power
+        self.discharge_power = discharge_power
+        self.min_soc = min_soc
+        self.max_soc = max_soc
+        self.efficiency = efficiency
+        self.soc_steps = soc_steps
+        self.max_periods = max_periods
+        self.step_energy = capacity / soc_steps  # Wh per step
+        hours = SLOT / 3600
+        # change of the state of charge per slot in steps, with the power seen by the grid (positive = discharge)
+        self.actions = [(0, 0.0)]
+        step = 1
+        while step * self.step_energy / efficiency / hours <= charge_power:
+            self.actions.append((step, -step * self.step_energy / efficiency / hours))
+            step += 1
+        step = 1
+        while step * self.step_energy * efficiency / hours <= discharge_power:
+            self.actions.append((-step, step * self.step_energy * efficiency / hours))
+            step += 1
+
+    @staticmethod
+    def slot_cost(power: float, demand: float, import_price: float, export_price: float) -> float:
+        """Cost of one slot in which the battery delivers `power` W (negative = charging) and the house uses `demand` W"""
+        grid = (demand - power) * SLOT / 3600000  # kWh, positive = import
+        return grid * import_price if grid >= 0 else grid * export_price
+
+    def plan(self, soc: float, import_prices: List[float], export_prices: List[float],
+             demand: List[float], end_price: Optional[float] = None) -> List[float]:
+        """
+        Find the lowest cost plan
+
+        Args:
+            soc: Current state of charge in %
+            import_prices: Price per kWh of imported energy, one per slot
+            export_prices: Price per kWh of exported energy, one per slot
+            demand: Expected household power without the battery in W (negative = PV surplus), one per slot
+            end_price: Value per kWh of the energy left in the battery after the last slot
+                       (default: the average import price)
+
+        Returns:
+            Battery power per slot in W, positive = discharge, negative = charge
+        """
+        slots = len(import_prices)
+        if slots == 0:
+            return []
+        if end_price is None:
+            end_price = sum(import_prices) / slots
+        states = self.soc_steps + 1
+        start = min(max(int(round(soc / 100 * self.soc_steps)), 0), self.soc_steps)
+        low = min(int(round(self.min_soc / 100 * self.soc_steps)), start)
+        high = max(int(round(self.max_soc / 100 * self.soc_steps)), start)
+        costs = [[self.slot_cost(power, demand[t], import_prices[t], export_prices[t]) for _, power in self.actions]
+                 for t in range(slots)]
+
+        inf = float("inf")
+        # value of the energy left at the end: it saves buying that energy later
+        final = [-(s - low) * self.step_energy * self.efficiency / 1000 * end_price if low <= s <= high else inf
+                 for s in range(states)]
+        values = [None] * slots + [final]
+        if numpy is not None:
+            following = numpy.array(final)
+            for t in range(slots - 1, -1, -1):
+                best = numpy.full(states, inf)
+                for (change, _), cost in zip(self.actions, costs[t]):
+                    if change >= 0:
+                        numpy.minimum(best[:states - change], following[change:] + cost, out=best[:states - change])
+                    else:
+                        numpy.minimum(best[-change:], following[:states + change] + cost, out=best[-change:])
+                best[:low] = inf  # the plan stays within min_soc and max_soc in every slot
+                best[high + 1:] = inf
+                following = best
+                values[t] = best.tolist()
+        else:
+            for t in range(slots - 1, -1, -1):
+                following = values[t + 1]
+                best = [inf] * states
+                for (change, _), cost in zip(self.actions, costs[t]):
+                    if change >= 0:
+                        shifted = following[change:] + [inf] * change
+                    else:
+                        shifted = [inf] * -change + following[:states + change]
+                    best = list(map(min, best, [value + cost for value in shifted]))
+                best[:low] = [inf] * low  # the plan stays within min_soc and max_soc in every slot
+                best[high + 1:] = [inf] * (states - high - 1)
+                values[t] = best
+
+        # follow the cheapest path forward, keeping the battery idle when that is as cheap
+        powers = []
+        state = start
+        for t in range(slots):
+            following = values[t + 1]
+            best_change, best_power, best_total = 0, 0.0, inf
+            for (change, power), cost in zip(self.actions, costs[t]):
+                if low <= state + change <= high:
+                    total = cost + following[state + change]
+                    if total < best_total - 1e-9:
+                        best_change, best_power, best_total = change, power, total
+            state += best_change
+            powers.append(round(best_power / POWER_ROUNDING) * POWER_ROUNDING)
+        return powers
+
+    def periods(self, start: float, powers: List[float], import_prices: List[float],
+                export_prices: List[float], demand: List[float]) -> List[Dict]:
+        """
+        Compress a plan into at most max_periods periods of constant power
+
+        Consecutive slots with the same power form a period, periods do not cross midnight.
+        While there are too many, the change that costs least is made: two neighbouring
+        periods of the same day are merged into one with their average power, or a period is left out.
+
+        Args:
+            start: Timestamp of the first slot
+            powers, import_prices, export_prices, demand: as for plan()
+
+        Returns:
+            List of {"start": timestamp, "end": timestamp, "power": W}, slots without a period are idle
+        """
+        segments = []  # [first slot, last slot + 1, power, day of the year]
+        for t, power in enumerate(powers):
+            day = time.localtime(start + t * SLOT).tm_yday
+            if segments and segments[-1][1] == t and segments[-1][2] == power and segments[-1][3] == day:
+                segments[-1][1] = t + 1
+            elif power != 0:
+                segments.append([t, t + 1, power, day])
+
+        def cost(first, last, power):
+            return sum(self.slot_cost(power, demand[t], import_prices[t], export_prices[t]) -
+                       self.slot_cost(powers[t], demand[t], import_prices[t], export_prices[t])
+                       for t in range(first, last))
+
+        while len(segments) > self.max_periods:
+            best = None
+            for i, (first, last, power, day) in enumerate(segments):
+                extra = cost(first, last, 0)
+                if best is None or extra < best[0]:
+                    best = (extra, i, None)
+                if i + 1 < len(segments) and segments[i + 1][3] == day:
+                    end = segments[i + 1][1]
+                    energy = sum(powers[t] for t in range(first, end))
+                    average = round(energy / (end - first) / POWER_ROUNDING) * POWER_ROUNDING
+                    extra = cost(first, end, average)
+                    if extra < best[0]:
+                        best = (extra, i, average)
+            _, i, average = best
+            if average is None:
+                del segments[i]
+            else:
+                segments[i] = [segments[i][0], segments[i + 1][1], average, segments[i][3]]
+                del segments[i + 1]
+        return [{"start": start + first * SLOT, "end": start + last * SLOT, "power": power}
+                for first, last, power, _ in segments if power != 0]
+
+
+def manual_config(periods: List[Dict], max_periods: int = MAX_PERIODS) -> List[Dict]:
+    """
+    Manual mode settings of the periods, as keyword arguments of VenusAPIClient.set_manual_mode
+
+    Each period gets its own period number and only the week day it falls on; the remaining
+    period numbers are switched off.
+    """
+    result = []
+    for number, period in enumerate(periods[:max_periods]):
+        start = time.localtime(period["start"])
+        end = time.localtime(period["end"])
+        end_time = "23:59" if end.tm_yday != start.tm_yday else time.strftime("%H:%M", end)
+        result.append({"periodnr": number, "start_time": time.strftime("%H:%M", start), "end_time": end_time,
+                       "week_set": 1 << start.tm_wday, "power": int(period["power"]), "enable": 1})
+    for number in range(len(result), max_periods):
+        result.append({"periodnr": number, "start_time": "00:00", "end_time": "00:15",
+                       "week_set": 0, "power": 0, "enable": 0})
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point, see python -m venus_optimiser --help"""
+    parser = argparse.ArgumentParser(prog="python -m venus_optimiser",
+                                     description="Plan battery charging/discharging against a price file, output as JSON")
+    parser.add_argument("tariff", help="price file, CSV start,import_price[,export_price] or JSON")
+    parser.add_argument("--soc", type=float, required=True, help="current state of charge in %%")
+    parser.add_argument("--capacity", type=float, required=True, help="battery capacity in Wh (rated_capacity)")
+    parser.add_argument("--demand", type=float, default=0, help="household power without battery in W, used for all slots (default: 0)")
+    parser.add_argument("--profile", help="load profile file of the plugin (loadprofile.json), replaces --demand where known")
+    parser.add_argument("--charge-power", type=float, default=1200, help="maximum charging power in W (default: 1200)")
+    parser.add_argument("--discharge-power", type=float, default=800, help="maximum discharging power in W (default: 800)")
+    parser.add_argument("--min-soc", type=float, default=10, help="lowest state of charge in %% (default: 10)")
+    parser.add_argument("--efficiency", type=float, default=0.95, help="charge and discharge efficiency (default: 0.95)")
+    parser.add_argument("--hours", type=float, default=24, help="maximum planning horizon in hours (default: 24)")
+    parser.add_argument("--push", metavar="IP[:PORT]", help="also send the periods to this battery in manual mode")
+    args = parser.parse_args(argv)
+
+    start = time.time() // SLOT * SLOT
+    import_prices, export_prices = tariff_slots(load_tariff(args.tariff), start, int(args.hours * 3600 / SLOT))
+    demand = [args.demand] * len(import_prices)
+    if args.profile:
+        from venus_analytics import LoadProfile
+        profile = LoadProfile()
+        with open(args.profile) as f:
+            profile.restore(json.load(f))
+        demand = [args.demand if value is None else value for value in profile.forecast(start, len(import_prices))]
+    optimiser = ScheduleOptimiser(args.capacity, args.charge_power, args.discharge_power, args.min_soc,
+                                  efficiency=args.efficiency)
+    began = time.perf_counter()
+    powers = optimiser.plan(args.soc, import_prices, export_prices, demand)
+    periods = optimiser.periods(start, powers, import_prices, export_prices, demand)
+    seconds = time.perf_counter() - began
+    config = manual_config(periods)
+    output = {"start": start, "slots": len(powers), "seconds": round(seconds, 3), "numpy": numpy is not None,
+              "powers": powers, "periods": config}
+    if args.push:
+        from venus_api_v2 import VenusAPIClient, _parse_device
+        ip, port = _parse_device(args.push, 30000)
+        client = VenusAPIClient(ip, port)
+        output["pushed"] = [client.set_manual_mode(**settings) for settings in config]
+    print(json.dumps(output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
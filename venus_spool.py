@@ -0,0 +1,290 @@
+"""
+Venus store-and-forward spool
+
+A bounded queue of records on disk, for the readings that cannot be delivered
+while Domoticz or another sink is busy, restarting or down. Records are
+appended as compact JSON lines to segment files of a fixed size, and read
+back in order, in batches; a batch is only removed (committed) after it was
+delivered. The read position is kept in a cursor file, so a restart of the
+program continues where it stopped. When the spool reaches its maximum size
+the oldest segment is dropped and its records are counted, so the memory used
+stays small and the disk use bounded, also on a Raspberry Pi with an SD card.
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentSpool:
+    """Append-only segment files with a committed read position"""
+
+    def __init__(self, directory: str, name: str = "spool", segment_bytes: int = 256 * 1024,
+                 max_bytes: int = 16 * 1024 * 1024, fsync: bool = False):
+        """
+        Open a spool, the records of an earlier run are kept
+
+        Args:
+            directory: Folder of the segment files and the cursor, created when needed
+            name: Name of the files, several spools can share a folder (default: "spool")
+            segment_bytes: Size from which a new segment file is started (default: 256 kB)
+            max_bytes: Maximum size of all segments, beyond it the oldest segment is dropped (default: 16 MB)
+            fsync: Force every record to disk, safer at a power cut but more writes to an SD card (default: False)
+        """
+        self.directory = directory
+        self.name = name
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max(max_bytes, 2 * segment_bytes)
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.counts = {"appended": 0, "replayed": 0, "dropped": 0, "dropped_segments": 0, "corrupt": 0}
+        os.makedirs(directory, exist_ok=True)
+        self.segments = {}  # segment number -> size in bytes
+        prefix = name + "-"
+        for file_name in os.listdir(directory):
+            if file_name.startswith(prefix) and file_name.endswith(".jsonl"):
+                try:
+                    number = int(file_name[len(prefix):-len(".jsonl")])
+                except ValueError:
+                    continue
+                self.segments[number] = os.path.getsize(os.path.join(directory, file_name))
+        if self.segments:
+            self._repair_tail(max(self.segments))
+        self.cursor = self._load_cursor()  # (segment, offset) of the first record not yet delivered
+        self.peeked = None                  # end offsets of the records returned by read(), None after commit()
+        self.pending = self._count_pending()
+        self.file = None
+        self.current = max(self.segments) if self.segments else self.cursor[0]
+        if self.pending:
+            logger.info(f"Spool {name}: {self.pending} records of an earlier run to replay")
+
+    def _path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{self.name}-{number:08d}.jsonl")
+
+    def _repair_tail(self, number: int):
+        """Cut off a last record that was only partly written (power cut), new records start on a line of their own"""
+        path = self._path(number)
+        try:
+            with open(path, "rb+") as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    end = data.rfind(b"\n") + 1
+                    f.truncate(end)
+                    self.segments[number] = end
+                    self.counts["corrupt"] += 1
+                    logger.warning(f"Spool {self.name}: incomplete last record of segment {number} removed")
+        except OSError as e:
+            logger.warning(f"Spool {self.name}: could not check segment {number}: {e}")
+
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, self.name + ".cursor")) as f:
+                cursor = json.load(f)
+            segment, offset = int(cursor["segment"]), int(cursor["offset"])
+        except (OSError, ValueError, KeyError, TypeError):
+            segment, offset = (min(self.segments) if self.segments else 1), 0
+        if self.segments and segment not in self.segments:
+            later = [number for number in self.segments if number > segment]
+            segment, offset = (min(later) if later else max(self.segments) + 1), 0
+        return segment, offset
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, self.name + ".cursor")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"segment": self.cursor[0], "offset": self.cursor[1]}, f)
+        os.replace(path + ".tmp", path)
+
+    def _count_lines(self, number: int, offset: int = 0) -> int:
+        try:
+            with open(self._path(number), "rb") as f:
+                f.seek(offset)
+                return sum(1 for line in f if line.endswith(b"\n"))
+        except OSError:
+            return 0
+
+    def _count_pending(self) -> int:
+        segment, offset = self.cursor
+        return sum(self._count_lines(number, offset if number == segment else 0)
+                   for number in self.segments if number >= segment)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.pending
+
+    def size(self) -> int:
+        """Bytes in the segment files"""
+        with self.lock:
+            return sum(self.segments.values())
+
+    def append(self, record: Any) -> int:
+        """
+        Add a record at the end
+
+        Args:
+            record: Any value that can be written as JSON
+
+        Returns:
+            Number of older records dropped to make room (0 normally)
+        """
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self.lock:
+            if self.file is None or self.segments.get(self.current, 0) >= self.segment_bytes:
+                self._rotate()
+            self.file.write(line)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.segments[self.current] += len(line)
+            self.pending += 1
+            self.counts["appended"] += 1
+            return self._enforce_limit()
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.segments.get(self.current, 0) >= self.segment_bytes:
+            self.current += 1
+        self.file = open(self._path(self.current), "ab")
+        self.segments.setdefault(self.current, 0)
+
+    def _enforce_limit(self) -> int:
+        dropped = 0
+        while sum(self.segments.values()) > self.max_bytes and len(self.segments) > 1:
+            oldest = min(self.segments)
+            if oldest >= self.cursor[0]:
+                lost = self._count_lines(oldest, self.cursor[1] if oldest == self.cursor[0] else 0)
+            else:
+                lost = 0  # already delivered, waiting for commit to remove it
+            try:
+                os.remove(self._path(oldest))
+            except OSError as e:
+                logger.warning(f"Spool {self.name}: could not remove segment {oldest}: {e}")
+            del self.segments[oldest]
+            if self.cursor[0] <= oldest:
+                self.cursor = (min(self.segments), 0)
+                self.peeked = None  # a batch being delivered is no longer in the spool
+                self._save_cursor()
+            self.pending -= lost
+            dropped += lost
+            self.counts["dropped"] += lost
+            self.counts["dropped_segments"] += 1
+        if dropped:
+            logger.warning(f"Spool {self.name} full, {dropped} oldest records dropped")
+        return dropped
+
+    def read(self, max_records: int = 100) -> List[Any]:
+        """
+        The oldest records not yet committed, in the order they were appended
+
+        The records stay in the spool until commit() is called, a second read() returns the same records.
+        """
+        records = []
+        ends = []  # (segment, offset after the line, valid record) per line read
+        with self.lock:
+            segment, offset = self.cursor
+            for number in sorted(n for n in self.segments if n >= segment):
+                start = offset if number == segment else 0
+                try:
+                    with open(self._path(number), "rb") as f:
+                        f.seek(start)
+                        position = start
+                        for line in f:
+                            if not line.endswith(b"\n"):
+                                break  # record being written, or cut off by a crash
+                            position += len(line)
+                            try:
+                                records.append(json.loads(line))
+                                ends.append((number, position, True))
+                            except ValueError:
+                                ends.append((number, position, False))  # skipped, removed with the batch
+                            if len(records) >= max_records:
+                                break
+                except OSError as e:
+                    logger.warning(f"Spool {self.name}: could not read segment {number}: {e}")
+                if len(records) >= max_records:
+                    break
+            self.peeked = ends
+        return records
+
+    def commit(self, count: Optional[int] = None) -> bool:
+        """
+        Remove the records of the last read() that were delivered
+
+        Args:
+            count: Number of records delivered, from the start of the batch (default: None = all of them)
+
+        Returns:
+            False when nothing was read, or the records were dropped in the meantime
+        """
+        with self.lock:
+            if not self.peeked:
+                return False
+            ends = self.peeked
+            if count is not None:
+                # the first `count` records, with the corrupt lines before them
+                valid = 0
+                for index, (_, _, ok) in enumerate(ends):
+                    if valid == count:
+                        ends = ends[:index]
+                        break
+                    valid += ok
+            if not ends:
+                return True
+            self.cursor = ends[-1][:2]
+            self.pending -= len(ends)
+            replayed = sum(1 for _, _, ok in ends if ok)
+            self.counts["replayed"] += replayed
+            self.counts["corrupt"] += len(ends) - replayed
+            self.peeked = None
+            # segments read to the end and not written to anymore are removed
+            for number in sorted(self.segments):
+                if number < self.cursor[0] or (number == self.cursor[0] and number != self.current
+                                               and self.cursor[1] >= self.segments[number]):
+                    try:
+                        os.remove(self._path(number))
+                    except OSError:
+                        pass
+                    del self.segments[number]
+                else:
+                    break
+            if not self.segments or self.cursor[0] not in self.segments:
+                self.cursor = (min(self.segments) if self.segments else self.current, 0)
+            self._save_cursor()
+            return True
+
+    def clear(self) -> int:
+        """Drop all records, returns the number of records that were not delivered"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            for number in list(self.segments):
+                try:
+                    os.remove(self._path(number))
+                except OSError as e:
+                    logger.warning(f"Spool {self.name}: could not remove segment {number}: {e}")
+            self.segments = {}
+            self.current += 1
+            self.cursor = (self.current, 0)
+            self.peeked = None
+            lost, self.pending = self.pending, 0
+            self.counts["dropped"] += lost
+            self._save_cursor()
+            return lost
+
+    def stats(self) -> Dict[str, int]:
+        """Records appended, replayed, dropped (and segments dropped), corrupt lines skipped, records and bytes waiting"""
+        with self.lock:
+            return dict(self.counts, pending=self.pending, bytes=sum(self.segments.values()))
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self._save_cursor()
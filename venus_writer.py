@@ -0,0 +1,403 @@
+"""
+Venus Domoticz writer
+
+Sends device updates and notifications to the Domoticz JSON API
+(json.htm) from a background thread, over one keep-alive requests.Session
+with timeouts. Callers only put the request in a queue, so a slow or hanging
+Domoticz web server never blocks the polling of the battery. Device updates
+waiting in the queue are coalesced per idx (the latest value wins), and the
+queue is bounded: when it is full the oldest device update is dropped and
+counted. With a spool (venus_spool.SegmentSpool) the device updates are not
+lost while Domoticz is down or restarting: after a failed request they are
+written to the spool on disk, every value in the order it was queued, and
+replayed in batches when Domoticz answers again, before the newer updates, so
+counters and history stay complete. Used by the Domoticz plugin for its
+notifications, and by programs outside Domoticz that write battery values to
+Domoticz devices, see python -m venus_writer --help.
+"""
+
+import argparse
+import itertools
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from venus_spool import SegmentSpool
+
+logger = logging.getLogger(__name__)
+
+UPDATE = "udevice"
+NOTIFY = "sendnotification"
+
+
+class DomoticzWriter:
+    """Queue of Domoticz JSON API requests, sent in the background over a pooled keep-alive session"""
+
+    def __init__(self, url: str = "http://127.0.0.1:8080", username: Optional[str] = None,
+                 password: Optional[str] = None, timeout: Tuple[float, float] = (2, 5), queue_size: int = 1000,
+                 batch_size: int = 50, retries: int = 2, max_backoff: float = 30,
+                 spool: Optional[SegmentSpool] = None):
+        """
+        Initialize writer, call start() before queueing requests
+
+        Args:
+            url: Base URL of the Domoticz web server (default: http://127.0.0.1:8080)
+            username: User name for basic authentication (default: None = no authentication)
+            password: Password for basic authentication (default: None)
+            timeout: Connect and read timeout in seconds of each request (default: (2, 5))
+            queue_size: Maximum number of requests waiting, the oldest device update is dropped
+                        beyond it (default: 1000)
+            batch_size: Maximum number of requests sent back to back over the open connection
+                        before the queue is looked at again (default: 50)
+            retries: Extra attempts of a notification that failed (default: 2), device updates are
+                     not retried, a newer value follows
+            max_backoff: Longest wait in seconds after failed requests (default: 30)
+            spool: Spool that keeps the device updates on disk while Domoticz cannot be reached, and
+                   replays them in order (default: None = the updates of that time are dropped)
+        """
+        self.url = url.rstrip("/") + "/json.htm"
+        self.timeout = timeout
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.retries = retries
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        if username:
+            self.session.auth = (username, password or "")
+        self.pending = OrderedDict()  # key -> (params, attempts), device updates keyed by idx
+        self.sequence = itertools.count()
+        self.wakeup = threading.Condition()
+        self.busy = False             # a batch is being sent
+        self.running = False
+        self.thread = None
+        self.backoff = 0.0
+        self.spool = spool
+        self.counts = {"sent": 0, "failed": 0, "coalesced": 0, "dropped": 0, "retried": 0, "spooled": 0, "replayed": 0}
+
+    def start(self):
+        """Start the background thread that sends the queued requests"""
+        with self.wakeup:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="domoticz-writer", daemon=True)
+        self.thread.start()
+
+    def close(self, timeout: float = 2.0):
+        """Send what is still queued within `timeout` seconds, then stop the thread and close the session
+
+        Device updates still in the spool stay there, they are sent after the next start().
+        """
+        self.flush(timeout)
+        with self.wakeup:
+            self.running = False
+            self.wakeup.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        self.session.close()
+        if self.spool is not None:
+            self._spill()
+            self.spool.close()
+
+    def update_device(self, idx: int, nvalue: int = 0, svalue: str = "") -> bool:
+        """
+        Queue a device update (param=udevice), replacing an update of the same device that was not sent yet
+
+        While the spool holds updates that were not delivered, the update is added to the spool instead.
+
+        Args:
+            idx: Domoticz device idx
+            nvalue: Numeric value (default: 0)
+            svalue: String value, e.g. "55" or "power;energy" (default: "")
+
+        Returns:
+            True when queued, False when the writer is not running
+        """
+        params = {"type": "command", "param": UPDATE, "idx": int(idx), "nvalue": int(nvalue), "svalue": str(svalue)}
+        return self._put((UPDATE, int(idx)), params)
+
+    def notify(self, subject: str, body: str = "", priority: Optional[int] = None) -> bool:
+        """
+        Queue a notification (param=sendnotification) over the notification systems set up in Domoticz
+
+        Args:
+            subject: Subject of the notification
+            body: Text of the notification (default: "")
+            priority: Domoticz notification priority (default: None = Domoticz default)
+
+        Returns:
+            True when queued, False when the writer is not running
+        """
+        params = {"type": "command", "param": NOTIFY, "subject": subject, "body": body}
+        if priority is not None:
+            params["priority"] = int(priority)
+        return self._put((NOTIFY, next(self.sequence)), params)
+
+    def _spooling(self) -> bool:
+        """Device updates go to the spool while it holds updates that were not delivered"""
+        return self.spool is not None and len(self.spool) > 0
+
+    def _put(self, key, params: Dict) -> bool:
+        with self.wakeup:
+            if not self.running:
+                return False
+            if key[0] == UPDATE and self._spooling():
+                self._spool_update(params)  # after the older updates, in order
+                self.wakeup.notify()
+                return True
+            if key in self.pending:
+                del self.pending[key]
+                self.counts["coalesced"] += 1
+            elif len(self.pending) >= self.queue_size:
+                updates = [k for k in self.pending if k[0] == UPDATE]
+                if not updates and key[0] == UPDATE:
+                    self.counts["dropped"] += 1
+                    return True
+                del self.pending[updates[0] if updates else next(iter(self.pending))]
+                self.counts["dropped"] += 1
+            self.pending[key] = (params, 0)
+            self.wakeup.notify()
+        return True
+
+    def _spool_update(self, params: Dict):
+        """Write a device update to the spool, call with self.wakeup held"""
+        self.counts["dropped"] += self.spool.append({"t": round(time.time(), 1), "p": params})
+        self.counts["spooled"] += 1
+
+    def _spill(self):
+        """Move the queued device updates to the spool, in order, the notifications stay queued"""
+        with self.wakeup:
+            for key in [k for k in self.pending if k[0] == UPDATE]:
+                self._spool_update(self.pending.pop(key)[0])
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until the queue and the spool are empty, True when they are empty within `timeout` seconds"""
+        end = time.monotonic() + timeout
+        with self.wakeup:
+            while (self.pending or self.busy or self._spooling()) and self.running:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.wakeup.wait(remaining)
+            return not self.pending and not self._spooling()
+
+    def queued(self) -> int:
+        with self.wakeup:
+            return len(self.pending)
+
+    def backlog(self) -> int:
+        """Requests not delivered yet, queued in memory and in the spool"""
+        with self.wakeup:
+            return len(self.pending) + (len(self.spool) if self.spool is not None else 0)
+
+    def stats(self) -> Dict[str, int]:
+        """Requests sent, failed, coalesced, dropped, retried, spooled and replayed, and the number waiting"""
+        with self.wakeup:
+            return dict(self.counts, queued=len(self.pending),
+                        spool=len(self.spool) if self.spool is not None else 0)
+
+    def _run(self):
+        while True:
+            with self.wakeup:
+                self.busy = False
+                self.wakeup.notify_all()  # flush() waiters
+                while self.running and not self.pending and not self._spooling():
+                    self.wakeup.wait()
+                if not self.running:
+                    return
+                self.busy = True
+                replay = self._spooling() and not self.pending  # notifications first, only they stay queued
+            if replay:
+                if not self._replay():
+                    self._back_off()
+                continue
+            with self.wakeup:
+                batch = []
+                while self.pending and len(batch) < self.batch_size:
+                    batch.append(self.pending.popitem(last=False))
+                self.busy = True
+            failed = False
+            unsent = []  # (key, params, attempts) to queue again, in order
+            for key, (params, attempts) in batch:
+                if failed:
+                    unsent.append((key, params, attempts))  # do not hammer a server that just failed
+                    continue
+                if self._send(params):
+                    self.backoff = 0.0
+                else:
+                    failed = True
+                    if key[0] == UPDATE and self.spool is not None:
+                        unsent.append((key, params, attempts))
+                    elif key[0] == NOTIFY and attempts < self.retries:
+                        unsent.append((key, params, attempts + 1))
+                        with self.wakeup:
+                            self.counts["retried"] += 1
+            if failed:
+                if self.spool is not None:
+                    # the updates of this batch first, then those queued meanwhile
+                    with self.wakeup:
+                        for key, params, _ in unsent:
+                            if key[0] == UPDATE:
+                                self._spool_update(params)
+                    unsent = [item for item in unsent if item[0][0] != UPDATE]
+                    self._spill()
+                self._requeue(unsent)
+                self._back_off()
+
+    def _back_off(self):
+        """Wait before the next attempt, longer after each failure"""
+        self.backoff = min(self.max_backoff, max(1.0, self.backoff * 2))
+        with self.wakeup:
+            self.busy = False
+            self.wakeup.notify_all()
+            self.wakeup.wait_for(lambda: not self.running, self.backoff)
+
+    def _replay(self) -> bool:
+        """Send the oldest batch of the spool in order, False when Domoticz failed"""
+        records = self.spool.read(self.batch_size)
+        delivered = 0
+        for record in records:
+            if isinstance(record, dict) and isinstance(record.get("p"), dict):
+                if not self._send(record["p"]):
+                    break
+            else:
+                logger.warning(f"Spool {self.spool.name}: record without request skipped")
+            delivered += 1
+        committed = self.spool.commit(delivered if delivered < len(records) else None)  # also skips corrupt lines
+        with self.wakeup:
+            self.counts["replayed"] += delivered
+        if delivered < len(records):
+            return False
+        self.backoff = 0.0
+        if not records and not committed and self._spooling():
+            # counted as waiting but nothing left to read, do not keep trying
+            with self.wakeup:
+                self.counts["dropped"] += self.spool.clear()
+        return True
+
+    def _requeue(self, items: List[Tuple]):
+        """Put (key, params, attempts) back at the front of the queue, in their order"""
+        with self.wakeup:
+            for key, params, attempts in reversed(items):
+                if key not in self.pending:  # a newer update of the same device wins
+                    self.pending[key] = (params, attempts)
+                    self.pending.move_to_end(key, last=False)
+
+    def _send(self, params: Dict) -> bool:
+        try:
+            response = self.session.get(self.url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            status = response.json().get("status")
+            if status != "OK":
+                raise ValueError(f"status {status}")
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Domoticz {params['param']} failed: {e}")
+            with self.wakeup:
+                self.counts["failed"] += 1
+            return False
+        with self.wakeup:
+            self.counts["sent"] += 1
+        return True
+
+
+def _parse_map(specs: List[str]) -> Dict[Tuple[str, str], int]:
+    """method.field=idx specifications, e.g. em.total_power=123"""
+    mapping = {}
+    for spec in specs:
+        name, _, idx = spec.partition("=")
+        method, _, field = name.partition(".")
+        if not field or not idx.isdigit():
+            raise ValueError(f"invalid mapping {spec!r}, expected method.field=idx")
+        mapping[(method, field)] = int(idx)
+    return mapping
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point, see python -m venus_writer --help"""
+    from venus_api_v2 import CLI_METHODS, VenusAPIClient, _parse_device, _poll_device, _emit
+
+    parser = argparse.ArgumentParser(prog="python -m venus_writer",
+                                     description="Write to Domoticz over its JSON API, outside the plugin")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="Domoticz web server (default: http://127.0.0.1:8080)")
+    parser.add_argument("--username", help="Domoticz user name")
+    parser.add_argument("--password", help="Domoticz password")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("update", help="update one device")
+    p.add_argument("idx", type=int, help="Domoticz device idx")
+    p.add_argument("svalue", help="string value, e.g. 55 or 300;12345")
+    p.add_argument("--nvalue", type=int, default=0, help="numeric value (default: 0)")
+    p = sub.add_parser("notify", help="send a notification")
+    p.add_argument("subject", help="subject")
+    p.add_argument("body", nargs="?", default="", help="text")
+    p = sub.add_parser("forward", help="poll a battery and write its values to Domoticz devices")
+    p.add_argument("device", help="battery as ip or ip:port")
+    p.add_argument("--map", action="append", default=[], metavar="METHOD.FIELD=IDX", required=True,
+                   help=f"write a field to a device, e.g. em.total_power=123 (repeatable), methods: {', '.join(sorted(CLI_METHODS))}")
+    p.add_argument("--interval", type=float, default=10, help="seconds between polls (default: 10)")
+    p.add_argument("--count", type=int, default=0, help="number of polls, 0 = until interrupted (default: 0)")
+    p.add_argument("--port", type=int, default=30000, help="default UDP port (default: 30000)")
+    p.add_argument("--spool", metavar="DIR", help="keep the updates in this folder while Domoticz is down, "
+                                                  "and send them when it is back (default: no spool)")
+    p.add_argument("--spool-mb", type=float, default=16, help="maximum size of the spool in MB (default: 16)")
+    args = parser.parse_args(argv)
+
+    spool = None
+    if getattr(args, "spool", None):
+        spool = SegmentSpool(args.spool, "domoticz", max_bytes=int(args.spool_mb * 1024 * 1024))
+    writer = DomoticzWriter(args.url, args.username, args.password, spool=spool)
+    writer.start()
+    try:
+        if args.command == "update":
+            writer.update_device(args.idx, args.nvalue, args.svalue)
+        elif args.command == "notify":
+            writer.notify(args.subject, args.body)
+        else:
+            try:
+                mapping = _parse_map(args.map)
+            except ValueError as e:
+                sys.stderr.write(f"{e}\n")
+                return 2
+            methods = sorted({method for method, _ in mapping})
+            unknown = [m for m in methods if m not in CLI_METHODS]
+            if unknown:
+                sys.stderr.write(f"Unknown method(s) {unknown}, choose from {sorted(CLI_METHODS)}\n")
+                return 2
+            ip, port = _parse_device(args.device, args.port)
+            client = VenusAPIClient(ip, port)
+            cycle = 0
+            next_cycle = time.monotonic()
+            try:
+                while args.count == 0 or cycle < args.count:
+                    record = _poll_device(client, methods, time.monotonic() + args.interval)
+                    for (method, field), idx in mapping.items():
+                        result = record.get(method)
+                        if result is not None and field in result:
+                            value = result[field]
+                            writer.update_device(idx, 0, int(value) if isinstance(value, bool) else value)
+                    _emit(dict(record, writer=writer.stats()))
+                    cycle += 1
+                    next_cycle += args.interval
+                    delay = next_cycle - time.monotonic()
+                    if delay > 0 and (args.count == 0 or cycle < args.count):
+                        time.sleep(delay)
+            finally:
+                client.close()
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        writer.close(timeout=10)
+    stats = writer.stats()
+    _emit(stats)
+    if spool is not None:  # failures are fine as long as the spool delivered everything later
+        return 0 if stats["dropped"] == 0 and stats["queued"] == 0 and stats["spool"] == 0 else 1
+    return 0 if stats["failed"] == 0 and stats["queued"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())